@@ -0,0 +1,193 @@
+import asyncio
+from collections import deque
+from functools import partial
+from typing import Callable, Optional, Union
+
+from .constants import *
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter, check_uncompressed
+from .blocking_io import BUFFER_SIZE, check_buffer_size, check_stream_version
+from .bytes_utils import clear_secret
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'encrypt_stream',
+    'decrypt_stream',
+)
+
+
+if hasattr(asyncio, 'get_running_loop'):
+    _get_running_loop = asyncio.get_running_loop
+else:
+    _get_running_loop = asyncio.get_event_loop  # The running one when called from a coroutine.
+
+
+async def encrypt_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: bytes,
+                         buffer_size: int = BUFFER_SIZE, version: int = 1,
+                         offload_size: Optional[int] = None) \
+        -> Union[Encrypter, SegmentedEncrypter]:
+    """
+    Encrypts everything from the reader into the writer, waiting for the writer to drain after
+    every chunk. Chunks of at least offload_size bytes are processed in the default executor,
+    so the event loop is not blocked by the cipher. The writer is neither closed nor EOF-ed.
+    """
+    check_buffer_size(buffer_size)
+    if check_stream_version(version) == 2:
+        return await _encrypt_segments(reader, writer, key, offload_size)
+    chunk = await _read_chunk(reader, buffer_size)
+    encrypter = Encrypter(key)
+    writer.write(encrypter.initialize())
+    while chunk:
+        writer.write(await _process(encrypter.process_chunk, chunk, offload_size))
+        await writer.drain()
+        chunk = await _read_chunk(reader, buffer_size)
+    writer.write(encrypter.finalize())
+    await writer.drain()
+    return encrypter
+
+
+async def decrypt_stream(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: bytes,
+                         buffer_size: int = BUFFER_SIZE, offload_size: Optional[int] = None) \
+        -> Union[Decrypter, SegmentedDecrypter]:
+    """
+    Decrypts a stream of any version from the reader into the writer.
+    See encrypt_stream() for the backpressure and offloading behavior.
+    Every decrypted chunk is wiped once the writer transport has sent it, so it returns only after
+    everything is sent. On errors and cancellation the unsent chunks are wiped right away.
+    """
+    check_buffer_size(buffer_size)
+    writer = _PlaintextWriter(writer)
+    try:
+        decrypter = await _decrypt_stream(reader, writer, key, buffer_size, offload_size)
+        await writer.flush()
+        return decrypter
+    finally:
+        writer.clear()
+
+
+async def _decrypt_stream(reader: asyncio.StreamReader, writer: '_PlaintextWriter', key: bytes,
+                          buffer_size: int, offload_size: Optional[int]) \
+        -> Union[Decrypter, SegmentedDecrypter]:
+    header = await _read_chunk(reader, STREAM_SIGNATURE_LENGTH)
+    if header == STREAM_V2_SIGNATURE:
+        decrypter = SegmentedDecrypter(key)
+        header += await _read_chunk(reader, STREAM_V2_HEADER_LENGTH - len(header))
+        if len(header) != STREAM_V2_HEADER_LENGTH:
+            raise ValueError('Not enough data.')
+        decrypter.initialize(header)
+        check_uncompressed(decrypter)
+        return await _decrypt_segments(reader, writer, decrypter, offload_size)
+    decrypter = Decrypter(key)
+    header += await _read_chunk(reader, STREAM_HEADER_LENGTH - len(header))
+    if len(header) != STREAM_HEADER_LENGTH:
+        raise ValueError('Not enough data.')
+    decrypter.initialize(header)
+    prev_chunk = await _read_chunk(reader, buffer_size)
+    next_chunk = await _read_chunk(reader, buffer_size) if len(prev_chunk) == buffer_size else b''
+    while len(next_chunk) == buffer_size:
+        await writer.write(await _process(decrypter.process_chunk, prev_chunk, offload_size))
+        prev_chunk, next_chunk = next_chunk, await _read_chunk(reader, buffer_size)
+    await writer.write(decrypter.finalize(prev_chunk + next_chunk))
+    return decrypter
+
+
+async def _encrypt_segments(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, key: bytes,
+                            offload_size: Optional[int]) -> SegmentedEncrypter:
+    chunk = await _read_chunk(reader, SEGMENT_PAYLOAD_LENGTH)
+    encrypter = SegmentedEncrypter(key)
+    writer.write(encrypter.initialize())
+    index = 0
+    while len(chunk) == SEGMENT_PAYLOAD_LENGTH:
+        next_chunk = await _read_chunk(reader, SEGMENT_PAYLOAD_LENGTH)
+        if not next_chunk:
+            break
+        writer.write(await _process(partial(encrypter.encrypt_segment, index), chunk, offload_size))
+        await writer.drain()
+        index += 1
+        chunk = next_chunk
+    writer.write(encrypter.finalize(index, chunk))
+    await writer.drain()
+    return encrypter
+
+
+async def _decrypt_segments(reader: asyncio.StreamReader, writer: '_PlaintextWriter',
+                            decrypter: SegmentedDecrypter, offload_size: Optional[int]) \
+        -> SegmentedDecrypter:
+    index = 0
+    prev_chunk = await _read_chunk(reader, SEGMENT_LENGTH)
+    next_chunk = await _read_chunk(reader, SEGMENT_LENGTH) \
+        if len(prev_chunk) == SEGMENT_LENGTH else b''
+    while len(next_chunk) == SEGMENT_LENGTH:
+        await writer.write(await _process(partial(decrypter.decrypt_segment, index), prev_chunk,
+                                          offload_size))
+        index += 1
+        prev_chunk, next_chunk = next_chunk, await _read_chunk(reader, SEGMENT_LENGTH)
+    if len(next_chunk) >= MIN_FINAL_SEGMENT_LENGTH:
+        await writer.write(await _process(partial(decrypter.decrypt_segment, index), prev_chunk,
+                                          offload_size))
+        index += 1
+        prev_chunk, next_chunk = next_chunk, b''
+    await writer.write(decrypter.finalize(index, prev_chunk + next_chunk))
+    return decrypter
+
+
+class _PlaintextWriter:
+    """
+    Writes decrypted chunks and wipes each one as soon as the transport has sent it, since a
+    transport may keep referencing written data instead of copying it. The write buffer holds
+    the most recently written bytes, so every chunk which ends before them has been sent.
+    """
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self._writer = writer
+        self._written_length = 0
+        self._pending = deque()
+
+    async def write(self, chunk: MutableBytes) -> None:
+        self._writer.write(chunk)
+        self._written_length += len(chunk)
+        self._pending.append((self._written_length, chunk))
+        await self._writer.drain()
+        self._clear_sent()
+
+    async def flush(self) -> None:
+        """Waits until the transport has sent everything, then wipes the remaining chunks."""
+        transport = self._writer.transport
+        if transport is not None and transport.get_write_buffer_size():
+            # With no high-water mark the protocol resumes writing only once the buffer is empty.
+            low, high = transport.get_write_buffer_limits()
+            transport.set_write_buffer_limits(0)
+            try:
+                await self._writer.drain()
+            finally:
+                transport.set_write_buffer_limits(high, low)
+        self._clear_sent()
+
+    def clear(self) -> None:
+        """Wipes the remaining chunks, whether sent or not."""
+        while self._pending:
+            clear_secret(self._pending.popleft()[1])
+
+    def _clear_sent(self) -> None:
+        transport = self._writer.transport
+        buffered_length = transport.get_write_buffer_size() if transport is not None else 0
+        while self._pending and self._pending[0][0] <= self._written_length - buffered_length:
+            clear_secret(self._pending.popleft()[1])
+
+
+async def _read_chunk(reader: asyncio.StreamReader, size: int) -> bytes:
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+
+
+async def _process(function: Callable[[Bytes], Bytes], chunk: Bytes,
+                   offload_size: Optional[int]) -> Bytes:
+    # Every result is a new buffer, which the writer may keep referencing until it is sent.
+    if offload_size is not None and len(chunk) >= offload_size:
+        return await _get_running_loop().run_in_executor(None, function, chunk)
+    return function(chunk)
@@ -1,15 +1,22 @@
+import os
 import sys
+import stat
 import logging
 import argparse
 import time
-from datetime import datetime, timezone
-from typing import Sequence, MutableSequence, Optional
+from typing import Sequence, MutableSequence, Optional, TYPE_CHECKING
 
 from .arguments_parser import ArgumentsParser
 from .operation_mode import OperationMode
-from .blocking_io import encrypt_stream, decrypt_stream
 from .stream_attributes import StreamAttributes
 
+# The I/O modules, the cipher and multiprocessing are imported on the paths which need them,
+# see test_startup.py.
+if TYPE_CHECKING:
+    from .batch import BatchResult
+    from .buffer_pool import SecureBufferPool
+    from .stats import ProcessingStats
+
 
 logger = logging.getLogger(__name__)
 
@@ -18,11 +25,26 @@ class Application:
 
     def __init__(self, args: Sequence[str]):
         self.start_time = self.get_monotonic_time()
+        self._buffer_pool = None
         args = list(args)
         self.args_parser = ArgumentsParser()
         logging_level = logging.DEBUG if self.pop_debug_arg(args) else logging.INFO
         logging.basicConfig(format='%(message)s', level=logging_level)
         self.parsed_args = self.args_parser.parse(args)
+        self.stats = self.create_stats()
+
+    def create_stats(self) -> Optional['ProcessingStats']:
+        """Wraps the streams with counters, keeping the original ones to be closed by clear()."""
+        parsed_args = self.parsed_args
+        if not hasattr(parsed_args, 'key') or parsed_args.batch \
+                or not (parsed_args.stats or parsed_args.progress):
+            return None
+        from .stats import ProcessingStats
+        stats = ProcessingStats(parsed_args.progress)
+        self.streams = (parsed_args.input, parsed_args.output)
+        parsed_args.input = stats.wrap_input(parsed_args.input)
+        parsed_args.output = stats.wrap_output(parsed_args.output)
+        return stats
 
     @staticmethod
     def get_monotonic_time() -> float:
@@ -36,40 +58,300 @@ class Application:
             return None
 
     def run(self) -> None:
+        if self.parsed_args.backend:
+            self.select_backend()
         if self.parsed_args.help:
             sys.stdout.write(self.args_parser.format_help())
+        elif self.parsed_args.info:
+            self.info()
+        elif self.parsed_args.serve:
+            self.serve()
+        elif self.parsed_args.via:
+            self.run_via()
+        elif self.parsed_args.batch:
+            self.run_batch()
+        elif len(self.parsed_args.key_locations) > 1:
+            self.fan_out()
         elif self.parsed_args.operation_mode is OperationMode.ENCRYPTION:
             self.encrypt()
-        elif self.parsed_args.operation_mode in (OperationMode.VERIFICATION, OperationMode.DECRYPTION):
+        elif self.parsed_args.operation_mode is OperationMode.REKEYING:
+            self.rekey()
+        elif self.parsed_args.operation_mode is OperationMode.VERIFICATION:
+            self.verify()
+        elif self.parsed_args.operation_mode is OperationMode.DECRYPTION:
             self.decrypt()
         else:
             assert False, self.parsed_args
+        self.drop_page_cache()
+
+    def select_backend(self) -> None:
+        from .backends import set_backend
+        # The name auto is resolved once, so batch processes do not measure the backends again.
+        self.parsed_args.backend = set_backend(self.parsed_args.backend).name
+        logging.debug('backend: ' + self.parsed_args.backend)
+
+    def drop_page_cache(self) -> None:
+        for name in ('input', 'output'):
+            stream = getattr(self.parsed_args, name, None)
+            if hasattr(stream, 'finish'):
+                logging.debug('page cache dropped from {}: {:,} B'.format(name, stream.finish()))
+
+    @property
+    def buffer_pool(self) -> 'SecureBufferPool':
+        if self._buffer_pool is None:
+            from .buffer_pool import SecureBufferPool
+            self._buffer_pool = SecureBufferPool()
+        return self._buffer_pool
+
+    @property
+    def io_module(self):
+        if self.parsed_args.pipeline:
+            from . import pipelined_io
+            return pipelined_io
+        from . import blocking_io
+        return blocking_io
+
+    @property
+    def mappable(self) -> bool:
+        from . import mapped_io
+        return mapped_io.is_mappable(self.parsed_args.output, self.parsed_args.input)
 
     def encrypt(self) -> None:
-        encrypter = encrypt_stream(
-            self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes
+        from . import mapped_io
+        # The compressed length is unknown beforehand, so the output cannot be preallocated.
+        mappable = not self.parsed_args.compress and self.mappable
+        if mappable:
+            encrypter = mapped_io.encrypt_file(
+                self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes,
+                self.parsed_args.stream_version, self.parsed_args.jobs
+            )
+        else:
+            encrypter = self.io_module.encrypt_stream(
+                self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes,
+                self.parsed_args.buffer_size, self.parsed_args.stream_version,
+                self.parsed_args.jobs, self.buffer_pool, self.parsed_args.compress
+            )
+        self.log_stream_attributes(encrypter)
+        self.write_stats(encrypter)
+
+    def fan_out(self) -> None:
+        from .fanout import encrypt_stream
+        encrypters = encrypt_stream(
+            self.parsed_args.outputs, self.parsed_args.input,
+            [key.bytes for key in self.parsed_args.keys], self.parsed_args.buffer_size,
+            self.parsed_args.stream_version, self.buffer_pool, self.parsed_args.compress
         )
+        for path, encrypter in zip(self.parsed_args.output_paths, encrypters):
+            logging.info('output: ' + path)
+            self.log_stream_attributes(encrypter)
+
+    def rekey(self) -> None:
+        from .rekey import rekey_stream
+        from .decrypter import StaleStreamError
+        try:
+            encrypter = rekey_stream(
+                self.parsed_args.output, self.parsed_args.input, self.parsed_args.old_key.bytes,
+                self.parsed_args.key.bytes, self.parsed_args.stream_version,
+                self.parsed_args.buffer_size, self.buffer_pool, self.parsed_args.after_ns,
+                self.parsed_args.keep_timestamp
+            )
+        except StaleStreamError:
+            self.discard_output()
+            raise ValueError('Not encrypted --after ' + self.parsed_args.after + '.')
+        except BaseException:
+            self.discard_output()
+            raise
         self.log_stream_attributes(encrypter)
+        self.write_stats(encrypter)
+
+    def discard_output(self) -> None:
+        """Truncates a regular output file, so no partial stream is left behind."""
+        output = getattr(self, 'streams', (None, self.parsed_args.output))[1]
+        try:
+            if stat.S_ISREG(os.fstat(output.fileno()).st_mode):
+                output.truncate(0)
+        except (OSError, ValueError, AttributeError):
+            pass
 
     def decrypt(self) -> None:
-        decrypter = decrypt_stream(
-            self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes
-        )
+        from . import mapped_io
+        from .decrypter import StaleStreamError
+        mappable = not self.parsed_args.range and self.mappable
+        # Streams encrypted too early are rejected right after their headers.
+        try:
+            if self.parsed_args.range:
+                from .random_access import decrypt_range
+                decrypter = decrypt_range(
+                    self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes,
+                    *self.parsed_args.range, workers=self.parsed_args.jobs,
+                    buffer_pool=self.buffer_pool, after_ns=self.parsed_args.after_ns
+                )
+            elif mappable:
+                decrypter = mapped_io.decrypt_file(
+                    self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes,
+                    self.parsed_args.jobs, self.parsed_args.after_ns
+                )
+            else:
+                decrypter = self.io_module.decrypt_stream(
+                    self.parsed_args.output, self.parsed_args.input, self.parsed_args.key.bytes,
+                    self.parsed_args.buffer_size, self.parsed_args.jobs, self.buffer_pool,
+                    self.parsed_args.after_ns
+                )
+        except StaleStreamError:
+            raise ValueError('Not encrypted --after ' + self.parsed_args.after + '.')
         self.log_stream_attributes(decrypter)
-        if decrypter.stream_timestamp_ns <= self.parsed_args.after_ns:
+        self.write_stats(decrypter)
+
+    def verify(self) -> None:
+        from . import verifier
+        from .decrypter import StaleStreamError
+        mappable = verifier.is_mappable(self.parsed_args.input)
+        try:
+            if mappable:
+                attrs = verifier.verify_file(self.parsed_args.input, self.parsed_args.key.bytes,
+                                             self.parsed_args.jobs, self.parsed_args.after_ns)
+            else:
+                attrs = verifier.verify_stream(
+                    self.parsed_args.input, self.parsed_args.key.bytes,
+                    self.parsed_args.buffer_size, self.parsed_args.jobs, self.buffer_pool,
+                    self.parsed_args.after_ns
+                )
+        except StaleStreamError:
             raise ValueError('Not encrypted --after ' + self.parsed_args.after + '.')
+        self.log_stream_attributes(attrs)
+        self.write_stats(attrs)
+
+    def info(self) -> None:
+        from .info import inspect_stream
+        from .decrypter import StaleStreamError
+        try:
+            info = inspect_stream(self.parsed_args.input, self.parsed_args.key.bytes,
+                                  self.parsed_args.after_ns)
+        except StaleStreamError:
+            raise ValueError('Not encrypted --after ' + self.parsed_args.after + '.')
+        logging.info('stream version: {}'.format(info.version))
+        logging.info('encryption timestamp: ' + self.format_timestamp_ns(info.stream_timestamp_ns))
+        if info.compression:
+            logging.info('compression: ' + info.compression)
+        if info.stream_length is not None:
+            logging.info('stream length: {:,} B'.format(info.stream_length))
+            logging.info('payload length: {:,} B to {:,} B'.format(
+                info.min_payload_length, info.max_payload_length
+            ))
+
+    def serve(self) -> None:
+        from .daemon import Daemon
+        from .key import KeyStore
+        key = self.parsed_args.key.bytes if hasattr(self.parsed_args, 'key') else None
+        key_store = KeyStore(self.parsed_args.key_dir) if self.parsed_args.key_dir else None
+        try:
+            Daemon(self.parsed_args.serve, key, self.parsed_args.jobs, key_store).serve()
+        finally:
+            if key_store is not None:
+                key_store.clear()
+
+    def run_via(self) -> None:
+        import json
+        from .daemon import STATS_MODE, send_request
+        if self.parsed_args.server_stats:
+            response = send_request(self.parsed_args.via, {'mode': STATS_MODE})
+            sys.stdout.write(json.dumps(response, indent=1) + '\n')
+            return
+        mode = self.parsed_args.operation_mode
+        fds = [self.parsed_args.input.fileno()]
+        if mode is not OperationMode.VERIFICATION:
+            fds.append(self.parsed_args.output.fileno())
+        request = {
+            'mode': mode.value,
+            'version': self.parsed_args.stream_version,
+            'after_ns': self.parsed_args.after_ns,
+            'buffer_size': self.parsed_args.buffer_size,
+            'no_cache': self.parsed_args.no_cache,
+            'compression': self.parsed_args.compress,
+        }
+        if self.parsed_args.key_location:
+            request['key_name'] = self.parsed_args.key_location.split(':', 1)[1]
+        response = send_request(self.parsed_args.via, request, fds)
+        if not response.get('ok'):
+            raise ValueError(response.get('error') or 'The daemon failed to process the request.')
+        attrs = StreamAttributes(b'')
+        attrs.stream_timestamp_ns = response['stream_timestamp_ns']
+        attrs.payload_length = response['payload_length']
+        attrs.compression = response.get('compression')
+        attrs.uncompressed_length = response.get('uncompressed_length')
+        attrs.mac = bytes.fromhex(response['mac']) if response['mac'] else None
+        self.log_stream_attributes(attrs)
+
+    BATCH_TABLE_HEADER = ('file', 'processing time', 'encryption timestamp', 'payload length',
+                          'MAC', 'error')
+
+    def run_batch(self) -> None:
+        from .batch import list_batch_files, process_files
+        paths = list_batch_files(self.parsed_args.batch, self.parsed_args.operation_mode,
+                                 self.parsed_args.input, self.parsed_args.null)
+        output = self.parsed_args.output
+        output.write(('\t'.join(self.BATCH_TABLE_HEADER) + '\n').encode())
+        old_key = self.parsed_args.old_key.bytes if self.parsed_args.rekey else None
+        failed = 0
+        for result in process_files(
+            paths, self.parsed_args.key.bytes, self.parsed_args.operation_mode,
+            self.parsed_args.stream_version, self.parsed_args.after_ns,
+            self.parsed_args.buffer_size, self.parsed_args.no_cache, self.parsed_args.jobs,
+            self.parsed_args.compress, old_key, self.parsed_args.keep_timestamp,
+            self.parsed_args.backend
+        ):
+            failed += result.error is not None
+            output.write(('\t'.join(self.format_batch_result(result)) + '\n').encode())
+            output.flush()
+        logging.info('processed files: {:,}, failed: {:,}'.format(len(paths), failed))
+        if failed:
+            raise ValueError('Processing of {:,} files failed.'.format(failed))
+
+    def format_batch_result(self, result: 'BatchResult') -> Sequence[str]:
+        if result.error is not None:
+            return result.path, '{:.3f} s'.format(result.processing_time), '', '', '', result.error
+        return (
+            result.path,
+            '{:.3f} s'.format(result.processing_time),
+            self.format_timestamp_ns(result.stream_timestamp_ns),
+            '{:,} B'.format(result.payload_length),
+            result.mac.hex().upper() if result.mac is not None else '',
+            '',
+        )
 
     def log_stream_attributes(self, attrs: StreamAttributes) -> None:
         logging.info('processing time: {:.3f} s'.format(self.get_monotonic_time() - self.start_time))
         logging.info('encryption timestamp: ' + self.format_timestamp_ns(attrs.stream_timestamp_ns))
-        logging.info('payload length: {:,} B'.format(attrs.payload_length))
-        logging.info('MAC: ' + attrs.mac.hex().upper())
+        if attrs.compression:
+            # The payload is what gets encrypted, so its length is the compressed one.
+            logging.info('compressed payload length: {:,} B'.format(attrs.payload_length))
+            if attrs.uncompressed_length is not None:
+                logging.info('uncompressed length: {:,} B'.format(attrs.uncompressed_length))
+            logging.info('compression: ' + attrs.compression)
+        else:
+            logging.info('payload length: {:,} B'.format(attrs.payload_length))
+        if attrs.mac is not None:
+            logging.info('MAC: ' + attrs.mac.hex().upper())
+
+    def write_stats(self, attrs: StreamAttributes) -> None:
+        # The counting streams are unseekable, so the files are never memory mapped with them.
+        if self.stats is None or self.parsed_args.stats is None:
+            return
+        report = self.stats.report(attrs, self.parsed_args.operation_mode.value)
+        import json
+        _, path = self.parsed_args.stats
+        if path is None:
+            sys.stderr.write(json.dumps(report) + '\n')
+            sys.stderr.flush()
+        else:
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=1)
+                f.write('\n')
 
     @staticmethod
     def format_timestamp_ns(ns: int) -> str:
         ts, ns = divmod(ns, 10**9)
-        dt = datetime.fromtimestamp(ts, tz=timezone.utc)
-        return dt.strftime('%Y-%m%dT%H:%M:%S') + '.{:09}Z'.format(ns)
+        return time.strftime('%Y-%m%dT%H:%M:%S', time.gmtime(ts)) + '.{:09}Z'.format(ns)
 
     def __enter__(self):
         return self
@@ -81,8 +363,21 @@ class Application:
         self.clear()
 
     def clear(self):
-        if hasattr(self, 'parsed_args') and hasattr(self.parsed_args, 'key'):
-            self.parsed_args.key.clear()
+        if getattr(self, '_buffer_pool', None) is not None:
+            self._buffer_pool.clear()
+        if hasattr(self, 'parsed_args'):
+            if hasattr(self.parsed_args, 'key'):
+                for key in getattr(self.parsed_args, 'keys', [self.parsed_args.key]):
+                    key.clear()
+            if hasattr(self.parsed_args, 'old_key'):
+                self.parsed_args.old_key.clear()
+            streams = getattr(self, 'streams', (
+                getattr(self.parsed_args, 'input', None), getattr(self.parsed_args, 'output', None)
+            ))
+            streams += tuple(getattr(self.parsed_args, 'outputs', ())[1:])
+            for stream in streams:
+                if stream is not None and stream not in (sys.stdin.buffer, sys.stdout.buffer):
+                    stream.close()
 
 
 def main() -> int:
@@ -1,14 +1,23 @@
 import os
 import re
 import os.path
-from datetime import datetime, timezone
 import sys
-from typing import Sequence
+import stat
+from typing import Sequence, Tuple, Optional, BinaryIO, TYPE_CHECKING
 import argparse
 
 from .operation_mode import OperationMode
-from .key import Cipher21Key
 from .null_stream import NullStream
+from .constants import STREAM_LENGTH_MULTIPLICAND, BUFFER_SIZE
+
+# Modules needed only by some options or modes, such as the cipher, are imported where they are
+# used, as the start-up time dominates processing of small inputs.
+if TYPE_CHECKING:
+    from .key import Cipher21Key
+
+
+DEFAULT_AFTER = '2021-01-01T00Z'
+DEFAULT_AFTER_NS = 1609459200 * 10**9
 
 
 class ArgumentsParser:
@@ -19,35 +28,89 @@ class ArgumentsParser:
         self._add_mode_arguments()
         self._add_key_argument()
         self._add_after_argument()
+        self._add_keep_timestamp_argument()
+        self._add_pipeline_argument()
+        self._add_buffer_size_argument()
+        self._add_stream_version_argument()
+        self._add_compress_argument()
+        self._add_backend_argument()
+        self._add_jobs_argument()
+        self._add_range_argument()
+        self._add_file_arguments()
+        self._add_no_cache_argument()
+        self._add_batch_arguments()
+        self._add_stats_arguments()
+        self._add_daemon_arguments()
 
     def parse(self, args: Sequence[str]) -> argparse.Namespace:
         parsed_args = self.parser.parse_args(args)
+        parsed_args.key_locations = parsed_args.key_locations or []
+        parsed_args.output_paths = parsed_args.output_paths or []
+        parsed_args.key_location = parsed_args.key_locations[0] if parsed_args.key_locations \
+            else None
+        parsed_args.output_path = parsed_args.output_paths[0] if parsed_args.output_paths \
+            else None
+        if parsed_args.rekey:
+            parsed_args.operation_mode = OperationMode.REKEYING
         self._verify_args(parsed_args)
-        parsed_args.after_ns = self.parse_date_time_into_ns(parsed_args.after)
-        if parsed_args.key_location:
-            parsed_args.key = self.fetch_key(parsed_args.key_location)
-            parsed_args.input = sys.stdin.buffer
-            if parsed_args.operation_mode is OperationMode.VERIFICATION:
+        if parsed_args.stream_version is None and not parsed_args.rekey:
+            parsed_args.stream_version = 2 if parsed_args.compress else 1
+        parsed_args.after_ns = DEFAULT_AFTER_NS if parsed_args.after == DEFAULT_AFTER \
+            else self.parse_date_time_into_ns(parsed_args.after)
+        parsed_args.range = self.parse_range(parsed_args.range) if parsed_args.range else None
+        parsed_args.stats = self.parse_stats(parsed_args.stats) if parsed_args.stats else None
+        if parsed_args.key_location and not parsed_args.via:
+            parsed_args.key = self.fetch_key(parsed_args.key_location, parsed_args.key_dir)
+            if parsed_args.rekey:
+                parsed_args.old_key = self.fetch_key(parsed_args.rekey, parsed_args.key_dir)
+            if len(parsed_args.key_locations) > 1:
+                parsed_args.keys = [parsed_args.key]
+                for location in parsed_args.key_locations[1:]:
+                    parsed_args.keys.append(self.fetch_key(location, parsed_args.key_dir))
+            if parsed_args.info:
+                parsed_args.input = self.open_file(parsed_args.input_path, 'rb', sys.stdin.buffer)
                 parsed_args.output = NullStream()
-            else:
-                parsed_args.output = sys.stdout.buffer
+                return parsed_args
+            if parsed_args.batch or parsed_args.serve:
+                # Files are opened one by one, the manifest comes from and the table goes to std.
+                parsed_args.input, parsed_args.output = sys.stdin.buffer, sys.stdout.buffer
+                return parsed_args
+            self._open_streams(parsed_args)
+            if parsed_args.no_cache:
+                from .page_cache import drop_behind
+                parsed_args.input = drop_behind(parsed_args.input, False)
+                parsed_args.output = drop_behind(parsed_args.output, True)
+            if parsed_args.buffer_size == 'auto':
+                from .buffer_tuning import choose_buffer_size
+                parsed_args.buffer_size = choose_buffer_size(parsed_args.input, parsed_args.output)
+        elif parsed_args.via and parsed_args.operation_mode:
+            # The daemon gets the file descriptors and applies --no-cache and --buffer-size auto.
+            self._open_streams(parsed_args)
         return parsed_args
 
+    def _open_streams(self, parsed_args: argparse.Namespace) -> None:
+        parsed_args.input = self.open_file(parsed_args.input_path, 'rb', sys.stdin.buffer)
+        if parsed_args.operation_mode is OperationMode.VERIFICATION:
+            parsed_args.output = NullStream()
+        else:
+            # Opening an output truncates it, so an output being the input is rejected beforehand.
+            self.check_outputs_differ(parsed_args.input, parsed_args.output_paths)
+            parsed_args.output = self.open_file(parsed_args.output_path, 'w+b', sys.stdout.buffer)
+            parsed_args.outputs = [parsed_args.output] + [
+                self.open_file(path, 'w+b', sys.stdout.buffer)
+                for path in parsed_args.output_paths[1:]
+            ]
+            self.check_outputs_distinct(parsed_args.outputs, parsed_args.output_paths)
+
     def format_help(self) -> str:
         return self.parser.format_help()
 
-    def fetch_key(self, reference: str) -> Cipher21Key:
-        reference = reference.split(':', 1)
-        if len(reference) != 2:
-            raise argparse.ArgumentError(
-                None, 'No --key LOCATION scheme. Use env: or file: or fd: prefix.'
-            )
-        if reference[0] == 'env':
-            return self.fetch_key_from_env(reference[1])
-        elif reference[0] in ('file', 'fd'):
-            return self.fetch_key_from_file(reference[1])
-        else:
-            raise argparse.ArgumentError(None, 'Unsupported secret source scheme `' + reference[0] + ':`.')
+    def fetch_key(self, reference: str, key_directory: Optional[str] = None) -> 'Cipher21Key':
+        from .key import KeyStore
+        try:
+            return KeyStore(key_directory).load(reference)
+        except ValueError as error:
+            raise argparse.ArgumentError(None, str(error))
 
     DATE_TIME_RE = re.compile(
         '(?P<year>20[0-9]{2})-(?P<month>0[1-9]|1[012])-(?P<day>0[1-9]|[12][0-9]|3[01])T'
@@ -60,6 +123,7 @@ class ArgumentsParser:
     )
 
     def parse_date_time_into_ns(self, text) -> int:
+        from datetime import datetime, timezone
         match = self.DATE_TIME_RE.fullmatch(text)
         if not match:
             raise argparse.ArgumentError(None, 'Malformed --after date and time value.')
@@ -77,27 +141,102 @@ class ArgumentsParser:
             return result
         return result + int(fraction.ljust(9, '0'))
 
-    @staticmethod
-    def fetch_key_from_env(env_name: str) -> Cipher21Key:
-        hex_key = os.environ.get(env_name)
-        if not hex_key:
-            raise argparse.ArgumentError(None, 'No value under ' + env_name + ' environment variable.')
+    RANGE_RE = re.compile('(?P<start>[0-9]*):(?P<end>[0-9]*)')
+
+    def parse_range(self, text: str) -> Tuple[int, Optional[int]]:
+        match = self.RANGE_RE.fullmatch(text)
+        if not match:
+            raise argparse.ArgumentError(None, 'Malformed --range value.')
+        start = int(match.group('start') or 0)
+        end = int(match.group('end')) if match.group('end') else None
+        if end is not None and end < start:
+            raise argparse.ArgumentError(None, 'The --range END must not precede START.')
+        return start, end
+
+    BUFFER_SIZE_RE = re.compile('(?P<number>[1-9][0-9]*)(?P<unit>[KM]?)')
+
+    def parse_buffer_size(self, text: str):
+        if text == 'auto':
+            return text
+        match = self.BUFFER_SIZE_RE.fullmatch(text)
+        if not match:
+            raise argparse.ArgumentError(None, 'Malformed --buffer-size value.')
+        result = int(match.group('number')) * {'': 1, 'K': 2**10, 'M': 2**20}[match.group('unit')]
+        from .blocking_io import check_buffer_size
         try:
-            return Cipher21Key.from_hexes(hex_key.encode('UTF-8'))
-        except Exception as error:
+            return check_buffer_size(result)
+        except ValueError as error:
+            raise argparse.ArgumentError(None, str(error))
+
+    def parse_compression(self, text: str) -> str:
+        from .compression import parse_compression
+        try:
+            parse_compression(text)
+        except ValueError as error:
+            raise argparse.ArgumentError(None, str(error))
+        return text
+
+    def parse_backend(self, text: str) -> str:
+        from .backends import BACKENDS, AUTO_BACKEND
+        if text != AUTO_BACKEND and text not in BACKENDS:
             raise argparse.ArgumentError(
-                None, 'Error occurred while reading key from ' + env_name
-                      + ' environment variable: ' + str(error)
+                None, 'Unavailable --backend `' + text + '`. Available: '
+                      + ', '.join(sorted(BACKENDS) + [AUTO_BACKEND]) + '.'
             )
+        return text
+
+    def parse_stats(self, text: str) -> Tuple[str, Optional[str]]:
+        stats_format, _, path = text.partition(':')
+        if stats_format != 'json':
+            raise argparse.ArgumentError(None, 'Unsupported --stats format `' + stats_format + '`.')
+        return stats_format, path or None
 
     @staticmethod
-    def fetch_key_from_file(file) -> Cipher21Key:
+    def open_file(path: Optional[str], mode: str, default: BinaryIO) -> BinaryIO:
+        if not path or path == '-':
+            return default
         try:
-            return Cipher21Key.from_hex_file(file)
-        except Exception as error:
-            raise argparse.ArgumentError(
-                None, 'Error occurred while reading ' + str(file) + ' file: ' + str(error)
-            )
+            return open(path, mode)
+        except OSError as error:
+            raise argparse.ArgumentError(None, 'Cannot open ' + path + ' file: ' + str(error))
+
+    @staticmethod
+    def regular_file_id(stream: BinaryIO) -> Optional[Tuple[int, int]]:
+        try:
+            file_stat = os.fstat(stream.fileno())
+        except (OSError, ValueError, AttributeError):
+            return None
+        return (file_stat.st_dev, file_stat.st_ino) if stat.S_ISREG(file_stat.st_mode) else None
+
+    @classmethod
+    def check_outputs_differ(cls, input_stream: BinaryIO, output_paths: Sequence[str]) -> None:
+        input_id = cls.regular_file_id(input_stream)
+        if input_id is None:
+            return
+        for path in output_paths:
+            if not path or path == '-':
+                continue
+            try:
+                output_stat = os.stat(path)
+            except OSError:
+                continue
+            if (output_stat.st_dev, output_stat.st_ino) == input_id:
+                raise argparse.ArgumentError(None, 'The output ' + path + ' is the input file.')
+
+    @classmethod
+    def check_outputs_distinct(cls, outputs: Sequence[BinaryIO], output_paths: Sequence[str]) \
+            -> None:
+        # Different paths, e.g. o1 and ./o1 or a link, may still name the same file.
+        paths = {}
+        for output, path in zip(outputs, output_paths):
+            output_id = cls.regular_file_id(output)
+            if output_id is None:
+                continue
+            if output_id in paths:
+                raise argparse.ArgumentError(
+                    None, 'The outputs ' + paths[output_id] + ' and ' + path + ' are the same file.'
+                )
+            paths[output_id] = path
 
     @staticmethod
     def _create_argument_parser(**kwargs) -> argparse.ArgumentParser:
@@ -129,35 +268,242 @@ class ArgumentsParser:
             '-d', '--decrypt', help='Decryption mode.',
             dest='operation_mode', action='store_const', const=OperationMode.DECRYPTION,
         )
+        group.add_argument(
+            '--rekey',
+            help='Re-keying mode. Decrypt with the key at OLD_LOCATION and encrypt with the --key '
+                 'in a single process, on a thread per stage. The new stream gets its final MAC '
+                 'only after the old one verifies. Default --stream-version: the input one',
+            metavar='OLD_LOCATION')
+        group.add_argument(
+            '--info', action='store_true',
+            help='Read the stream header only and show the stream version, the encryption '
+                 'timestamp and, for a regular file, the payload length range.')
+        group.add_argument(
+            '--serve',
+            help='Serve the modes above to --via clients on a Unix domain SOCKET, with the key '
+                 'loaded once and --jobs worker threads. The socket is accessible to the user '
+                 'only. SIGTERM stops the daemon after the requests in progress.',
+            metavar='SOCKET')
+        group.add_argument(
+            '--server-stats', action='store_true',
+            help='Print the request count and latency statistics of the --via daemon as JSON.')
 
     def _add_key_argument(self):
         self.parser.add_argument(
-            '-k', '--key', help='64 hexadecimal key location.',
-            dest='key_location', metavar='LOCATION'
+            '-k', '--key', action='append',
+            help='64 hexadecimal key location. Encryption accepts many keys with an --output per '
+                 'key, in the same order, and encrypts a single read of the input for all of '
+                 'them on a thread per key.',
+            dest='key_locations', metavar='LOCATION'
         )
+        self.parser.add_argument(
+            '--key-dir',
+            help='Directory of key files, one per file, for the dir: key locations. With --serve, '
+                 'the keys are cached and --via clients choose them by a dir: --key.',
+            metavar='DIRECTORY')
         self.parser.epilog += (
             'The --key LOCATION has to be specified in one from the following forms:\n'
             ' - file:FILE_PATH\n'
             ' - env:ENVIRONMENT_VARIABLE_NAME\n'
             ' - fd:FILE_DESCRIPTION_NUMBER\n'
+            ' - dir:KEY_FILE_NAME in the --key-dir\n'
             '\n'
             'Example: --key file:path/to/my/secret.key'
         )
 
     def _add_after_argument(self):
         self.parser.add_argument(
-            '-a', '--after', default='2021-01-01T00Z',
+            '-a', '--after', default=DEFAULT_AFTER,
             help='Check encryption timestamp. Value must be in ISO 8601-1:2019 combined '
                  'date and time representation with a Z at the end. '
                  'Default: 2021-01-01T00Z',
             metavar='DATE_TIME')
 
+    def _add_keep_timestamp_argument(self):
+        self.parser.add_argument(
+            '--keep-timestamp', action='store_true',
+            help='Keep the encryption timestamp of the --rekey input stream.')
+
+    def _add_pipeline_argument(self):
+        self.parser.add_argument(
+            '-p', '--pipeline', action='store_true',
+            help='Read, process and write on separate threads to overlap I/O with the cipher. '
+                 'Encryption and decryption only.'
+        )
+
+    def _add_buffer_size_argument(self):
+        self.parser.add_argument(
+            '--buffer-size', default=BUFFER_SIZE, type=self.parse_buffer_size,
+            help='I/O buffer size in bytes, optionally with a K or M binary suffix. It has to be '
+                 'a multiple of {}. Use auto to choose it from the input type. '
+                 'Default: {}K'.format(STREAM_LENGTH_MULTIPLICAND, BUFFER_SIZE // 2**10),
+            metavar='SIZE')
+
+    def _add_stream_version_argument(self):
+        self.parser.add_argument(
+            '--stream-version', type=int, choices=(1, 2),
+            help='Encrypted stream format version. Version 2 consists of independently '
+                 'authenticated segments which are processed in parallel. Decryption '
+                 'recognizes the version automatically. Default: 2 with --compress, otherwise 1',
+            metavar='VERSION')
+
+    def _add_compress_argument(self):
+        self.parser.add_argument(
+            '--compress', type=self.parse_compression,
+            help='Compress the payload with zlib, bz2 or lzma before encrypting it, in blocks on '
+                 '--jobs threads. The codec is recorded in the version 2 stream header and '
+                 'decryption decompresses automatically. Default LEVEL: the codec one',
+            metavar='CODEC[:LEVEL]')
+
+    def _add_backend_argument(self):
+        self.parser.add_argument(
+            '--backend', type=self.parse_backend,
+            help='XChaCha20-Poly1305 implementation: pycryptodome or, if installed, libsodium. '
+                 'The auto one is the fastest by a micro-benchmark, whose result is cached in '
+                 '~/.cache/cipher21. Every backend produces the same streams. '
+                 'Default: pycryptodome',
+            metavar='NAME')
+
+    def _add_jobs_argument(self):
+        self.parser.add_argument(
+            '-j', '--jobs', type=int, default=None,
+            help='Number of threads processing version 2 stream segments, of --batch '
+                 'processes or of --serve worker threads. Default: the number of CPUs',
+            metavar='N')
+
+    def _add_range_argument(self):
+        self.parser.add_argument(
+            '--range',
+            help='Decrypt only the payload bytes from START inclusive to END exclusive. Either '
+                 'may be omitted. Requires a version 2 stream in a regular file as the input.',
+            metavar='START:END')
+
+    def _add_file_arguments(self):
+        self.parser.add_argument(
+            '-i', '--input', dest='input_path',
+            help='Input file. Default: the standard input',
+            metavar='FILE')
+        self.parser.add_argument(
+            '-o', '--output', dest='output_paths', action='append',
+            help='Output file. Regular input and output files are processed through memory '
+                 'mapping. Default: the standard output',
+            metavar='FILE')
+
+    def _add_no_cache_argument(self):
+        self.parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Evict processed parts of regular input and output files from the page cache, '
+                 'so other processes keep their cached data.')
+
+    def _add_batch_arguments(self):
+        self.parser.add_argument(
+            '--batch',
+            help='Process many files with the key loaded once, on a pool of --jobs processes. '
+                 'SOURCE is a directory, a glob pattern or - for a manifest of paths on the '
+                 'standard input. Encryption writes FILE.c21, decryption strips .c21 and '
+                 're-keying replaces FILE.c21, all atomically. A result table is written to the '
+                 'standard output.',
+            metavar='SOURCE')
+        self.parser.add_argument(
+            '-0', '--null', action='store_true',
+            help='The --batch manifest paths are separated by NUL instead of newline characters.')
+
+    def _add_stats_arguments(self):
+        self.parser.add_argument(
+            '--stats',
+            help='Write processing counters as a JSON object: bytes in and out, read, write and '
+                 'crypto time, call and stall counts, peak memory and throughput. The object goes '
+                 'to FILE if given, otherwise to the standard error.',
+            metavar='json[:FILE]')
+        self.parser.add_argument(
+            '--progress', type=float,
+            help='Log the processed bytes and the rate every SECONDS.',
+            metavar='SECONDS')
+
+    def _add_daemon_arguments(self):
+        self.parser.add_argument(
+            '--via',
+            help='Let the --serve daemon on SOCKET process the input and output files, which '
+                 'are passed to it as file descriptors. The daemon provides the key.',
+            metavar='SOCKET')
+
     @staticmethod
     def _verify_args(args: argparse.Namespace) -> None:
-        if args.operation_mode and not args.key_location:
+        if args.operation_mode and not args.key_location and not args.via:
+            raise argparse.ArgumentError(
+                None, 'Encryption, verification, decryption and re-keying require a --key.'
+            )
+        if args.info and not args.key_location:
+            raise argparse.ArgumentError(None, 'The --info requires a --key.')
+        if args.info and (args.via or args.output_path or args.batch or args.pipeline
+                          or args.stats or args.progress):
+            raise argparse.ArgumentError(
+                None, 'The --info excludes --via, --output, --batch, --pipeline, --stats and '
+                      '--progress.'
+            )
+        if args.serve and not (args.key_location or args.key_dir):
+            raise argparse.ArgumentError(None, 'The --serve requires a --key or a --key-dir.')
+        if args.serve and (args.via or args.input_path or args.output_path or args.range
+                           or args.batch or args.pipeline or args.stats or args.progress):
+            raise argparse.ArgumentError(
+                None, 'The --serve excludes --via, --input, --output, --range, --batch, '
+                      '--pipeline, --stats and --progress.'
+            )
+        if args.via and (args.key_location and not args.key_location.startswith('dir:')
+                         or args.key_dir or args.range or args.batch or args.pipeline
+                         or args.stats or args.progress):
+            raise argparse.ArgumentError(
+                None, 'The --via excludes --key other than dir:, --key-dir, --range, --batch, '
+                      '--pipeline, --stats and --progress.'
+            )
+        if len(args.key_locations) > 1 or len(args.output_paths) > 1:
+            if args.operation_mode is not OperationMode.ENCRYPTION:
+                raise argparse.ArgumentError(
+                    None, 'Many --key and --output values are allowed in encryption mode only.'
+                )
+            if len(args.key_locations) != len(args.output_paths):
+                raise argparse.ArgumentError(None, 'Every --key requires its own --output.')
+            if len(set(args.output_paths)) != len(args.output_paths):
+                raise argparse.ArgumentError(None, 'The --output files must differ.')
+            if args.via or args.batch or args.pipeline or args.no_cache or args.stats \
+                    or args.progress:
+                raise argparse.ArgumentError(
+                    None, 'Many --key values exclude --via, --batch, --pipeline, --no-cache, '
+                          '--stats and --progress.'
+                )
+        if args.backend and args.via:
+            raise argparse.ArgumentError(
+                None, 'The --backend applies to the --serve daemon, not to --via clients.'
+            )
+        if args.server_stats and not args.via:
+            raise argparse.ArgumentError(None, 'The --server-stats requires --via.')
+        if args.compress and args.operation_mode is not OperationMode.ENCRYPTION:
+            raise argparse.ArgumentError(None, 'The --compress is allowed in encryption mode only.')
+        if args.compress and args.stream_version == 1:
+            raise argparse.ArgumentError(None, 'The --compress requires the --stream-version 2.')
+        if args.rekey and (args.via or args.range or args.compress or args.pipeline):
+            raise argparse.ArgumentError(
+                None, 'The --rekey excludes --via, --range, --compress and --pipeline.'
+            )
+        if args.keep_timestamp and not args.rekey:
+            raise argparse.ArgumentError(None, 'The --keep-timestamp requires --rekey.')
+        if args.pipeline and args.operation_mode is OperationMode.VERIFICATION:
+            # Verification reads only, there is no writing to overlap the cipher with.
+            raise argparse.ArgumentError(None, 'The --pipeline does not apply to --verify.')
+        if args.range and args.operation_mode is not OperationMode.DECRYPTION:
+            raise argparse.ArgumentError(None, 'The --range is allowed in decryption mode only.')
+        if args.batch and (args.input_path or args.output_path or args.range or args.pipeline):
             raise argparse.ArgumentError(
-                None, 'Encryption, verification and decryption require a --key.'
+                None, 'The --batch excludes --input, --output, --range and --pipeline.'
             )
+        if args.null and args.batch != '-':
+            raise argparse.ArgumentError(None, 'The --null applies to the --batch - manifest only.')
+        if args.jobs is not None and args.jobs < 1:
+            raise argparse.ArgumentError(None, 'The --jobs value must be positive.')
+        if args.batch and (args.stats or args.progress):
+            raise argparse.ArgumentError(None, 'The --batch excludes --stats and --progress.')
+        if args.progress is not None and args.progress <= 0:
+            raise argparse.ArgumentError(None, 'The --progress value must be positive.')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,341 @@
+"""
+Implementations of XChaCha20-Poly1305 behind the Encrypter, the Decrypter and their segmented
+versions. The pycryptodome one is the default. The optional ones are discovered at import time
+and may be chosen by name or, with auto, by a micro-benchmark whose result is cached per host.
+"""
+
+import os
+import sys
+import time
+import ctypes
+import struct
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from Crypto.Cipher import ChaCha20_Poly1305
+
+from .bytes_utils import clear_secret
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'Backend',
+    'BACKENDS',
+    'DEFAULT_BACKEND',
+    'AUTO_BACKEND',
+    'new_cipher',
+    'get_backend',
+    'set_backend',
+    'choose_fastest',
+)
+
+
+DEFAULT_BACKEND = 'pycryptodome'
+AUTO_BACKEND = 'auto'
+BENCHMARK_LENGTH = 2**20
+BENCHMARK_REPEAT = 3
+LIBSODIUM_NAMES = ('libsodium.so.23', 'libsodium.so.26', 'libsodium.so', 'libsodium.dylib',
+                   'libsodium.dll')
+
+_KEY_LENGTH = 32
+_XNONCE_LENGTH = 24
+_MAC_LENGTH = 16
+_CHACHA20_BLOCK_LENGTH = 64
+_POLY1305_KEY_LENGTH = 32
+_POLY1305_TAG_LENGTH = 16
+_POLY1305_STATE_ALIGNMENT = 16
+
+
+class Backend:
+    """
+    Creates cipher objects with the interface of the pycryptodome ChaCha20_Poly1305 ones which
+    cipher21 uses: encrypt() and decrypt() with an optional output, digest() and verify().
+    """
+
+    name = None  # type: str
+
+    @property
+    def version(self) -> str:
+        raise NotImplementedError
+
+    def new(self, key: Bytes, nonce: Bytes):
+        raise NotImplementedError
+
+
+class PycryptodomeBackend(Backend):
+
+    name = DEFAULT_BACKEND
+
+    @property
+    def version(self) -> str:
+        import Crypto
+        return Crypto.__version__
+
+    def new(self, key: Bytes, nonce: Bytes):
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce)
+
+
+class SodiumBackend(Backend):
+    """
+    libsodium through ctypes. Its AEAD functions are one-shot, so the cipher is composed of
+    the XChaCha20 stream with an initial counter and the incremental Poly1305, as in RFC 8439.
+    """
+
+    name = 'libsodium'
+
+    def __init__(self, lib: ctypes.CDLL):
+        if lib.sodium_init() < 0:
+            raise OSError('libsodium initialization failed')
+        lib.sodium_version_string.restype = ctypes.c_char_p
+        lib.crypto_onetimeauth_poly1305_statebytes.restype = ctypes.c_size_t
+        lib.crypto_stream_xchacha20_xor_ic.argtypes = (
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulonglong, ctypes.c_void_p,
+            ctypes.c_uint64, ctypes.c_void_p
+        )
+        lib.crypto_onetimeauth_poly1305_init.argtypes = (ctypes.c_void_p, ctypes.c_void_p)
+        lib.crypto_onetimeauth_poly1305_update.argtypes = (
+            ctypes.c_void_p, ctypes.c_void_p, ctypes.c_ulonglong
+        )
+        lib.crypto_onetimeauth_poly1305_final.argtypes = (ctypes.c_void_p, ctypes.c_void_p)
+        lib.crypto_verify_16.argtypes = (ctypes.c_char_p, ctypes.c_char_p)
+        self.lib = lib
+        self.state_length = lib.crypto_onetimeauth_poly1305_statebytes()
+
+    @classmethod
+    def load(cls) -> Optional['SodiumBackend']:
+        """Returns None if no libsodium with the XChaCha20 stream functions is installed."""
+        names = LIBSODIUM_NAMES
+        if os.environ.get('CIPHER21_LIBSODIUM'):
+            names = (os.environ['CIPHER21_LIBSODIUM'],) + names
+        for name in names:
+            try:
+                return cls(ctypes.CDLL(name))
+            except (OSError, AttributeError):
+                continue
+        return None
+
+    @property
+    def version(self) -> str:
+        return self.lib.sodium_version_string().decode()
+
+    def new(self, key: Bytes, nonce: Bytes) -> '_SodiumCipher':
+        return _SodiumCipher(self, key, nonce)
+
+
+class _SodiumCipher:
+
+    def __init__(self, backend: SodiumBackend, key: Bytes, nonce: Bytes):
+        if len(key) != _KEY_LENGTH:
+            raise ValueError('Key must be ' + str(_KEY_LENGTH) + ' bytes long.')
+        if len(nonce) != _XNONCE_LENGTH:
+            raise ValueError('Nonce must be ' + str(_XNONCE_LENGTH) + ' bytes long.')
+        self._lib = backend.lib
+        self._key = bytearray(key)
+        self._nonce = bytes(nonce)
+        self._state_buffer = bytearray(backend.state_length + _POLY1305_STATE_ALIGNMENT)
+        self._state = _address(self._state_buffer)
+        self._state += -self._state % _POLY1305_STATE_ALIGNMENT
+        self._length = 0
+        self._mac = None  # type: Optional[bytes]
+        # As in RFC 8439, the one-time Poly1305 key is the first keystream block,
+        # and the ciphertext is encrypted starting from the second one.
+        one_time_key = bytearray(_POLY1305_KEY_LENGTH)
+        try:
+            self._xor_blocks(one_time_key, one_time_key, 0)
+            with _pointer(one_time_key) as address:
+                self._lib.crypto_onetimeauth_poly1305_init(self._state, address)
+        finally:
+            clear_secret(one_time_key)
+
+    def __del__(self):
+        self._clear()
+
+    def encrypt(self, plaintext: Bytes, output: Optional[MutableBytes] = None) -> Optional[bytes]:
+        result = bytearray(len(plaintext)) if output is None else output
+        self._xor(plaintext, result)
+        self._authenticate(result)
+        self._length += len(plaintext)
+        return None if output is not None else bytes(result)
+
+    def decrypt(self, ciphertext: Bytes, output: Optional[MutableBytes] = None) \
+            -> Optional[bytes]:
+        # The ciphertext is authenticated first, as the output may be the same buffer.
+        self._authenticate(ciphertext)
+        result = bytearray(len(ciphertext)) if output is None else output
+        self._xor(ciphertext, result)
+        self._length += len(ciphertext)
+        return None if output is not None else bytes(result)
+
+    def digest(self) -> bytes:
+        if self._mac is None:
+            # There is no associated data, so it is the ciphertext padding and both lengths only.
+            trailer = bytes(-self._length % 16) + struct.pack('<QQ', 0, self._length)
+            self._lib.crypto_onetimeauth_poly1305_update(self._state, trailer, len(trailer))
+            mac = ctypes.create_string_buffer(_POLY1305_TAG_LENGTH)
+            self._lib.crypto_onetimeauth_poly1305_final(self._state, mac)
+            self._mac = mac.raw
+            self._clear()
+        return self._mac
+
+    def verify(self, mac: Bytes) -> None:
+        if len(mac) != _MAC_LENGTH or self._lib.crypto_verify_16(self.digest(), bytes(mac)) != 0:
+            raise ValueError('MAC check failed')
+
+    def _authenticate(self, ciphertext: Bytes) -> None:
+        if self._mac is not None:
+            raise TypeError('The cipher cannot be used after the MAC is computed.')
+        with _pointer(ciphertext) as address:
+            self._lib.crypto_onetimeauth_poly1305_update(self._state, address, len(ciphertext))
+
+    def _xor(self, data: Bytes, output: MutableBytes) -> None:
+        if len(output) != len(data):
+            raise ValueError('The output must be as long as the input.')
+        offset = self._length % _CHACHA20_BLOCK_LENGTH
+        counter = 1 + self._length // _CHACHA20_BLOCK_LENGTH
+        head = min(len(data), -offset % _CHACHA20_BLOCK_LENGTH)
+        with memoryview(data) as data_view, memoryview(output) as output_view:
+            if head:
+                # The rest of a block started by the previous call goes through a scratch block.
+                block = bytearray(_CHACHA20_BLOCK_LENGTH)
+                try:
+                    block[offset:offset+head] = data_view[:head]
+                    self._xor_blocks(block, block, counter)
+                    output_view[:head] = block[offset:offset+head]
+                finally:
+                    clear_secret(block)
+                counter += 1
+            if head < len(data):
+                self._xor_blocks(output_view[head:], data_view[head:], counter)
+
+    def _xor_blocks(self, output: MutableBytes, data: Bytes, counter: int) -> None:
+        with _pointer(output, True) as output_address, _pointer(data) as data_address, \
+                _pointer(self._key) as key_address:
+            self._lib.crypto_stream_xchacha20_xor_ic(
+                output_address, data_address, len(data), self._nonce, counter, key_address
+            )
+
+    def _clear(self) -> None:
+        for secret in (getattr(self, '_key', None), getattr(self, '_state_buffer', None)):
+            if secret:
+                clear_secret(secret)
+
+
+class _PyBuffer(ctypes.Structure):
+    # See Include/cpython/object.h of CPython.
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.py_object),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('strides', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('suboffsets', ctypes.POINTER(ctypes.c_ssize_t)),
+        ('internal', ctypes.c_void_p),
+    ]
+
+
+_PyBUF_SIMPLE = 0
+_PyBUF_WRITABLE = 1
+
+
+@contextmanager
+def _pointer(data: Bytes, writable: bool = False) -> Iterator[int]:
+    """Yields the address of a contiguous buffer, e.g. of a read-only mmap, without copying it."""
+    buffer = _PyBuffer()
+    ctypes.pythonapi.PyObject_GetBuffer(
+        ctypes.py_object(data), ctypes.byref(buffer),
+        _PyBUF_WRITABLE if writable else _PyBUF_SIMPLE
+    )
+    try:
+        yield buffer.buf
+    finally:
+        ctypes.pythonapi.PyBuffer_Release(ctypes.byref(buffer))
+
+
+def _address(data: MutableBytes) -> int:
+    return ctypes.addressof(ctypes.c_char.from_buffer(data))
+
+
+def _discover() -> Dict[str, Backend]:
+    backends = {DEFAULT_BACKEND: PycryptodomeBackend()}  # type: Dict[str, Backend]
+    for backend in (SodiumBackend.load(),):
+        if backend is not None:
+            backends[backend.name] = backend
+    return backends
+
+
+BACKENDS = _discover()
+_current = BACKENDS[DEFAULT_BACKEND]
+
+
+def new_cipher(key: Bytes, nonce: Bytes):
+    return _current.new(key, nonce)
+
+
+def get_backend() -> Backend:
+    return _current
+
+
+def set_backend(name: str) -> Backend:
+    """Chooses the backend by name or the fastest one by auto, see choose_fastest()."""
+    global _current
+    if name == AUTO_BACKEND:
+        name = choose_fastest()
+    if name not in BACKENDS:
+        raise ValueError('Unavailable backend `' + name + '`. Available: '
+                         + ', '.join(sorted(BACKENDS)) + '.')
+    _current = BACKENDS[name]
+    return _current
+
+
+def default_cache_path() -> str:
+    cache_directory = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_directory, 'cipher21', 'backend.json')
+
+
+def choose_fastest(cache_path: Optional[str] = None) -> str:
+    """
+    Returns the name of the backend which encrypts BENCHMARK_LENGTH bytes the fastest. The result
+    is cached in a JSON file and measured again when the backends, their versions or Python change.
+    """
+    import json  # Not needed on the start-up path of the default backend.
+    cache_path = cache_path or default_cache_path()
+    fingerprint = {
+        'python': sys.version,
+        'backends': {name: backend.version for name, backend in sorted(BACKENDS.items())},
+    }
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+        if cache.get('fingerprint') == fingerprint and cache.get('fastest') in BACKENDS:
+            return cache['fastest']
+    except (OSError, ValueError, AttributeError):
+        pass
+    seconds = {name: measure_backend(backend) for name, backend in BACKENDS.items()}
+    fastest = min(seconds, key=seconds.get)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'fastest': fastest, 'seconds': seconds}, f,
+                      indent=1)
+    except OSError:
+        pass
+    return fastest
+
+
+def measure_backend(backend: Backend, length: int = BENCHMARK_LENGTH,
+                    repeat: int = BENCHMARK_REPEAT) -> float:
+    """Returns the best time of encrypting and authenticating length bytes in seconds."""
+    key, nonce = os.urandom(_KEY_LENGTH), os.urandom(_XNONCE_LENGTH)
+    buffer = bytearray(length)
+    result = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        cipher = backend.new(key, nonce)
+        cipher.encrypt(buffer, buffer)
+        cipher.digest()
+        result = min(result, time.perf_counter() - start_time)
+    return result
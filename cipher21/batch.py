@@ -0,0 +1,218 @@
+import os
+import glob
+import stat
+import tempfile
+import time
+from io import IOBase
+import multiprocessing
+from multiprocessing.util import Finalize
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Sequence, Union
+
+from .operation_mode import OperationMode
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter
+from .null_stream import NullStream
+from . import blocking_io, mapped_io, verifier, rekey
+from .buffer_tuning import choose_buffer_size
+from .page_cache import drop_behind
+from .bytes_utils import clear_secret
+
+
+__all__ = (
+    'BatchResult',
+    'list_batch_files',
+    'process_files',
+    'process_file',
+    'process_streams',
+)
+
+
+ENCRYPTED_SUFFIX = '.c21'
+
+
+class BatchResult(NamedTuple):
+    path: str
+    output_path: Optional[str]
+    processing_time: float
+    stream_timestamp_ns: Optional[int] = None
+    payload_length: Optional[int] = None
+    mac: Optional[bytes] = None
+    error: Optional[str] = None
+
+
+def list_batch_files(source: str, mode: OperationMode, manifest: Optional[BinaryIO] = None,
+                     null_separated: bool = False) -> List[str]:
+    """
+    Lists the files of a directory, of a glob pattern or of a manifest read when the source is -.
+    Directories contribute the regular files they contain directly, only *.c21 ones when
+    decrypting, verifying or re-keying and all but *.c21 ones when encrypting.
+    """
+    if source == '-':
+        separator = b'\0' if null_separated else b'\n'
+        return [os.fsdecode(path) for path in manifest.read().split(separator) if path]
+    if os.path.isdir(source):
+        encrypted = mode is not OperationMode.ENCRYPTION
+        return sorted(
+            entry.path for entry in os.scandir(source)
+            if entry.is_file() and entry.name.endswith(ENCRYPTED_SUFFIX) == encrypted
+        )
+    return sorted(path for path in glob.glob(source) if os.path.isfile(path))
+
+
+def process_files(paths: Sequence[str], key: bytearray, mode: OperationMode, version: int = 1,
+                  after_ns: int = 0, buffer_size: Union[int, str] = blocking_io.BUFFER_SIZE,
+                  no_cache: bool = False, processes: Optional[int] = None,
+                  compression: Optional[str] = None, old_key: Optional[bytearray] = None,
+                  keep_timestamp: bool = False, backend: Optional[str] = None) \
+        -> Iterator[BatchResult]:
+    """
+    Processes the files on a pool of processes, which get the keys and choose the backend, see
+    backends.set_backend(), once at start-up. Yields the results in the order of the paths as soon
+    as they are available.
+    The processes are forked, so the keys are inherited rather than pickled through a pipe as the
+    spawn and forkserver start methods would do, and wiped as the processes exit. Platforms
+    without fork are refused.
+    """
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        raise ValueError('The batch processing requires the fork start method.')
+    with multiprocessing.get_context('fork').Pool(
+            processes, _initialize_worker, (key, old_key, backend)
+    ) as pool:
+        yield from pool.imap(
+            _process_in_worker,
+            ((path, mode, version, after_ns, buffer_size, no_cache, compression, keep_timestamp)
+             for path in paths)
+        )
+        # Terminating would kill the workers before their keys are wiped.
+        pool.close()
+        pool.join()
+
+
+_worker_key = bytearray()
+_worker_old_key = None  # type: Optional[bytearray]
+
+
+def _initialize_worker(key: bytearray, old_key: Optional[bytearray] = None,
+                       backend: Optional[str] = None) -> None:
+    global _worker_key, _worker_old_key
+    _worker_key, _worker_old_key = key, old_key
+    Finalize(None, _wipe_worker_keys, exitpriority=0)
+    if backend:
+        from .backends import set_backend
+        set_backend(backend)
+
+
+def _wipe_worker_keys() -> None:
+    clear_secret(_worker_key)
+    if _worker_old_key is not None:
+        clear_secret(_worker_old_key)
+
+
+def _process_in_worker(args) -> BatchResult:
+    return process_file(args[0], _worker_key, *args[1:-1], old_key=_worker_old_key,
+                        keep_timestamp=args[-1])
+
+
+def process_file(path: str, key: bytearray, mode: OperationMode, version: int = 1,
+                 after_ns: int = 0, buffer_size: Union[int, str] = blocking_io.BUFFER_SIZE,
+                 no_cache: bool = False, compression: Optional[str] = None,
+                 old_key: Optional[bytearray] = None, keep_timestamp: bool = False) -> BatchResult:
+    """
+    Encrypts into path.c21, decrypts a path.c21 into path, re-keys a path.c21 in place from the
+    old key to the key or verifies a file. Outputs are written to a temporary file which replaces
+    the output file only after a successful processing. Errors are reported in the result instead
+    of being raised.
+    """
+    start_time = time.monotonic()
+    output_path = None
+    try:
+        output_path = _get_output_path(path, mode)
+        with open(path, 'rb') as input_file:
+            if not stat.S_ISREG(os.fstat(input_file.fileno()).st_mode):
+                raise ValueError('Not a regular file.')
+            if output_path is None:
+                attrs = process_streams(NullStream(), input_file, key, mode, version, after_ns,
+                                        buffer_size, no_cache)
+            else:
+                attrs = _process_into_temporary(output_path, input_file, key, mode, version,
+                                                after_ns, buffer_size, no_cache, compression,
+                                                old_key, keep_timestamp)
+        return BatchResult(path, output_path, time.monotonic() - start_time,
+                           attrs.stream_timestamp_ns, attrs.payload_length, attrs.mac)
+    except Exception as e:
+        return BatchResult(path, output_path, time.monotonic() - start_time,
+                           error=str(e) or type(e).__name__)
+
+
+def _get_output_path(path: str, mode: OperationMode) -> Optional[str]:
+    if mode is OperationMode.ENCRYPTION:
+        return path + ENCRYPTED_SUFFIX
+    if mode is OperationMode.VERIFICATION:
+        return None
+    if mode is OperationMode.REKEYING:
+        return path
+    if not path.endswith(ENCRYPTED_SUFFIX) or len(os.path.basename(path)) == len(ENCRYPTED_SUFFIX):
+        raise ValueError('No ' + ENCRYPTED_SUFFIX + ' file name extension to strip.')
+    return path[:-len(ENCRYPTED_SUFFIX)]
+
+
+def _process_into_temporary(output_path: str, input_file: IOBase, key: bytearray,
+                            mode: OperationMode, version: int, after_ns: int,
+                            buffer_size: Union[int, str], no_cache: bool,
+                            compression: Optional[str] = None,
+                            old_key: Optional[bytearray] = None, keep_timestamp: bool = False):
+    directory, name = os.path.split(output_path)
+    fd, temporary_path = tempfile.mkstemp('.tmp', '.' + name + '.', directory or '.')
+    try:
+        with open(fd, 'w+b') as output_file:
+            attrs = process_streams(output_file, input_file, key, mode, version, after_ns,
+                                    buffer_size, no_cache, compression, old_key, keep_timestamp)
+        os.replace(temporary_path, output_path)
+        return attrs
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def process_streams(output_file: IOBase, input_file: IOBase, key: bytearray,
+                     mode: OperationMode, version: int, after_ns: int,
+                     buffer_size: Union[int, str], no_cache: bool,
+                     compression: Optional[str] = None, old_key: Optional[bytearray] = None,
+                     keep_timestamp: bool = False) \
+        -> Union[Encrypter, SegmentedEncrypter, Decrypter, SegmentedDecrypter]:
+    """Processes a single stream on a single thread, through memory mapping if possible."""
+    if no_cache:
+        input_file = drop_behind(input_file, False)
+        output_file = drop_behind(output_file, True)
+    if buffer_size == 'auto':
+        buffer_size = choose_buffer_size(input_file, output_file)
+    # Parallelism comes from the process pool, so every file gets a single thread.
+    if mode is OperationMode.ENCRYPTION:
+        if not compression and mapped_io.is_mappable(output_file, input_file):
+            attrs = mapped_io.encrypt_file(output_file, input_file, key, version, 1)
+        else:
+            attrs = blocking_io.encrypt_stream(output_file, input_file, key, buffer_size,
+                                               version, 1, compression=compression)
+    elif mode is OperationMode.REKEYING:
+        if old_key is None:
+            raise ValueError('Re-keying requires the old key.')
+        attrs = rekey.rekey_stream(output_file, input_file, old_key, key, version, buffer_size,
+                                   after_ns=after_ns, keep_timestamp=keep_timestamp)
+    else:
+        # The streams encrypted too early are rejected right after their headers.
+        if mode is OperationMode.VERIFICATION:
+            if verifier.is_mappable(input_file):
+                attrs = verifier.verify_file(input_file, key, 1, after_ns)
+            else:
+                attrs = verifier.verify_stream(input_file, key, buffer_size, 1, after_ns=after_ns)
+        elif mapped_io.is_mappable(output_file, input_file):
+            attrs = mapped_io.decrypt_file(output_file, input_file, key, 1, after_ns)
+        else:
+            attrs = blocking_io.decrypt_stream(output_file, input_file, key, buffer_size, 1,
+                                               after_ns=after_ns)
+    for stream in (input_file, output_file):
+        if hasattr(stream, 'finish'):
+            stream.finish()
+    return attrs
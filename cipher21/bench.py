@@ -0,0 +1,628 @@
+"""
+Benchmarks of cipher21. Run as: python -m cipher21.bench [run|compare|bytes-utils|messages] --help
+
+The run command measures encryption, decryption and verification throughput, peak RSS and peak
+tracemalloc usage in-process and through the command line application, its start-up time and the
+per-call cost of clear_secret(), Cipher21Key construction and the one-shot encryption and
+decryption of small messages against the stream path. With --compress, encryption with
+the built-in compression is compared with an external compressor piped into the application.
+The results are written as JSON, which the compare command checks against a baseline run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from io import BytesIO, RawIOBase
+from random import SystemRandom
+from timeit import Timer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .bytes_utils import clear_secret, count_unique_bytes, differentiate_bytes, unhexlify
+from .constants import KEY_LENGTH
+from .key import Cipher21Key
+from .null_stream import NullStream
+from .stats import peak_rss
+from . import blocking_io, oneshot, verifier
+
+
+RESULTS_FORMAT = 1
+DEFAULT_SIZES = '0,64K,16M,256M'
+DEFAULT_BUFFER_SIZES = '32K,1M'
+DEFAULT_TOLERANCE = 0.1
+# Peak memory differences below this are allocator noise rather than regressions.
+MEMORY_SLACK = 2**20
+PATTERN_LENGTH = 2**20
+MESSAGE_SIZES = (100, 2**10, 2**12, 2**14)
+SIZE_RE = re.compile(r'(?P<number>[0-9]+)(?P<unit>[KMG]?)')
+
+
+_rng = SystemRandom()
+
+
+def _per_byte_clear_secret(secret: bytearray) -> None:
+    for i in range(len(secret)):
+        secret[i] = 0xFF
+    for i in range(len(secret)):
+        secret[i] = 0x00
+    for i in range(len(secret)):
+        secret[i] = _rng.getrandbits(8)
+
+
+def _per_byte_count_unique_bytes(b: bytes) -> int:
+    occurrences = bytearray(256)
+    for x in b:
+        occurrences[x] = 1
+    result = sum(occurrences)
+    _per_byte_clear_secret(occurrences)
+    return result
+
+
+def _per_byte_differentiate_bytes(b: bytes) -> bytearray:
+    derivative = bytearray(len(b) - 1)
+    for i in range(1, len(b)):
+        derivative[i-1] = (b[i] - b[i-1]) & 0xFF
+    return derivative
+
+
+def _per_byte_unhexlify(hexes: bytes) -> bytearray:
+    ignored_bytes = frozenset(ord(c) for c in '\t\n\v\f\r .,:;-')
+    x = bytearray(1)
+    buffer = bytearray(len(hexes) // 2 + 1)
+    buffer_idx = 0
+    first_digit = True
+    try:
+        for hexes_idx in range(len(hexes)):
+            if ord('0') <= hexes[hexes_idx] <= ord('9'):
+                x[0] = hexes[hexes_idx] - ord('0')
+            elif ord('A') <= hexes[hexes_idx] <= ord('F'):
+                x[0] = hexes[hexes_idx] - ord('A') + 10
+            elif ord('a') <= hexes[hexes_idx] <= ord('f'):
+                x[0] = hexes[hexes_idx] - ord('a') + 10
+            elif hexes[hexes_idx] in ignored_bytes:
+                continue
+            else:
+                raise ValueError('Invalid hexadecimal symbol.')
+            if first_digit:
+                buffer[buffer_idx] = 16 * x[0]
+            else:
+                buffer[buffer_idx] += x[0]
+                buffer_idx += 1
+            first_digit = not first_digit
+        return bytearray(buffer[0:buffer_idx])
+    finally:
+        _per_byte_clear_secret(buffer)
+        _per_byte_clear_secret(x)
+
+
+def measure(function: Callable[[], object], min_time: float = 0.2) -> float:
+    """Returns the best time of a single call in seconds."""
+    timer = Timer(function)
+    number, _ = timer.autorange()
+    number = max(1, int(number * min_time / 0.2))
+    return min(timer.repeat(repeat=3, number=number)) / number
+
+
+def bytes_utils_cases(sizes: Iterable[int] = (32, 2**15, 2**20)) \
+        -> Iterable[Tuple[str, int, Callable[[], object], Callable[[], object]]]:
+    """Yields (name, size, per-byte reference, current implementation) tuples."""
+    for size in sizes:
+        buffer = bytearray(size)
+        data = bytes(_rng.getrandbits(8) for _ in range(size))
+        hexes = data.hex().encode()
+        yield 'clear_secret', size, \
+            lambda b=buffer: _per_byte_clear_secret(b), lambda b=buffer: clear_secret(b)
+        yield 'count_unique_bytes', size, \
+            lambda d=data: _per_byte_count_unique_bytes(d), lambda d=data: count_unique_bytes(d)
+        yield 'differentiate_bytes', size, \
+            lambda d=data: _per_byte_differentiate_bytes(d), lambda d=data: differentiate_bytes(d)
+        yield 'unhexlify', size, \
+            lambda h=hexes: _per_byte_unhexlify(h), lambda h=hexes: unhexlify(h)
+
+
+def bytes_utils_table() -> int:
+    print('{:<20} {:>8} {:>14} {:>14} {:>8}'.format(
+        'function', 'size', 'per-byte [us]', 'current [us]', 'speedup'
+    ))
+    for name, size, reference, current in bytes_utils_cases():
+        reference_time, current_time = measure(reference), measure(current)
+        print('{:<20} {:>8} {:>14.1f} {:>14.1f} {:>7.1f}x'.format(
+            name, size, 1e6 * reference_time, 1e6 * current_time, reference_time / current_time
+        ))
+    return 0
+
+
+def message_cases(sizes: Iterable[int] = MESSAGE_SIZES) \
+        -> Iterable[Tuple[str, int, Callable[[], object], Callable[[], object]]]:
+    """Yields (operation, size, stream path, one-shot function) tuples of whole messages."""
+    key = bytes(_rng.getrandbits(8) for _ in range(KEY_LENGTH))
+    for size in sizes:
+        data = bytes(_rng.getrandbits(8) for _ in range(size))
+        blob = bytes(oneshot.encrypt_bytes(data, key))
+        stream_output = bytearray(oneshot.encrypted_length(size))
+        payload_output = bytearray(size)
+        yield 'encrypt', size, \
+            lambda d=data: blocking_io.encrypt_stream(BytesIO(), BytesIO(d), key), \
+            lambda d=data, o=stream_output: oneshot.encrypt_bytes(d, key, o)
+        yield 'decrypt', size, \
+            lambda b=blob: blocking_io.decrypt_stream(BytesIO(), BytesIO(b), key), \
+            lambda b=blob, o=payload_output: oneshot.decrypt_into(b, key, o)
+
+
+def messages_table() -> int:
+    print('{:<10} {:>8} {:>16} {:>16} {:>8}'.format(
+        'operation', 'size', 'stream [rec/s]', 'one-shot [rec/s]', 'speedup'
+    ))
+    for operation, size, stream, current in message_cases():
+        stream_time, current_time = measure(stream), measure(current)
+        print('{:<10} {:>8} {:>16,.0f} {:>16,.0f} {:>7.1f}x'.format(
+            operation, size, 1 / stream_time, 1 / current_time, stream_time / current_time
+        ))
+    return 0
+
+
+class Result(dict):
+    """A JSON object of a single measurement identified by name, mode, size, buffer and version."""
+
+    KEY_FIELDS = ('name', 'mode', 'size', 'buffer_size', 'version')
+
+    def __init__(self, name: str, mode: str, size: int, seconds: float,
+                 buffer_size: Optional[int] = None, version: Optional[int] = None,
+                 peak_rss: Optional[int] = None, peak_tracemalloc: Optional[int] = None):
+        super().__init__(
+            name=name, mode=mode, size=size, buffer_size=buffer_size, version=version,
+            seconds=seconds, throughput=size / seconds / 1e6 if size and seconds else None,
+            peak_rss=peak_rss, peak_tracemalloc=peak_tracemalloc
+        )
+
+    @classmethod
+    def key(cls, result: dict) -> tuple:
+        return tuple(result.get(field) for field in cls.KEY_FIELDS)
+
+
+def parse_size(text: str) -> int:
+    match = SIZE_RE.fullmatch(text.strip())
+    if not match:
+        raise argparse.ArgumentTypeError('Malformed size: ' + text)
+    return int(match.group('number')) * {'': 1, 'K': 2**10, 'M': 2**20, 'G': 2**30}[
+        match.group('unit')
+    ]
+
+
+def parse_sizes(text: str) -> List[int]:
+    return [parse_size(size) for size in text.split(',')]
+
+
+def format_size(size: Optional[int]) -> str:
+    if size is None:
+        return '-'
+    for unit, multiplier in (('G', 2**30), ('M', 2**20), ('K', 2**10)):
+        if size >= multiplier and size % multiplier == 0:
+            return str(size // multiplier) + unit
+    return str(size)
+
+
+class PatternStream(RawIOBase):
+    """
+    Reads the given number of bytes repeating a random pattern, without holding them all.
+    The compressible pattern consists of random words from a small vocabulary instead.
+    """
+
+    def __init__(self, size: int, compressible: bool = False):
+        super().__init__()
+        self._remaining = size
+        if compressible:
+            letters = b'abcdefghijklmnopqrstuvwxyz'
+            words = [bytes(_rng.choice(letters) for _ in range(_rng.randint(1, 9)))
+                     for _ in range(1000)]
+            pattern = bytearray()
+            while len(pattern) < PATTERN_LENGTH:
+                pattern += _rng.choice(words) + _rng.choice((b' ', b' ', b' ', b', ', b'.\n'))
+            self._pattern = bytes(pattern[:PATTERN_LENGTH])
+        else:
+            self._pattern = bytes(_rng.getrandbits(8) for _ in range(PATTERN_LENGTH))
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        with memoryview(b) as view:
+            length = min(len(view), self._remaining, PATTERN_LENGTH)
+            view[:length] = self._pattern[:length]
+            self._remaining -= length
+            return length
+
+
+def reset_peak_rss() -> None:
+    """Resets VmHWM on Linux. Elsewhere the peak RSS stays the high-water mark of the process."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+# Runs the application reporting its own peak RSS, as ru_maxrss of a child survives fork and exec.
+_CHILD_CODE = """
+import atexit, runpy, sys
+def report_peak_rss():
+    try:
+        with open('/proc/self/status') as f:
+            sys.stderr.write(''.join(line for line in f if line.startswith('VmHWM:')))
+    except OSError:
+        pass
+atexit.register(report_peak_rss)
+runpy.run_module('cipher21.application', run_name='__main__', alter_sys=True)
+"""
+
+
+def run_child(args: Sequence[str], env: Dict[str, str]) -> Tuple[float, Optional[int]]:
+    """Runs the application with the arguments. Returns its wall time and peak RSS."""
+    start_time = time.perf_counter()
+    process = subprocess.run((sys.executable, '-c', _CHILD_CODE) + tuple(args),
+                             stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, env=env)
+    seconds = time.perf_counter() - start_time
+    error = process.stderr.decode(errors='replace')
+    if process.returncode:
+        raise RuntimeError('cipher21 {} failed: {}'.format(' '.join(args), error))
+    rss = None
+    for line in error.splitlines():
+        if line.startswith('VmHWM:'):
+            rss = int(line.split()[1]) * 2**10
+    return seconds, rss
+
+
+def measure_in_process(function: Callable[[], object], min_time: float) \
+        -> Tuple[float, Optional[int], int]:
+    """Returns the best time of a call, the peak RSS and the peak tracemalloc usage of a call."""
+    seconds = measure(function, min_time)
+    reset_peak_rss()
+    function()
+    rss = peak_rss()
+    tracemalloc.start()
+    try:
+        function()
+        _, traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return seconds, rss, traced
+
+
+def _child_env(key: bytes) -> Dict[str, str]:
+    env = dict(os.environ, CIPHER21_BENCH_KEY=key.hex())
+    env['PYTHONPATH'] = os.pathsep.join(
+        filter(None, (os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      env.get('PYTHONPATH')))
+    )
+    return env
+
+
+_KEY_ARGS = ('-k', 'env:CIPHER21_BENCH_KEY')
+
+
+def _write_pattern_file(path: str, size: int, compressible: bool = False) -> None:
+    with open(path, 'wb') as f:
+        stream = PatternStream(size, compressible)
+        chunk = stream.read(PATTERN_LENGTH)
+        while chunk:
+            f.write(chunk)
+            chunk = stream.read(PATTERN_LENGTH)
+
+
+def run_streams(directory: str, key: bytes, sizes: Sequence[int], buffer_sizes: Sequence[int],
+                versions: Sequence[int], cli: bool, min_time: float, repeat: int,
+                log: Callable[[str], None]) -> Iterable[Result]:
+    env = _child_env(key)
+    key_args = _KEY_ARGS
+    for size in sizes:
+        plain_path = os.path.join(directory, 'plain')
+        log('preparing ' + format_size(size) + ' B')
+        _write_pattern_file(plain_path, size)
+        for version in versions:
+            encrypted_path = os.path.join(directory, 'encrypted')
+            with open(plain_path, 'rb') as plain, open(encrypted_path, 'wb') as encrypted:
+                blocking_io.encrypt_stream(encrypted, plain, key, version=version)
+            for buffer_size in buffer_sizes:
+                operations = (
+                    ('encrypt', plain_path, lambda i, o: blocking_io.encrypt_stream(
+                        o, i, key, buffer_size, version), os.devnull, '-e'),
+                    ('decrypt', encrypted_path, lambda i, o: blocking_io.decrypt_stream(
+                        o, i, key, buffer_size), os.devnull, '-d'),
+                    ('verify', encrypted_path, lambda i, o: verifier.verify_stream(
+                        i, key, buffer_size), None, '-v'),
+                    # The verification path preceding the MAC-only verifier, for comparison.
+                    ('verify-by-decryption', encrypted_path, lambda i, o: blocking_io.decrypt_stream(
+                        o, i, key, buffer_size), None, None),
+                )
+                for name, input_path, process, output_path, flag in operations:
+                    log('{} {} B, buffer {}, version {}'.format(
+                        name, format_size(size), format_size(buffer_size), version
+                    ))
+                    seconds, rss, traced = measure_in_process(
+                        lambda: _process_files(process, input_path, output_path), min_time
+                    )
+                    yield Result(name, 'in-process', size, seconds, buffer_size, version,
+                                 rss, traced)
+                    if not cli or flag is None:
+                        continue
+                    args = key_args + (flag, '-i', input_path, '--buffer-size',
+                                          str(buffer_size), '--stream-version', str(version))
+                    if output_path:
+                        args += ('-o', output_path)
+                    runs = [run_child(args, env) for _ in range(repeat)]
+                    yield Result(name, 'cli', size, min(r[0] for r in runs), buffer_size, version,
+                                 _max_optional(r[1] for r in runs))
+    if cli:
+        log('start-up')
+        runs = [run_child(key_args + ('-e',), env) for _ in range(repeat)]
+        yield Result('startup', 'cli', 0, min(r[0] for r in runs),
+                     peak_rss=_max_optional(r[1] for r in runs))
+
+
+# The command line compressors writing the same formats as the codecs, for the pipe setup.
+EXTERNAL_COMPRESSORS = {'zlib': ('gzip', '-c'), 'bz2': ('bzip2', '-c'), 'lzma': ('xz', '-zc')}
+
+
+def run_compression(directory: str, key: bytes, sizes: Sequence[int], codecs: Sequence[str],
+                    cli: bool, min_time: float, repeat: int, log: Callable[[str], None]) \
+        -> Iterable[Result]:
+    """
+    Measures encryption of compressible payloads with --compress in-process and through the
+    application, and through an external compressor piped into the application. The results
+    are named after the codec and the pipe ones have the pipe mode.
+    """
+    from .compression import parse_compression
+    env = _child_env(key)
+    for size in sizes:
+        plain_path = os.path.join(directory, 'plain-text')
+        log('preparing compressible ' + format_size(size) + ' B')
+        _write_pattern_file(plain_path, size, True)
+        for compression in codecs:
+            codec, level = parse_compression(compression)
+            name = 'encrypt+' + compression
+            log('{} {} B'.format(name, format_size(size)))
+            seconds, rss, traced = measure_in_process(lambda: _process_files(
+                lambda i, o: blocking_io.encrypt_stream(o, i, key, version=2,
+                                                        compression=compression),
+                plain_path, os.devnull
+            ), min_time)
+            yield Result(name, 'in-process', size, seconds, None, 2, rss, traced)
+            if not cli:
+                continue
+            args = _KEY_ARGS + ('-e', '--compress', compression, '-i', plain_path,
+                                '-o', os.devnull)
+            runs = [run_child(args, env) for _ in range(repeat)]
+            yield Result(name, 'cli', size, min(r[0] for r in runs), None, 2,
+                         _max_optional(r[1] for r in runs))
+            compressor = EXTERNAL_COMPRESSORS[codec]
+            if shutil.which(compressor[0]) is None:
+                log('skipping the pipe from ' + compressor[0] + ', which is not installed')
+                continue
+            if level is not None:
+                compressor += ('-' + str(max(1, level)),)  # gzip has no level 0.
+            runs = [run_pipe(compressor, plain_path, _KEY_ARGS + ('-e', '--stream-version', '2'),
+                             env) for _ in range(repeat)]
+            yield Result(name, 'pipe', size, min(runs), None, 2)
+
+
+def run_pipe(compressor: Sequence[str], input_path: str, args: Sequence[str],
+             env: Dict[str, str]) -> float:
+    """Runs the compressor piped into the application with the arguments. Returns the wall time."""
+    start_time = time.perf_counter()
+    with open(input_path, 'rb') as input_file:
+        compressing = subprocess.Popen(compressor, stdin=input_file, stdout=subprocess.PIPE)
+        encrypting = subprocess.Popen((sys.executable, '-m', 'cipher21.application') + tuple(args),
+                                      stdin=compressing.stdout, stdout=subprocess.DEVNULL,
+                                      stderr=subprocess.PIPE, env=env)
+        compressing.stdout.close()
+        _, error = encrypting.communicate()
+        compressing.wait()
+    seconds = time.perf_counter() - start_time
+    if compressing.returncode or encrypting.returncode:
+        raise RuntimeError('{} | cipher21 {} failed: {}'.format(
+            ' '.join(compressor), ' '.join(args), error.decode(errors='replace')
+        ))
+    return seconds
+
+
+def _max_optional(values: Iterable[Optional[int]]) -> Optional[int]:
+    return max((v for v in values if v is not None), default=None)
+
+
+def _process_files(process: Callable, input_path: str, output_path: Optional[str]) -> None:
+    with open(input_path, 'rb', buffering=0) as input_stream:
+        if output_path is None:
+            process(input_stream, NullStream())
+        else:
+            with open(output_path, 'wb', buffering=0) as output_stream:
+                process(input_stream, output_stream)
+
+
+def run_calls(min_time: float, log: Callable[[str], None]) -> Iterable[Result]:
+    for size in (KEY_LENGTH, 2**12, 2**20):
+        log('clear_secret ' + format_size(size) + ' B')
+        secret = bytearray(size)
+        yield Result('clear_secret', 'call', size, measure(lambda: clear_secret(secret), min_time))
+    key = bytes(_rng.getrandbits(8) for _ in range(KEY_LENGTH))
+    hexes = key.hex().encode()
+    log('Cipher21Key')
+    yield Result('Cipher21Key.from_bytes', 'call', KEY_LENGTH,
+                 measure(lambda: Cipher21Key.from_bytes(key).clear(), min_time))
+    yield Result('Cipher21Key.from_hexes', 'call', len(hexes),
+                 measure(lambda: Cipher21Key.from_hexes(hexes).clear(), min_time))
+    for operation, size, stream, current in message_cases():
+        log(operation + ' message ' + format_size(size) + ' B')
+        yield Result(operation + '_stream', 'message', size, measure(stream, min_time))
+        yield Result(operation + '_bytes', 'message', size, measure(current, min_time))
+
+
+def run(parsed_args: argparse.Namespace) -> int:
+    log = (lambda message: None) if parsed_args.quiet else \
+        (lambda message: print(message, file=sys.stderr, flush=True))
+    key = bytes(_rng.getrandbits(8) for _ in range(KEY_LENGTH))
+    results = list(run_calls(parsed_args.min_time, log))
+    with tempfile.TemporaryDirectory(prefix='cipher21-bench-', dir=parsed_args.directory) as d:
+        results.extend(run_streams(
+            d, key, parsed_args.sizes, parsed_args.buffer_sizes, parsed_args.stream_versions,
+            not parsed_args.no_cli, parsed_args.min_time, parsed_args.repeat, log
+        ))
+        results.extend(run_compression(
+            d, key, parsed_args.sizes, parsed_args.compress, not parsed_args.no_cli,
+            parsed_args.min_time, parsed_args.repeat, log
+        ))
+    document = {
+        'format': RESULTS_FORMAT,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as f:
+            json.dump(document, f, indent=1)
+    print_results(results)
+    return 0
+
+
+def print_results(results: Sequence[dict]) -> None:
+    print('{:<24} {:<10} {:>6} {:>6} {:>3} {:>12} {:>10} {:>10} {:>10}'.format(
+        'name', 'mode', 'size', 'buffer', 'v', 'time [ms]', 'MB/s', 'RSS [MiB]', 'heap [MiB]'
+    ))
+    for r in results:
+        print('{:<24} {:<10} {:>6} {:>6} {:>3} {:>12.3f} {:>10} {:>10} {:>10}'.format(
+            r['name'], r['mode'], format_size(r['size']), format_size(r['buffer_size']),
+            r['version'] or '-', 1e3 * r['seconds'], _format_optional(r['throughput'], 1),
+            _format_optional(r['peak_rss'], 1, 2**20),
+            _format_optional(r['peak_tracemalloc'], 2, 2**20)
+        ))
+
+
+def _format_optional(value: Optional[float], precision: int, divisor: int = 1) -> str:
+    return '-' if value is None else '{:.{}f}'.format(value / divisor, precision)
+
+
+def compare_results(baseline: Sequence[dict], current: Sequence[dict],
+                    tolerance: float = DEFAULT_TOLERANCE) -> List[Tuple[dict, dict, List[str]]]:
+    """
+    Pairs up the measurements of both runs. Returns (baseline, current, regressions) tuples,
+    where regressions name the fields which got worse by more than the tolerance.
+    """
+    baseline = {Result.key(r): r for r in baseline}
+    comparison = []
+    for new in current:
+        old = baseline.get(Result.key(new))
+        if old is None:
+            continue
+        regressions = []
+        if new['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append('time')
+        for field in ('peak_rss', 'peak_tracemalloc'):
+            if old.get(field) is not None and new.get(field) is not None \
+                    and new[field] > old[field] * (1 + tolerance) + MEMORY_SLACK:
+                regressions.append(field)
+        comparison.append((old, new, regressions))
+    return comparison
+
+
+def compare(parsed_args: argparse.Namespace) -> int:
+    documents = []
+    for path in (parsed_args.baseline, parsed_args.current):
+        with open(path) as f:
+            document = json.load(f)
+        if document.get('format') != RESULTS_FORMAT:
+            raise ValueError('Unsupported results format: ' + path)
+        documents.append(document)
+    comparison = compare_results(documents[0]['results'], documents[1]['results'],
+                                 parsed_args.tolerance)
+    print('{:<24} {:<10} {:>6} {:>6} {:>3} {:>12} {:>12} {:>8}  {}'.format(
+        'name', 'mode', 'size', 'buffer', 'v', 'base [ms]', 'current [ms]', 'change', 'regressions'
+    ))
+    regressions = 0
+    for old, new, fields in comparison:
+        print('{:<24} {:<10} {:>6} {:>6} {:>3} {:>12.3f} {:>12.3f} {:>+7.1f}%  {}'.format(
+            new['name'], new['mode'], format_size(new['size']), format_size(new['buffer_size']),
+            new['version'] or '-', 1e3 * old['seconds'], 1e3 * new['seconds'],
+            100 * (new['seconds'] / old['seconds'] - 1) if old['seconds'] else 0.0,
+            ', '.join(fields)
+        ))
+        regressions += bool(fields)
+    print('compared: {:,}, regressions: {:,}'.format(len(comparison), regressions))
+    return 1 if regressions else 0
+
+
+def create_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m cipher21.bench')
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser(
+        'run', help='Measure and print the results, optionally writing them as JSON. Default.'
+    )
+    run_parser.add_argument(
+        '--sizes', type=parse_sizes, default=parse_sizes(DEFAULT_SIZES),
+        help='Comma separated payload sizes with an optional K, M or G binary suffix. Plain and '
+             'encrypted payloads are stored in a temporary directory. Default: ' + DEFAULT_SIZES)
+    run_parser.add_argument(
+        '--buffer-sizes', type=parse_sizes, default=parse_sizes(DEFAULT_BUFFER_SIZES),
+        help='Comma separated I/O buffer sizes. Default: ' + DEFAULT_BUFFER_SIZES)
+    run_parser.add_argument(
+        '--stream-versions', type=lambda t: [int(v) for v in t.split(',')], default=[1],
+        help='Comma separated stream format versions. Default: 1')
+    run_parser.add_argument(
+        '--compress', type=lambda t: t.split(','), default=[],
+        help='Comma separated CODEC[:LEVEL] values of --compress to compare with the external '
+             'gzip, bzip2 or xz piped into the application, on a compressible payload. '
+             'Default: none')
+    run_parser.add_argument(
+        '--no-cli', action='store_true', help='Skip the command line application runs.')
+    run_parser.add_argument(
+        '--repeat', type=int, default=3, help='Command line application runs per measurement.')
+    run_parser.add_argument(
+        '--min-time', type=float, default=0.2,
+        help='Minimal duration of an in-process measurement in seconds.')
+    run_parser.add_argument('--directory', help='Parent of the temporary directory.')
+    run_parser.add_argument('-o', '--output', help='JSON results file.')
+    run_parser.add_argument('-q', '--quiet', action='store_true', help='Do not log progress.')
+    compare_parser = commands.add_parser(
+        'compare', help='Compare two JSON results files. Exits with 1 on a regression.'
+    )
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help='Allowed relative slowdown or memory growth. Default: ' + str(DEFAULT_TOLERANCE))
+    commands.add_parser(
+        'bytes-utils', help='Compare bytes_utils with the per-byte reference implementations.'
+    )
+    commands.add_parser(
+        'messages', help='Compare records per second of the one-shot functions of whole '
+                         'messages with the stream path.'
+    )
+    return parser
+
+
+def main(args: Optional[Sequence[str]] = None) -> int:
+    parser = create_argument_parser()
+    args = list(sys.argv[1:] if args is None else args)
+    if not args or args[0].startswith('-') and args[0] not in ('-h', '--help'):
+        args.insert(0, 'run')
+    parsed_args = parser.parse_args(args)
+    if parsed_args.command == 'compare':
+        return compare(parsed_args)
+    if parsed_args.command == 'bytes-utils':
+        return bytes_utils_table()
+    if parsed_args.command == 'messages':
+        return messages_table()
+    return run(parsed_args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,69 @@
+import os
+import selectors
 from time import sleep
 from io import RawIOBase
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, Union
 
-from .constants import STREAM_HEADER_LENGTH, STREAM_LENGTH_MULTIPLICAND
+from .constants import *
 from .encrypter import Encrypter
 from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter
 from .bytes_utils import clear_secret
+from .buffer_pool import SecureBufferPool, acquire_buffer, release_buffer
 from .typing import Bytes, MutableBytes
 
 
 __all__ = (
     'encrypt_stream',
     'decrypt_stream',
+    'check_buffer_size',
+    'create_decrypter',
 )
 
 
-def encrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes) -> Encrypter:
-    input_buffer = bytearray(BUFFER_SIZE)
+SLEEP_INTERVAL = 1 / 32
+
+
+def check_buffer_size(buffer_size: int) -> int:
+    if buffer_size <= 0 or buffer_size % STREAM_LENGTH_MULTIPLICAND:
+        raise ValueError(
+            'Buffer size must be a positive multiple of ' + str(STREAM_LENGTH_MULTIPLICAND) + ' bytes.'
+        )
+    return buffer_size
+
+
+def check_stream_version(version: int) -> int:
+    if version not in (1, 2):
+        raise ValueError('Unsupported stream version ' + str(version) + '.')
+    return version
+
+
+def encrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes,
+                   buffer_size: int = BUFFER_SIZE, version: int = 1,
+                   workers: Optional[int] = None, buffer_pool: Optional[SecureBufferPool] = None,
+                   compression: Optional[str] = None) -> Union[Encrypter, SegmentedEncrypter]:
+    """
+    The compression is a CODEC[:LEVEL] of zlib, bz2 or lzma, applied on worker threads before
+    the encryption. It requires the stream version 2, whose header records the codec.
+    """
+    check_buffer_size(buffer_size)
+    if compression and version != 2:
+        raise ValueError('Compression requires the stream version 2.')
+    if check_stream_version(version) == 2:
+        if compression:
+            from .compression import CompressingReader
+            with CompressingReader(input_stream, compression, workers) as reader:
+                encrypter = _encrypt_segmented_stream(output_stream, reader, key, workers,
+                                                      buffer_pool, reader.codec)
+                encrypter.uncompressed_length = reader.input_length
+                return encrypter
+        return _encrypt_segmented_stream(output_stream, input_stream, key, workers, buffer_pool)
+    input_buffer = acquire_buffer(buffer_pool, buffer_size)
     input_view = memoryview(input_buffer)
-    output_buffer = bytearray(BUFFER_SIZE)
+    output_buffer = acquire_buffer(buffer_pool, buffer_size)
     output_view = memoryview(output_buffer)
     try:
         length = read_all(input_buffer, input_stream)
@@ -30,45 +76,185 @@ def encrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes
             )
             length = read_all(input_buffer, input_stream)
     finally:
-        clear_secret(input_buffer)
+        release_buffer(buffer_pool, input_buffer)
+        release_buffer(buffer_pool, output_buffer)
     write_all(output_stream, encrypter.finalize())
     return encrypter
 
 
-def decrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes) -> Decrypter:
-    decrypter = _create_decrypter(input_stream, key)
-    prev_buffer = bytearray(BUFFER_SIZE)
-    prev_length = read_all(prev_buffer, input_stream)
-    next_buffer = bytearray(BUFFER_SIZE)
-    next_length = read_all(next_buffer, input_stream)
-    out_buffer = bytearray(BUFFER_SIZE)
+def decrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes,
+                   buffer_size: int = BUFFER_SIZE, workers: Optional[int] = None,
+                   buffer_pool: Optional[SecureBufferPool] = None, after_ns: Optional[int] = None) \
+        -> Union[Decrypter, SegmentedDecrypter]:
+    check_buffer_size(buffer_size)
+    decrypter = create_decrypter(input_stream, key, after_ns)
+    if isinstance(decrypter, SegmentedDecrypter):
+        return _decrypt_segmented_stream(output_stream, input_stream, decrypter, workers,
+                                         buffer_pool)
+    prev_buffer = acquire_buffer(buffer_pool, buffer_size)
+    next_buffer = acquire_buffer(buffer_pool, buffer_size)
+    out_buffer = acquire_buffer(buffer_pool, buffer_size)
+    final_buffer = bytearray()
     try:
+        prev_length = read_all(prev_buffer, input_stream)
+        next_length = read_all(next_buffer, input_stream)
         while next_length == len(next_buffer):
             assert prev_length == next_length, (prev_length, next_length)
             decrypter.process_chunk(prev_buffer, out_buffer)
             write_all(output_stream, out_buffer)
             prev_buffer, next_buffer = next_buffer, prev_buffer
             next_length = read_all(next_buffer, input_stream)
-        clear_secret(out_buffer)
-        out_buffer = decrypter.finalize(prev_buffer[:prev_length] + next_buffer[:next_length])
-        write_all(output_stream, out_buffer)
+        final_buffer = decrypter.finalize(
+            b''.join((prev_buffer[:prev_length], next_buffer[:next_length]))
+        )
+        write_all(output_stream, final_buffer)
     finally:
-        clear_secret(out_buffer)
+        clear_secret(final_buffer)
+        for buffer in (prev_buffer, next_buffer, out_buffer):
+            release_buffer(buffer_pool, buffer)
     return decrypter
 
 
-def _create_decrypter(input_stream: RawIOBase, key: bytes) -> Decrypter:
-    buffer = bytearray(STREAM_HEADER_LENGTH)
-    length = read_all(buffer, input_stream)
-    if length != STREAM_HEADER_LENGTH:
+def create_decrypter(input_stream: RawIOBase, key: bytes, after_ns: Optional[int] = None,
+                     classes: Tuple[type, type] = (Decrypter, SegmentedDecrypter)) \
+        -> Union[Decrypter, SegmentedDecrypter]:
+    """Reads the header and initializes the one of the version 1 and 2 classes it belongs to."""
+    buffer = bytearray(STREAM_V2_HEADER_LENGTH)
+    view = memoryview(buffer)
+    length = read_all(view[:STREAM_SIGNATURE_LENGTH], input_stream)
+    if buffer.startswith(STREAM_V2_SIGNATURE):
+        decrypter, header_length = classes[1](key, after_ns), STREAM_V2_HEADER_LENGTH
+    else:
+        decrypter, header_length = classes[0](key, after_ns), STREAM_HEADER_LENGTH
+    length += read_all(view[length:header_length], input_stream)
+    if length != header_length:
         raise ValueError('Not enough data.')
-    decrypted = Decrypter(key)
-    decrypted.initialize(buffer)
-    return decrypted
+    decrypter.initialize(buffer[:header_length])
+    return decrypter
 
 
-BUFFER_SIZE = 2 * STREAM_LENGTH_MULTIPLICAND
-SLEEP_INTERVAL = 1 / 32
+def _encrypt_segmented_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes,
+                              workers: Optional[int], buffer_pool: Optional[SecureBufferPool],
+                              compression: Optional[str] = None) -> SegmentedEncrypter:
+    with _SegmentPool(output_stream, SEGMENT_PAYLOAD_LENGTH, SEGMENT_LENGTH, workers,
+                      buffer_pool) as pool:
+        chunk = pool.acquire_input()
+        length = read_all(chunk, input_stream)
+        encrypter = SegmentedEncrypter(key)
+        write_all(output_stream, encrypter.initialize(compression=compression))
+        index = 0
+        while length == len(chunk):
+            next_chunk = pool.acquire_input()
+            next_length = read_all(next_chunk, input_stream)
+            if not next_length:
+                break
+            pool.submit(encrypter.encrypt_segment, index, chunk)
+            index += 1
+            chunk, length = next_chunk, next_length
+        pool.drain()
+        write_all(output_stream, encrypter.finalize(index, memoryview(chunk)[:length]))
+    return encrypter
+
+
+def _decrypt_segmented_stream(output_stream: RawIOBase, input_stream: RawIOBase,
+                              decrypter: SegmentedDecrypter, workers: Optional[int],
+                              buffer_pool: Optional[SecureBufferPool] = None) -> SegmentedDecrypter:
+    out_buffer = bytearray()
+    if decrypter.compression:
+        from .compression import DecompressingWriter
+        output_stream = DecompressingWriter(output_stream, decrypter.compression)
+    try:
+        with _SegmentPool(output_stream, SEGMENT_LENGTH, SEGMENT_PAYLOAD_LENGTH, workers,
+                          buffer_pool) as pool:
+            index = 0
+            prev_buffer = pool.acquire_input()
+            prev_length = read_all(prev_buffer, input_stream)
+            next_buffer, next_length = bytearray(), 0
+            if prev_length == len(prev_buffer):
+                next_buffer = pool.acquire_input()
+                next_length = read_all(next_buffer, input_stream)
+            while next_length and next_length == len(next_buffer):
+                pool.submit(decrypter.decrypt_segment, index, prev_buffer)
+                index += 1
+                prev_buffer, prev_length = next_buffer, next_length
+                next_buffer = pool.acquire_input()
+                next_length = read_all(next_buffer, input_stream)
+            # See README.md: the final segment is never shorter than MIN_FINAL_SEGMENT_LENGTH.
+            if next_length >= MIN_FINAL_SEGMENT_LENGTH:
+                pool.submit(decrypter.decrypt_segment, index, prev_buffer)
+                index += 1
+                final_segment = memoryview(next_buffer)[:next_length]
+            else:
+                final_segment = b''.join((prev_buffer[:prev_length], next_buffer[:next_length]))
+            pool.drain()
+            out_buffer = decrypter.finalize(index, final_segment)
+            write_all(output_stream, out_buffer)
+        if decrypter.compression:
+            output_stream.finish()
+            decrypter.uncompressed_length = output_stream.output_length
+    finally:
+        clear_secret(out_buffer)
+    return decrypter
+
+
+class _SegmentPool:
+    """
+    Processes segments on a thread pool and writes the results in the submission order.
+    At most two segments per worker are in flight. All buffers are wiped when the pool is left.
+    """
+
+    def __init__(self, output_stream: RawIOBase, input_size: int, output_size: int,
+                 workers: Optional[int] = None, buffer_pool: Optional[SecureBufferPool] = None):
+        workers = workers or os.cpu_count() or 1
+        self._output_stream = output_stream
+        self._input_size = input_size
+        self._output_size = output_size
+        self._limit = 2 * workers
+        self._buffer_pool = buffer_pool
+        self._executor = ThreadPoolExecutor(workers)
+        self._pending = deque()
+        self._buffers = []
+        self._free_inputs = []
+        self._free_outputs = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for future, _, _ in self._pending:
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        for buffer in self._buffers:
+            release_buffer(self._buffer_pool, buffer)
+
+    def acquire_input(self) -> MutableBytes:
+        return self._acquire(self._free_inputs, self._input_size)
+
+    def submit(self, function: Callable[[int, Bytes, MutableBytes], Bytes], index: int,
+               input_buffer: MutableBytes) -> None:
+        output_buffer = self._acquire(self._free_outputs, self._output_size)
+        future = self._executor.submit(function, index, input_buffer, output_buffer)
+        self._pending.append((future, input_buffer, output_buffer))
+        while len(self._pending) > self._limit:
+            self._write_oldest()
+
+    def drain(self) -> None:
+        while self._pending:
+            self._write_oldest()
+
+    def _write_oldest(self) -> None:
+        future, input_buffer, output_buffer = self._pending[0]
+        write_all(self._output_stream, future.result())
+        self._pending.popleft()
+        self._free_inputs.append(input_buffer)
+        self._free_outputs.append(output_buffer)
+
+    def _acquire(self, free_buffers: list, size: int) -> MutableBytes:
+        if free_buffers:
+            return free_buffers.pop()
+        buffer = acquire_buffer(self._buffer_pool, size)
+        self._buffers.append(buffer)
+        return buffer
 
 
 def read_all(b: MutableBytes, f: RawIOBase) -> int:
@@ -77,7 +263,7 @@ def read_all(b: MutableBytes, f: RawIOBase) -> int:
     while result < len(b):
         length = f.readinto(view[result:])
         if length is None:
-            sleep(SLEEP_INTERVAL)
+            wait_until_ready(f, selectors.EVENT_READ)
         elif length == 0:
             return result
         else:
@@ -93,9 +279,31 @@ def write_all(f: RawIOBase, b: Bytes) -> None:
     while written < len(b):
         length = f.write(view[written:])
         if length is None:
-            sleep(SLEEP_INTERVAL)
+            wait_until_ready(f, selectors.EVENT_WRITE)
         else:
             assert length > 0, length
             written += length
 
 
+
+
+_Selector = getattr(selectors, 'PollSelector', selectors.DefaultSelector)
+
+
+def wait_until_ready(f: RawIOBase, events: int) -> None:
+    """
+    Blocks until the non-blocking stream file descriptor is ready for the events. Streams without
+    a selectable file descriptor are polled every SLEEP_INTERVAL instead.
+    """
+    try:
+        fd = f.fileno()
+    except (OSError, ValueError, AttributeError):
+        sleep(SLEEP_INTERVAL)
+        return
+    with _Selector() as selector:
+        try:
+            selector.register(fd, events)
+        except (OSError, ValueError):
+            sleep(SLEEP_INTERVAL)  # E.g. Windows select() accepts sockets only.
+            return
+        selector.select()
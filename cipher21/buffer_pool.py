@@ -0,0 +1,166 @@
+import sys
+import mmap
+import ctypes
+import logging
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from .bytes_utils import clear_secret
+from .typing import MutableBytes
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+__all__ = (
+    'SecureBufferPool',
+    'acquire_buffer',
+    'release_buffer',
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MAX_SIZE = 2**26
+
+
+def _load_libc_function(name: str):
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        function = getattr(ctypes.CDLL(None, use_errno=True), name)
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = (ctypes.c_void_p, ctypes.c_size_t)
+    function.restype = ctypes.c_int
+    return function
+
+
+_mlock = _load_libc_function('mlock')
+_munlock = _load_libc_function('munlock')
+
+
+def _get_lock_limit() -> Optional[int]:
+    """Returns the number of bytes which may be locked in RAM, None if unlimited."""
+    if _mlock is None or resource is None:
+        return 0
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+    return None if soft_limit == resource.RLIM_INFINITY else soft_limit
+
+
+class SecureBufferPool:
+    """
+    Hands out page-aligned anonymous memory mapped buffers, which are locked in RAM as far as
+    RLIMIT_MEMLOCK allows and excluded from core dumps. Released buffers are wiped and kept for
+    reuse, up to max_size bytes, the least recently released ones are unmapped first.
+    A pool is thread safe and may be shared by any number of streams.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, lock: bool = True):
+        self.max_size = max_size
+        self.lock_limit = _get_lock_limit() if lock else 0
+        self.locked_size = 0
+        self.idle_size = 0
+        self._mutex = Lock()
+        self._idle = []  # type: List[Tuple[mmap.mmap, bool]]
+        self._active = {}  # type: Dict[int, Tuple[memoryview, mmap.mmap, bool]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clear()
+
+    def acquire(self, size: int) -> memoryview:
+        """Returns a zeroed buffer of the size, which has to be passed to release() afterwards."""
+        if size <= 0:
+            raise ValueError('Buffer size must be positive.')
+        mapped_size = -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+        with self._mutex:
+            for i in range(len(self._idle) - 1, -1, -1):
+                if len(self._idle[i][0]) == mapped_size:
+                    mapping, locked = self._idle.pop(i)
+                    self.idle_size -= mapped_size
+                    break
+            else:
+                mapping, locked = self._map(mapped_size)
+            view = memoryview(mapping)[:size]
+            self._active[id(view)] = view, mapping, locked
+        return view
+
+    def release(self, buffer: memoryview, reuse: bool = True) -> None:
+        """
+        Wipes and takes the buffer back. Pass reuse=False when the buffer may still be referenced,
+        e.g. by an abandoned thread, then it is unmapped as soon as it is not referenced anymore.
+        """
+        with self._mutex:
+            try:
+                view, mapping, locked = self._active.pop(id(buffer))
+            except KeyError:
+                raise ValueError('The buffer does not belong to this pool.') from None
+        assert view is buffer
+        clear_secret(mapping)
+        try:
+            view.release()
+        except BufferError:
+            reuse = False
+        with self._mutex:
+            if reuse and len(mapping) <= self.max_size:
+                self._idle.append((mapping, locked))
+                self.idle_size += len(mapping)
+                while self.idle_size > self.max_size:
+                    self._evict()
+            else:
+                self._unmap(mapping, locked)
+
+    def clear(self) -> None:
+        """Unmaps all idle buffers. Buffers in use are not affected."""
+        with self._mutex:
+            while self._idle:
+                self._evict()
+
+    def _map(self, size: int) -> Tuple[mmap.mmap, bool]:
+        mapping = mmap.mmap(-1, size)
+        if hasattr(mmap, 'MADV_DONTDUMP'):
+            mapping.madvise(mmap.MADV_DONTDUMP)
+        locked = False
+        if self.lock_limit is None or self.locked_size + size <= self.lock_limit:
+            address = ctypes.addressof(ctypes.c_char.from_buffer(mapping))
+            if _mlock(address, size) == 0:
+                locked = True
+                self.locked_size += size
+            else:
+                logger.debug('buffer pool: cannot lock {} bytes: {}'.format(
+                    size, ctypes.get_errno()
+                ))
+        return mapping, locked
+
+    def _evict(self) -> None:
+        mapping, locked = self._idle.pop(0)
+        self.idle_size -= len(mapping)
+        self._unmap(mapping, locked)
+
+    def _unmap(self, mapping: mmap.mmap, locked: bool) -> None:
+        if locked:
+            _munlock(ctypes.addressof(ctypes.c_char.from_buffer(mapping)), len(mapping))
+            self.locked_size -= len(mapping)
+        try:
+            mapping.close()
+        except BufferError:
+            pass  # Still referenced, the mapping is closed by GC then.
+
+
+def acquire_buffer(buffer_pool: Optional[SecureBufferPool], size: int) -> MutableBytes:
+    """Acquires a buffer from the pool, or allocates a plain bytearray without a pool."""
+    return bytearray(size) if buffer_pool is None else buffer_pool.acquire(size)
+
+
+def release_buffer(buffer_pool: Optional[SecureBufferPool], buffer: MutableBytes,
+                   reuse: bool = True) -> None:
+    if buffer_pool is None:
+        clear_secret(buffer)
+    else:
+        buffer_pool.release(buffer, reuse)
@@ -0,0 +1,86 @@
+import os
+import sys
+import stat
+import logging
+from io import IOBase
+from typing import Optional
+
+from .constants import STREAM_LENGTH_MULTIPLICAND, BUFFER_SIZE
+
+
+__all__ = (
+    'choose_buffer_size',
+    'enlarge_pipe',
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+FILE_BUFFER_SIZE = 64 * STREAM_LENGTH_MULTIPLICAND
+PIPE_BUFFER_SIZE = 64 * STREAM_LENGTH_MULTIPLICAND
+
+if sys.platform.startswith('linux'):
+    import fcntl
+    F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+    F_GETPIPE_SZ = getattr(fcntl, 'F_GETPIPE_SZ', 1032)
+else:
+    fcntl = None
+
+
+def choose_buffer_size(input_stream: IOBase, output_stream: Optional[IOBase] = None) -> int:
+    """
+    Picks a buffer size for the input stream type: a large one for regular files and pipes,
+    the default one for terminals and anything else. Pipes are enlarged to the chosen size
+    where the system allows it.
+    """
+    kind = _get_stream_kind(input_stream)
+    if kind == 'file':
+        result = FILE_BUFFER_SIZE
+    elif kind == 'pipe':
+        result = PIPE_BUFFER_SIZE
+        enlarge_pipe(input_stream.fileno(), result)
+    else:
+        result = BUFFER_SIZE
+    if output_stream is not None and _get_stream_kind(output_stream) == 'pipe':
+        enlarge_pipe(output_stream.fileno(), result)
+    logger.debug('buffer size: {:,} B (input: {})'.format(result, kind))
+    return result
+
+
+def enlarge_pipe(fd: int, size: int) -> Optional[int]:
+    """Tries to grow the pipe capacity to the given size. Returns the resulting capacity if known."""
+    if fcntl is None:
+        return None
+    try:
+        capacity = fcntl.fcntl(fd, F_GETPIPE_SZ)
+        if capacity < size:
+            capacity = fcntl.fcntl(fd, F_SETPIPE_SZ, min(size, _get_max_pipe_size()))
+    except OSError as e:
+        logger.debug('pipe {} capacity has not been changed: {}'.format(fd, e))
+        return None
+    logger.debug('pipe {} capacity: {:,} B'.format(fd, capacity))
+    return capacity
+
+
+def _get_stream_kind(stream: IOBase) -> str:
+    try:
+        fd = stream.fileno()
+        mode = os.fstat(fd).st_mode
+    except (OSError, ValueError, AttributeError):
+        return 'other'
+    if stat.S_ISREG(mode):
+        return 'file'
+    if stat.S_ISFIFO(mode):
+        return 'pipe'
+    if os.isatty(fd):
+        return 'tty'
+    return 'other'
+
+
+def _get_max_pipe_size() -> int:
+    try:
+        with open('/proc/sys/fs/pipe-max-size', 'rb') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return PIPE_BUFFER_SIZE
@@ -0,0 +1,302 @@
+from io import BufferedIOBase, RawIOBase
+from typing import Optional, Union
+
+from .constants import *
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter, check_uncompressed
+from .blocking_io import BUFFER_SIZE, check_buffer_size, check_stream_version, read_all, write_all
+from .bytes_utils import clear_secret
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'Cipher21Writer',
+    'Cipher21Reader',
+)
+
+
+class Cipher21Writer(BufferedIOBase):
+    """
+    Encrypts everything written into the underlying binary stream, which is left open.
+    close() writes the padding and the MAC, while leaving a with block on an exception does
+    not, so an interrupted stream never verifies.
+
+    The ciphertext is written in buffer_size pieces. Version 1 encrypts the written data
+    straight into the buffer, version 2 collects a segment payload in it and encrypts it in
+    place. A caller-supplied buffer, e.g. from a SecureBufferPool, replaces the internal one.
+    """
+
+    def __init__(self, raw: RawIOBase, key: bytes, buffer_size: int = BUFFER_SIZE,
+                 version: int = 1, buffer: Optional[MutableBytes] = None):
+        super().__init__()
+        self.raw = raw
+        self.version = check_stream_version(version)
+        if buffer is None:
+            buffer = bytearray(check_buffer_size(buffer_size) if version == 1 else SEGMENT_LENGTH)
+        self._buffer = memoryview(buffer).cast('B')
+        if version == 1:
+            check_buffer_size(len(self._buffer))
+            self.encrypter = Encrypter(key)  # type: Union[Encrypter, SegmentedEncrypter]
+            header = self.encrypter.initialize()
+        else:
+            if len(self._buffer) < SEGMENT_LENGTH:
+                raise ValueError('Buffer must be at least ' + str(SEGMENT_LENGTH) + ' bytes long.')
+            self._buffer = self._buffer[:SEGMENT_LENGTH]
+            self.encrypter = SegmentedEncrypter(key)
+            header = self.encrypter.initialize()
+            write_all(raw, header)
+            header = b''
+        self._buffer[:len(header)] = header
+        self._length = len(header)
+        self._index = 0
+        self._aborted = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Bytes) -> int:
+        if self.closed:
+            raise ValueError('write to closed file')
+        with memoryview(b) as original, original.cast('B') as view:
+            if self.version == 1:
+                self._encrypt_chunks(view)
+            else:
+                self._collect_segments(view)
+            return len(view)
+
+    def flush(self) -> None:
+        if self.closed or self._aborted:
+            return
+        if self.version == 1 and self._length:
+            write_all(self.raw, self._buffer[:self._length])
+            self._length = 0
+        self.raw.flush()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self.version == 1:
+                self.flush()
+                write_all(self.raw, self.encrypter.finalize())
+            else:
+                write_all(self.raw, self.encrypter.finalize(
+                    self._index, self._buffer[:self._length]
+                ))
+            self.raw.flush()
+        finally:
+            self.abort()
+
+    def abort(self) -> None:
+        """Wipes the buffer and closes without finalizing the stream."""
+        self._aborted = True
+        clear_secret(self._buffer)
+        self._buffer.release()
+        super().close()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def __del__(self):
+        # Unlike close(), garbage collection must not turn a truncated stream into a valid one.
+        if not self.closed and hasattr(self, '_aborted'):
+            self.abort()
+
+    def _encrypt_chunks(self, view: memoryview) -> None:
+        while view:
+            length = min(len(self._buffer) - self._length, len(view))
+            self.encrypter.process_chunk(
+                view[:length], self._buffer[self._length:self._length+length]
+            )
+            self._length += length
+            view = view[length:]
+            if self._length == len(self._buffer):
+                write_all(self.raw, self._buffer)
+                self._length = 0
+
+    def _collect_segments(self, view: memoryview) -> None:
+        while view:
+            if self._length == SEGMENT_PAYLOAD_LENGTH:
+                # More data follows, so the collected segment is not the final one.
+                self.encrypter.encrypt_segment(
+                    self._index, self._buffer[:SEGMENT_PAYLOAD_LENGTH], self._buffer
+                )
+                write_all(self.raw, self._buffer)
+                self._index += 1
+                self._length = 0
+            length = min(SEGMENT_PAYLOAD_LENGTH - self._length, len(view))
+            self._buffer[self._length:self._length+length] = view[:length]
+            self._length += length
+            view = view[length:]
+
+
+class Cipher21Reader(BufferedIOBase):
+    """
+    Decrypts lazily a stream of any version from the underlying binary stream, which is left
+    open. The ciphertext is read in pieces of at least buffer_size bytes and decrypted straight
+    into the caller's buffer, except for the final chunk or a segment larger than that buffer.
+    A caller-supplied buffer for the ciphertext replaces the internal one.
+
+    Data is returned before the MAC is checked, as with decrypt_stream(). A tampered stream
+    raises DecryptingError at the latest when the end of the stream is read.
+    """
+
+    def __init__(self, raw: RawIOBase, key: bytes, buffer_size: int = BUFFER_SIZE,
+                 buffer: Optional[MutableBytes] = None):
+        super().__init__()
+        self.raw = raw
+        self.key = key
+        self.decrypter = None  # type: Optional[Union[Decrypter, SegmentedDecrypter]]
+        self._buffer_size = check_buffer_size(buffer_size)
+        self._buffer = None if buffer is None else memoryview(buffer).cast('B')
+        self._start = 0
+        self._end = 0
+        self._eof = False
+        self._index = 0
+        self._plain_buffer = bytearray()
+        self._plain = memoryview(self._plain_buffer)
+        self._finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        if size is None or size < 0:
+            chunks = []
+            chunk = self.read1()
+            while chunk:
+                chunks.append(chunk)
+                chunk = self.read1()
+            return b''.join(chunks)
+        return self._read(self.readinto, size)
+
+    def read1(self, size: int = -1) -> bytes:
+        return self._read(
+            self.readinto1, size if size >= 0 else max(self._buffer_size, SEGMENT_PAYLOAD_LENGTH)
+        )
+
+    def readinto(self, b: MutableBytes) -> int:
+        with memoryview(b) as original, original.cast('B') as view:
+            result = 0
+            while result < len(view):
+                length = self.readinto1(view[result:])
+                if not length:
+                    break
+                result += length
+            return result
+
+    def readinto1(self, b: MutableBytes) -> int:
+        if self.closed:
+            raise ValueError('read from closed file')
+        with memoryview(b) as original, original.cast('B') as view:
+            if not view:
+                return 0
+            if not self._plain and not self._finished:
+                if self.decrypter is None:
+                    self._initialize()
+                if isinstance(self.decrypter, SegmentedDecrypter):
+                    length = self._decrypt_segment(view)
+                else:
+                    length = self._decrypt_chunk(view)
+                if length:
+                    return length
+            length = min(len(view), len(self._plain))
+            view[:length] = self._plain[:length]
+            self._plain = self._plain[length:]
+            return length
+
+    def seekable(self) -> bool:
+        return False
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._plain.release()
+        clear_secret(self._plain_buffer)
+        if self._buffer is not None:
+            self._buffer.release()
+        super().close()
+
+    @staticmethod
+    def _read(readinto, size: int) -> bytes:
+        buffer = bytearray(size)
+        try:
+            with memoryview(buffer) as view:
+                return bytes(view[:readinto(view)])
+        finally:
+            clear_secret(buffer)
+
+    def _initialize(self) -> None:
+        header = bytearray(STREAM_V2_HEADER_LENGTH)
+        view = memoryview(header)
+        length = read_all(view[:STREAM_SIGNATURE_LENGTH], self.raw)
+        if header.startswith(STREAM_V2_SIGNATURE):
+            decrypter, capacity = SegmentedDecrypter(self.key), SEGMENT_LOOKAHEAD
+            header_length = STREAM_V2_HEADER_LENGTH
+            self._plain_buffer = bytearray(SEGMENT_LOOKAHEAD)
+        else:
+            decrypter = Decrypter(self.key)
+            capacity = FINAL_CHUNK_HOLDBACK + (
+                STREAM_LENGTH_MULTIPLICAND if self._buffer is not None else self._buffer_size
+            )
+            header_length = STREAM_HEADER_LENGTH
+            self._plain_buffer = bytearray(FINAL_CHUNK_HOLDBACK)
+        length += read_all(view[length:header_length], self.raw)
+        if length != header_length:
+            raise ValueError('Not enough data.')
+        decrypter.initialize(header[:header_length])
+        check_uncompressed(decrypter)
+        if self._buffer is None:
+            self._buffer = memoryview(bytearray(capacity))
+        elif len(self._buffer) < capacity:
+            raise ValueError('Buffer must be at least ' + str(capacity) + ' bytes long.')
+        self.decrypter = decrypter
+
+    def _fill(self, needed: int) -> int:
+        """Reads until at least the needed number of bytes is buffered or EOF. Returns the count."""
+        if self._end - self._start < needed and not self._eof:
+            remaining = self._end - self._start
+            self._buffer[:remaining] = self._buffer[self._start:self._end]
+            self._start, self._end = 0, remaining
+            length = read_all(self._buffer[self._end:], self.raw)
+            self._eof = self._end + length < len(self._buffer)
+            self._end += length
+        return self._end - self._start
+
+    def _decrypt_chunk(self, view: memoryview) -> int:
+        available = self._fill(FINAL_CHUNK_HOLDBACK + 1) - FINAL_CHUNK_HOLDBACK
+        if available > 0:
+            length = min(len(view), available)
+            self.decrypter.process_chunk(self._buffer[self._start:self._start+length], view[:length])
+            self._start += length
+            return length
+        self._plain = self.decrypter.finalize(
+            self._buffer[self._start:self._end], self._plain_buffer
+        )
+        self._start = self._end
+        self._finished = True
+        return 0
+
+    def _decrypt_segment(self, view: memoryview) -> int:
+        if self._fill(SEGMENT_LOOKAHEAD) >= SEGMENT_LOOKAHEAD:
+            segment = self._buffer[self._start:self._start+SEGMENT_LENGTH]
+            self._start += SEGMENT_LENGTH
+            self._index += 1
+            if len(view) >= SEGMENT_PAYLOAD_LENGTH:
+                self.decrypter.decrypt_segment(self._index - 1, segment, view)
+                return SEGMENT_PAYLOAD_LENGTH
+            self._plain = self.decrypter.decrypt_segment(
+                self._index - 1, segment, self._plain_buffer
+            )
+            return 0
+        self._plain = self.decrypter.finalize(
+            self._index, self._buffer[self._start:self._end], self._plain_buffer
+        )
+        self._start = self._end
+        self._finished = True
+        return 0
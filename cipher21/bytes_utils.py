@@ -1,4 +1,7 @@
-from random import SystemRandom
+import os
+import ctypes
+from itertools import repeat
+from operator import and_, or_, sub
 from typing import Container
 
 from .typing import Bytes, MutableBytes
@@ -6,40 +9,65 @@ from .typing import Bytes, MutableBytes
 
 __all__ = (
     'clear_secret',
+    'zero_fill',
     'count_unique_bytes',
     'differentiate_bytes',
     'unhexlify',
 )
 
 
-_rng = SystemRandom()
+RANDOM_CHUNK_SIZE = 2**20
+SHORT_BYTES_LENGTH = 64  # Shorter inputs are cheaper to scan byte by byte than to probe 256 times.
+
+_INVALID_NIBBLE = 0xFF
+_NIBBLES = bytes(
+    int(chr(x), 16) if chr(x) in '0123456789ABCDEFabcdef' else _INVALID_NIBBLE for x in range(256)
+)
+_HIGH_NIBBLES = bytes((x << 4) & 0xFF for x in range(256))
 
 
 def clear_secret(secret: MutableBytes) -> None:
-    for i in range(len(secret)):
-        secret[i] = 0xFF
-    for i in range(len(secret)):
-        secret[i] = 0x00
-    for i in range(len(secret)):
-        secret[i] = _rng.getrandbits(8)
+    # The views are released explicitly, so the buffer (e.g. a mmap) may be closed right after.
+    with memoryview(secret) as original, original.cast('B') as view:
+        if not view:
+            return
+        address = ctypes.addressof(ctypes.c_char.from_buffer(view))
+        ctypes.memset(address, 0xFF, len(view))
+        ctypes.memset(address, 0x00, len(view))
+        for offset in range(0, len(view), RANDOM_CHUNK_SIZE):
+            with view[offset:offset+RANDOM_CHUNK_SIZE] as chunk:
+                chunk[:] = os.urandom(len(chunk))
+
+
+def zero_fill(buffer: MutableBytes) -> None:
+    """Cheaply wipes a buffer recycled within a stream. Released buffers need clear_secret()."""
+    with memoryview(buffer) as original, original.cast('B') as view:
+        if view:
+            ctypes.memset(ctypes.addressof(ctypes.c_char.from_buffer(view)), 0x00, len(view))
 
 
 def count_unique_bytes(b: Bytes) -> int:
-    occurrences = bytearray(256)
-    for x in b:
-        occurrences[x] = 1
-    result = sum(occurrences)
-    clear_secret(occurrences)
-    return result
+    if len(b) < SHORT_BYTES_LENGTH:
+        occurrences = bytearray(256)
+        for x in b:
+            occurrences[x] = 1
+        result = sum(occurrences)
+        clear_secret(occurrences)
+        return result
+    # Every probe is a single memchr() call, no byte of the secret is copied.
+    haystack = b if isinstance(b, (bytes, bytearray)) else bytearray(b)
+    try:
+        return sum(1 for x in range(256) if x in haystack)
+    finally:
+        if haystack is not b:
+            clear_secret(haystack)
 
 
 def differentiate_bytes(b: Bytes) -> bytearray:
     if not b:
         return bytearray()
-    derivative = bytearray(len(b) - 1)
-    for i in range(1, len(b)):
-        derivative[i-1] = (b[i] - b[i-1]) & 0xFF
-    return derivative
+    view = memoryview(b).cast('B')
+    return bytearray(map(and_, map(sub, view[1:], view[:-1]), repeat(0xFF)))
 
 
 def unhexlify(hexes: Bytes, ignored_bytes=frozenset(ord(c) for c in '\t\n\v\f\r .,:;-')) \
@@ -52,7 +80,6 @@ class HexToBinSecureConverter:
     def __init__(self, hexes: Bytes, ignored_bytes: Container[int]):
         self._hexes = hexes
         self.ignored_bytes = ignored_bytes
-        self._x = bytearray(1)
         self._buffer = bytearray(len(hexes) // 2 + 1)
         self._buffer_idx = 0
         self._first_digit = True
@@ -67,23 +94,31 @@ class HexToBinSecureConverter:
             return bytearray(self._buffer[0:self._buffer_idx])
         finally:
             clear_secret(self._buffer)
-            clear_secret(self._x)
 
     def _unhexlify_to_buffer(self) -> None:
-        for hexes_idx in range(len(self._hexes)):
-            if ord('0') <= self._hexes[hexes_idx] <= ord('9'):
-                self._x[0] = self._hexes[hexes_idx] - ord('0')
-            elif ord('A') <= self._hexes[hexes_idx] <= ord('F'):
-                self._x[0] = self._hexes[hexes_idx] - ord('A') + 10
-            elif ord('a') <= self._hexes[hexes_idx] <= ord('f'):
-                self._x[0] = self._hexes[hexes_idx] - ord('a') + 10
-            elif self._hexes[hexes_idx] in self.ignored_bytes:
-                continue
-            else:
+        # Every intermediate is a bytearray of the exact size, so it can be wiped afterwards.
+        temporaries = []
+        try:
+            hexes = self._hexes
+            if not isinstance(hexes, bytearray):
+                hexes = bytearray(memoryview(hexes))
+                temporaries.append(hexes)
+            try:
+                ignored = bytes(sorted(self.ignored_bytes))
+            except TypeError:  # Not iterable container.
+                ignored = bytes(x for x in range(256) if x in self.ignored_bytes)
+            nibbles = hexes.translate(_NIBBLES, ignored)
+            temporaries.append(nibbles)
+            if _INVALID_NIBBLE in nibbles:
                 raise ValueError('Invalid hexadecimal symbol.')
-            if self._first_digit:
-                self._buffer[self._buffer_idx] = 16 * self._x[0]
-            else:
-                self._buffer[self._buffer_idx] += self._x[0]
-                self._buffer_idx += 1
-            self._first_digit = not self._first_digit
+            high = nibbles.translate(_HIGH_NIBBLES)
+            temporaries.append(high)
+            # Strided views pair the digits up without copying them.
+            combined = bytearray(map(or_, memoryview(high)[0::2], memoryview(nibbles)[1::2]))
+            temporaries.append(combined)
+            self._buffer_idx = len(combined)
+            self._buffer[0:self._buffer_idx] = combined
+            self._first_digit = len(nibbles) % 2 == 0
+        finally:
+            for temporary in temporaries:
+                clear_secret(temporary)
@@ -0,0 +1,182 @@
+import os
+from importlib import import_module
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import RawIOBase
+from typing import NamedTuple, Optional, Tuple
+
+from .constants import COMPRESSION_CODECS
+from .blocking_io import read_all, write_all
+from .bytes_utils import clear_secret
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'parse_compression',
+    'CompressingReader',
+    'DecompressingWriter',
+)
+
+
+# The decompressed bytes written at once, which bounds the memory of highly compressed blocks.
+OUTPUT_LENGTH = 2**20
+
+
+class _Codec(NamedTuple):
+    levels: range
+    block_length: int
+    errors: Tuple[str, ...]
+
+
+# The codec modules are imported on use. The blocks are compressed independently, so the longer
+# ones lose less of the ratio to the restarted dictionaries. bz2 compresses 900 kB blocks anyway.
+CODECS = {
+    'zlib': _Codec(range(0, 10), 2**20, ('error',)),
+    'bz2': _Codec(range(1, 10), 900000, ()),
+    'lzma': _Codec(range(0, 10), 4 * 2**20, ('LZMAError',)),
+}
+assert set(CODECS) == set(COMPRESSION_CODECS[1:])
+
+
+def parse_compression(text: str) -> Tuple[str, Optional[int]]:
+    """Parses CODEC[:LEVEL], e.g. zlib:6. The level defaults to the one of the codec."""
+    codec, separator, level = text.partition(':')
+    if codec not in CODECS:
+        raise ValueError('Unsupported compression codec `' + codec + '`.')
+    if not separator:
+        return codec, None
+    levels = CODECS[codec].levels
+    if not level.isdigit() or int(level) not in levels:
+        raise ValueError('The {} compression level must be from {} to {}.'.format(
+            codec, levels[0], levels[-1]
+        ))
+    return codec, int(level)
+
+
+def compress_block(codec: str, level: Optional[int], block: Bytes) -> bytes:
+    module = import_module(codec)
+    if codec == 'lzma':
+        return module.compress(block, preset=level)
+    if level is None:
+        return module.compress(block)
+    return module.compress(block, level)
+
+
+def create_decompressor(codec: str):
+    module = import_module(codec)
+    if codec == 'zlib':
+        return module.decompressobj()
+    if codec == 'bz2':
+        return module.BZ2Decompressor()
+    return module.LZMADecompressor()
+
+
+class CompressingReader(RawIOBase):
+    """
+    Reads the input stream and serves it compressed. Blocks of the codec block length are
+    compressed independently on a thread pool, as the codecs release the GIL, and concatenated
+    in order. At most two blocks per worker are in flight. The plain blocks are wiped.
+    """
+
+    def __init__(self, input_stream: RawIOBase, compression: str, workers: Optional[int] = None):
+        super().__init__()
+        self.codec, self.level = parse_compression(compression)
+        self.input_length = 0
+        workers = workers or os.cpu_count() or 1
+        self._input_stream = input_stream
+        self._limit = 2 * workers
+        self._executor = ThreadPoolExecutor(workers)
+        self._pending = deque()
+        self._compressed = memoryview(b'')
+        self._eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b: MutableBytes) -> int:
+        while not self._compressed:
+            self._read_blocks()
+            if not self._pending:
+                return 0
+            self._compressed = memoryview(self._pending.popleft().result())
+        with memoryview(b) as view:
+            length = min(len(view), len(self._compressed))
+            view[:length] = self._compressed[:length]
+        self._compressed = self._compressed[length:]
+        return length
+
+    def close(self) -> None:
+        """Stops the compression. The input stream is left open."""
+        if not self.closed:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown(wait=True)
+            self._pending.clear()
+        super().close()
+
+    def _read_blocks(self) -> None:
+        while not self._eof and len(self._pending) < self._limit:
+            block = bytearray(CODECS[self.codec].block_length)
+            length = read_all(block, self._input_stream)
+            self._eof = length < len(block)
+            self.input_length += length
+            if length:
+                self._pending.append(self._executor.submit(self._compress, block, length))
+
+    def _compress(self, block: bytearray, length: int) -> bytes:
+        try:
+            with memoryview(block) as view:
+                return compress_block(self.codec, self.level, view[:length])
+        finally:
+            clear_secret(block)
+
+
+class DecompressingWriter(RawIOBase):
+    """
+    Decompresses the concatenated blocks written to it into the output stream.
+    finish() checks that the final block is complete. The output stream is left open.
+    """
+
+    def __init__(self, output_stream: RawIOBase, codec: str):
+        super().__init__()
+        if codec not in CODECS:
+            raise ValueError('Unsupported compression codec `' + codec + '`.')
+        self.codec = codec
+        self.output_length = 0
+        self._output_stream = output_stream
+        self._decompressor = None
+        module = import_module(codec)
+        self._errors = (EOFError, OSError) + tuple(getattr(module, e) for e in CODECS[codec].errors)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b: Bytes) -> int:
+        try:
+            self._decompress(b)
+        except self._errors as e:
+            raise ValueError('Malformed compressed payload.') from e
+        return len(b)
+
+    def finish(self) -> None:
+        if self._decompressor is not None:
+            raise ValueError('Truncated compressed payload.')
+
+    def _decompress(self, data: Bytes) -> None:
+        while True:
+            if self._decompressor is None:
+                if not data:
+                    return
+                self._decompressor = create_decompressor(self.codec)
+            decompressor = self._decompressor
+            output = decompressor.decompress(data, OUTPUT_LENGTH)
+            # zlib returns the input exceeding the output limit, the others keep it internally.
+            data = getattr(decompressor, 'unconsumed_tail', b'')
+            write_all(self._output_stream, output)
+            self.output_length += len(output)
+            if decompressor.eof:
+                data = decompressor.unused_data + data
+                self._decompressor = None
+            elif len(output) < OUTPUT_LENGTH and not data \
+                    and getattr(decompressor, 'needs_input', True):
+                return
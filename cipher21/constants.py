@@ -12,6 +12,8 @@ TIMESTAMP_LENGTH = 8
 STREAM_LENGTH_MULTIPLICAND = 2**14
 M = STREAM_LENGTH_MULTIPLICAND
 
+BUFFER_SIZE = 2 * STREAM_LENGTH_MULTIPLICAND
+
 PADDING_LENGTH_LENGTH = 2
 assert 256**PADDING_LENGTH_LENGTH >= STREAM_LENGTH_MULTIPLICAND
 
@@ -23,3 +25,31 @@ STREAM_FOOTER_LENGTH = PADDING_LENGTH_LENGTH + MAC_LENGTH
 
 STREAM_METADATA_LENGTH = STREAM_HEADER_LENGTH + STREAM_FOOTER_LENGTH
 
+STREAM_V2_SIGNATURE = b'c21\x1A\x00\xFF\x19\x83'
+assert len(STREAM_V2_SIGNATURE) == len(STREAM_SIGNATURE)
+
+STREAM_SIGNATURE_LENGTH = len(STREAM_SIGNATURE)
+
+NONCE_PREFIX_OFFSET = STREAM_SIGNATURE_LENGTH
+NONCE_PREFIX_LENGTH = 16
+SEGMENT_INDEX_LENGTH = NONCE_LENGTH - NONCE_PREFIX_LENGTH - 1
+
+HEADER_BLOCK_OFFSET = NONCE_PREFIX_OFFSET + NONCE_PREFIX_LENGTH
+HEADER_BLOCK_LENGTH = TIMESTAMP_LENGTH + 8
+
+STREAM_V2_HEADER_LENGTH = HEADER_BLOCK_OFFSET + HEADER_BLOCK_LENGTH + MAC_LENGTH
+
+SEGMENT_LENGTH = 64 * STREAM_LENGTH_MULTIPLICAND
+SEGMENT_PAYLOAD_LENGTH = SEGMENT_LENGTH - MAC_LENGTH
+
+MIN_FINAL_SEGMENT_LENGTH = 2 * STREAM_LENGTH_MULTIPLICAND - STREAM_V2_HEADER_LENGTH
+assert 256**PADDING_LENGTH_LENGTH > MIN_FINAL_SEGMENT_LENGTH
+
+# The final chunk of a version 1 stream has to cover the whole padding, which is shorter than M.
+FINAL_CHUNK_HOLDBACK = 2 * STREAM_LENGTH_MULTIPLICAND
+# A segment followed by at least MIN_FINAL_SEGMENT_LENGTH bytes is not the final one.
+SEGMENT_LOOKAHEAD = SEGMENT_LENGTH + MIN_FINAL_SEGMENT_LENGTH
+
+# The header block byte following the timestamp, an index of COMPRESSION_CODECS.
+COMPRESSION_CODEC_OFFSET = TIMESTAMP_LENGTH
+COMPRESSION_CODECS = (None, 'zlib', 'bz2', 'lzma')
@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import socket
+import signal
+import logging
+import selectors
+import threading
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple, Union
+
+from .operation_mode import OperationMode
+from .null_stream import NullStream
+from .batch import process_streams
+from .blocking_io import BUFFER_SIZE
+from .key import KeyStore
+
+
+__all__ = (
+    'Daemon',
+    'send_request',
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+MAX_MESSAGE_LENGTH = 2**16
+MAX_FDS = 2
+LATENCY_SAMPLES = 1024
+# Seconds for a client to send its request, after which the connection is dropped.
+REQUEST_TIMEOUT = 5.0
+STATS_MODE = 'stats'
+
+
+class Daemon:
+    """
+    Serves encryption, decryption and verification requests with a key loaded once.
+    Clients connect to a Unix domain socket and pass their input and output file descriptors
+    with SCM_RIGHTS, so the data never goes through the socket. A request is a JSON line,
+    see send_request(), and so is the response.
+
+    Requests are read without blocking by the accepting thread, so a slow client delays nobody,
+    and processed on a pool of workers threads, each stream on a single thread.
+    With a key store, requests may choose a dir: key by its key_name.
+    SIGTERM and SIGINT stop accepting connections and wait for the requests in progress.
+    """
+
+    def __init__(self, path: str, key: Optional[bytearray], workers: Optional[int] = None,
+                 key_store: Optional[KeyStore] = None):
+        self.path = path
+        self.key = key
+        self.key_store = key_store
+        self.workers = workers or os.cpu_count() or 1
+        self.requests = 0
+        self.failed = 0
+        self.active = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.start_time = time.monotonic()
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._listener = None  # type: Optional[socket.socket]
+        self._wakeup_writer = None  # type: Optional[socket.socket]
+
+    def serve(self, handle_signals: bool = True) -> None:
+        """Serves until stop() or a signal. Signals may be handled only on the main thread."""
+        self._listener = self._bind()
+        wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_writer.setblocking(False)
+        previous_handlers = {}
+        if handle_signals:
+            previous_handlers = {
+                signum: signal.signal(signum, self._request_stop)
+                for signum in (signal.SIGTERM, signal.SIGINT)
+            }
+        logger.info('serving on {} with {} workers'.format(self.path, self.workers))
+        try:
+            with ThreadPoolExecutor(self.workers) as executor, \
+                    selectors.DefaultSelector() as selector:
+                selector.register(self._listener, selectors.EVENT_READ)
+                selector.register(wakeup_reader, selectors.EVENT_READ)
+                while not self._stopping:
+                    for key, _ in selector.select(self._select_timeout(selector)):
+                        if key.fileobj is wakeup_reader:
+                            wakeup_reader.recv(4096)
+                        elif self._stopping:
+                            pass
+                        elif key.fileobj is self._listener:
+                            self._accept(selector)
+                        else:
+                            self._receive(selector, executor, key.data)
+                    self._expire(selector)
+                logger.info('draining {} active requests'.format(self.active))
+                self._close_listener()
+                for key in list(selector.get_map().values()):
+                    if isinstance(key.data, _PendingRequest):
+                        self._drop(selector, key.data)
+        finally:
+            self._close_listener()
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            wakeup_reader.close()
+            self._wakeup_writer.close()
+        logger.info('stopped after {:,} requests, {:,} failed'.format(self.requests, self.failed))
+
+    def stop(self) -> None:
+        """Stops accepting connections. serve() returns once the active requests finish."""
+        self._stopping = True
+        try:
+            self._wakeup_writer.send(b'\0')
+        except (AttributeError, OSError):
+            pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            stats = {
+                'uptime': time.monotonic() - self.start_time,
+                'workers': self.workers,
+                'requests': self.requests,
+                'failed': self.failed,
+                'active': self.active,
+                'latency': {
+                    'samples': len(latencies),
+                    'mean': sum(latencies) / len(latencies) if latencies else None,
+                    'p50': _percentile(latencies, 0.5),
+                    'p99': _percentile(latencies, 0.99),
+                    'max': latencies[-1] if latencies else None,
+                },
+            }
+        if self.key_store is not None:
+            stats['keys'] = {
+                'cached': len(self.key_store),
+                'hits': self.key_store.hits,
+                'misses': self.key_store.misses,
+            }
+        return stats
+
+    def _request_stop(self, signum, frame) -> None:
+        self.stop()
+
+    def _bind(self) -> socket.socket:
+        if os.path.exists(self.path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(self.path)
+                except OSError:
+                    os.unlink(self.path)  # A leftover of a daemon which did not stop cleanly.
+                else:
+                    raise ValueError('Another daemon serves on ' + self.path + '.')
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Anyone able to connect may use the key, so the socket is private to the user.
+        umask = os.umask(0o077)
+        try:
+            listener.bind(self.path)
+        except BaseException:
+            listener.close()
+            raise
+        finally:
+            os.umask(umask)
+        listener.listen(4 * self.workers)
+        return listener
+
+    def _close_listener(self) -> None:
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def _accept(self, selector: selectors.BaseSelector) -> None:
+        try:
+            connection, _ = self._listener.accept()
+        except OSError as e:
+            logger.debug('accept failed: {}'.format(e))
+            return
+        connection.setblocking(False)
+        selector.register(connection, selectors.EVENT_READ,
+                          _PendingRequest(connection, time.monotonic()))
+
+    def _receive(self, selector: selectors.BaseSelector, executor: ThreadPoolExecutor,
+                 pending: '_PendingRequest') -> None:
+        try:
+            if not receive_message_part(pending.connection, pending.data, pending.fds):
+                return
+            request = json.loads(pending.data.decode())
+            if not isinstance(request, dict):
+                raise ValueError('The request is not a JSON object.')
+        except BlockingIOError:
+            return
+        except Exception as e:
+            logger.debug('malformed request: {}'.format(e))
+            self._drop(selector, pending)
+            return
+        selector.unregister(pending.connection)
+        connection, fds, accept_time = pending.connection, list(pending.fds), pending.accept_time
+        connection.setblocking(True)
+        if request.get('mode') == STATS_MODE:
+            # Answered right away, so the stats are available even when all workers are busy.
+            _close_fds(fds)
+            with connection:
+                send_message(connection, self.stats())
+            return
+        with self._lock:
+            self.active += 1
+        executor.submit(self._handle, connection, request, fds, accept_time)
+
+    @staticmethod
+    def _select_timeout(selector: selectors.BaseSelector) -> Optional[float]:
+        accept_times = [key.data.accept_time for key in selector.get_map().values()
+                        if isinstance(key.data, _PendingRequest)]
+        if not accept_times:
+            return None
+        return max(0.0, min(accept_times) + REQUEST_TIMEOUT - time.monotonic())
+
+    def _expire(self, selector: selectors.BaseSelector) -> None:
+        deadline = time.monotonic() - REQUEST_TIMEOUT
+        for key in list(selector.get_map().values()):
+            if isinstance(key.data, _PendingRequest) and key.data.accept_time <= deadline:
+                logger.debug('request timed out')
+                self._drop(selector, key.data)
+
+    @staticmethod
+    def _drop(selector: selectors.BaseSelector, pending: '_PendingRequest') -> None:
+        selector.unregister(pending.connection)
+        _close_fds(pending.fds)
+        pending.connection.close()
+
+    def _handle(self, connection: socket.socket, request: dict, fds: List[int],
+                accept_time: float) -> None:
+        response = {'ok': False}
+        with connection:
+            try:
+                attrs = self._process(request, fds)
+                response = {
+                    'ok': True,
+                    'stream_timestamp_ns': attrs.stream_timestamp_ns,
+                    'payload_length': attrs.payload_length,
+                    'compression': attrs.compression,
+                    'uncompressed_length': attrs.uncompressed_length,
+                    'mac': attrs.mac.hex() if attrs.mac is not None else None,
+                }
+            except Exception as e:
+                response['error'] = str(e) or type(e).__name__
+            finally:
+                _close_fds(fds)
+                # Counted before responding, so the client sees its request in the stats.
+                with self._lock:
+                    self.active -= 1
+                    self.requests += 1
+                    self.failed += not response['ok']
+                    self.latencies.append(time.monotonic() - accept_time)
+            try:
+                send_message(connection, response)
+            except OSError as e:
+                logger.debug('cannot respond: {}'.format(e))
+
+    def _process(self, request: dict, fds: List[int]):
+        mode = OperationMode(request['mode'])
+        expected = 1 if mode is OperationMode.VERIFICATION else 2
+        if len(fds) != expected:
+            raise ValueError('Expected {} file descriptors, got {}.'.format(expected, len(fds)))
+        key_name = request.get('key_name')
+        if key_name is None:
+            if self.key is None:
+                raise ValueError('No key_name and no default key.')
+            return self._process_streams(request, fds, mode, self.key)
+        if self.key_store is None:
+            raise ValueError('No key directory to choose the key from.')
+        with self.key_store.lease('dir:' + str(key_name)) as key:
+            return self._process_streams(request, fds, mode, key.bytes)
+
+    @staticmethod
+    def _process_streams(request: dict, fds: List[int], mode: OperationMode, key: bytearray):
+        # The descriptors are closed by _handle(), so the files are not.
+        input_file = open(fds[0], 'rb', buffering=0, closefd=False)
+        output_file = NullStream() if mode is OperationMode.VERIFICATION \
+            else open(fds[1], 'wb', buffering=0, closefd=False)
+        with input_file, output_file:
+            return process_streams(
+                output_file, input_file, key, mode, int(request.get('version', 1)),
+                int(request.get('after_ns', 0)), request.get('buffer_size', BUFFER_SIZE),
+                bool(request.get('no_cache', False)), request.get('compression')
+            )
+
+
+def send_request(path: str, request: dict, fds: Sequence[int] = ()) -> dict:
+    """
+    Sends a request to the daemon and waits for its response. Processing requests consist of
+    mode, version, after_ns, buffer_size, no_cache, compression and an optional key_name.
+    They carry the input and, unless verifying, the output file descriptors.
+    The stats mode requests carry none.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(path)
+        send_message(connection, request, fds)
+        response, received_fds = receive_message(connection)
+        _close_fds(received_fds)
+        return response
+
+
+def send_message(connection: socket.socket, message: dict, fds: Sequence[int] = ()) -> None:
+    data = json.dumps(message).encode() + b'\n'
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array('i', fds))] if fds else []
+    sent = connection.sendmsg([data], ancillary)
+    if sent < len(data):
+        connection.sendall(data[sent:])
+
+
+def receive_message(connection: socket.socket) -> Tuple[dict, List[int]]:
+    """Receives a JSON line and the file descriptors sent along with its beginning."""
+    fds = array('i')
+    data = bytearray()
+    try:
+        while not receive_message_part(connection, data, fds):
+            pass
+        return json.loads(data.decode()), list(fds)
+    except BaseException:
+        _close_fds(fds)
+        raise
+
+
+def receive_message_part(connection: socket.socket, data: bytearray, fds: array) -> bool:
+    """Receives a part of a JSON line into data and fds. Tells whether the line is complete."""
+    chunk, ancillary, _, _ = connection.recvmsg(
+        MAX_MESSAGE_LENGTH, socket.CMSG_SPACE(MAX_FDS * fds.itemsize)
+    )
+    for level, kind, cmsg_data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - len(cmsg_data) % fds.itemsize])
+    if not chunk:
+        raise ValueError('Connection closed before the end of the message.')
+    data += chunk
+    if len(data) > MAX_MESSAGE_LENGTH:
+        raise ValueError('Message too long.')
+    return data.endswith(b'\n')
+
+
+def _close_fds(fds: Union[Sequence[int], array]) -> None:
+    for fd in fds:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+
+def _percentile(values: Sequence[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class _PendingRequest:
+    """A connection whose request is being received."""
+
+    def __init__(self, connection: socket.socket, accept_time: float):
+        self.connection = connection
+        self.accept_time = accept_time
+        self.data = bytearray()
+        self.fds = array('i')
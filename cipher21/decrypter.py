@@ -1,17 +1,34 @@
 from typing import Optional
 
 from .constants import *
+from .backends import new_cipher
 from .typing import Bytes, MutableBytes
 from .stream_attributes import StreamAttributes
 
-from Crypto.Cipher import ChaCha20_Poly1305
-
 
 class DecryptingError(ValueError):
     pass
 
 
+class StaleStreamError(DecryptingError):
+    pass
+
+
+def check_stream_timestamp(attrs: StreamAttributes, after_ns: Optional[int]) -> None:
+    if after_ns is not None and attrs.stream_timestamp_ns <= after_ns:
+        raise StaleStreamError('Not encrypted after the given date and time.')
+
+
 class Decrypter(StreamAttributes):
+    """
+    With after_ns, streams encrypted at or before it are rejected by initialize(), so before
+    any payload is processed. The version 1 timestamp is authenticated by the final MAC only,
+    yet a forged one may only reject a stream which would fail the MAC check anyway.
+    """
+
+    def __init__(self, key: Bytes, after_ns: Optional[int] = None):
+        super().__init__(key)
+        self.after_ns = after_ns
 
     @staticmethod
     def extract_nonce(stream_header: Bytes) -> memoryview:
@@ -27,11 +44,12 @@ class Decrypter(StreamAttributes):
         if not stream_header.startswith(STREAM_SIGNATURE):
             raise ValueError('Unrecognized Cipher21 header.')
         self.nonce = bytes(stream_header[NONCE_OFFSET:NONCE_OFFSET+NONCE_LENGTH])
-        self.cipher = ChaCha20_Poly1305.new(key=self.key, nonce=self.nonce)
+        self.cipher = new_cipher(self.key, self.nonce)
         encrypted_timestamp_ns = stream_header[TIMESTAMP_OFFSET:TIMESTAMP_OFFSET+TIMESTAMP_LENGTH]
         self.stream_timestamp_ns = int.from_bytes(
             self.cipher.decrypt(encrypted_timestamp_ns), 'little'
         )
+        check_stream_timestamp(self, self.after_ns)
         self.payload_length = 0
 
     def process_chunk(self, chunk: Bytes, output: Optional[MutableBytes] = None) -> MutableBytes:
@@ -52,7 +70,7 @@ class Decrypter(StreamAttributes):
         else:
             output = bytearray(len(chunk) - MAC_LENGTH)
         self.cipher.decrypt(chunk[:-MAC_LENGTH], output)
-        self.mac = chunk[-MAC_LENGTH:]
+        self.mac = bytes(chunk[-MAC_LENGTH:])
         try:
             self.cipher.verify(self.mac)
         except ValueError as e:
@@ -1,10 +1,9 @@
 import time
-from secrets import token_bytes
+from os import urandom as token_bytes
 from typing import Optional
 
-from Crypto.Cipher import ChaCha20_Poly1305
-
 from .constants import *
+from .backends import new_cipher
 from .typing import Bytes, MutableBytes
 from .stream_attributes import StreamAttributes
 
@@ -18,15 +17,26 @@ else:
 
 class Encrypter(StreamAttributes):
 
-    def initialize(self, nonce: Optional[Bytes] = None) -> bytearray:
+    @staticmethod
+    def padding_length_for(payload_length: int) -> int:
+        # See README.md
+        return (2*M - STREAM_METADATA_LENGTH - (payload_length % M)) % M
+
+    @classmethod
+    def stream_length(cls, payload_length: int) -> int:
+        return STREAM_METADATA_LENGTH + payload_length + cls.padding_length_for(payload_length)
+
+    def initialize(self, nonce: Optional[Bytes] = None, timestamp_ns: Optional[int] = None) \
+            -> bytearray:
+        """The encryption timestamp is the current time unless given, e.g. kept when re-keying."""
         assert not self.cipher
         self.reset()
         self.nonce = nonce if nonce else token_bytes(NONCE_LENGTH)
         if len(self.nonce) != NONCE_LENGTH:
             raise ValueError('Nonce must be ' + str(NONCE_LENGTH) + ' bytes long.')
         stream_header = bytearray(STREAM_SIGNATURE + self.nonce + TIMESTAMP_LENGTH*b'\x00')
-        self.cipher = ChaCha20_Poly1305.new(key=self.key, nonce=self.nonce)
-        self.stream_timestamp_ns = time_ns()
+        self.cipher = new_cipher(self.key, self.nonce)
+        self.stream_timestamp_ns = time_ns() if timestamp_ns is None else timestamp_ns
         self.cipher.encrypt(
             self.stream_timestamp_ns.to_bytes(TIMESTAMP_LENGTH, 'little'),
             memoryview(stream_header)[-TIMESTAMP_LENGTH:]
@@ -47,7 +57,7 @@ class Encrypter(StreamAttributes):
     def finalize(self) -> bytearray:
         assert self.cipher
         # See README.md
-        self.padding_length = (2*M - STREAM_METADATA_LENGTH - (self.payload_length % M)) % M
+        self.padding_length = self.padding_length_for(self.payload_length)
         padding = token_bytes(self.padding_length) \
                 + self.padding_length.to_bytes(PADDING_LENGTH_LENGTH, 'little', signed=False)
         result = bytearray(len(padding) + MAC_LENGTH)
@@ -0,0 +1,120 @@
+from io import RawIOBase
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Union
+
+from .constants import *
+from .encrypter import Encrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .buffer_pool import SecureBufferPool, acquire_buffer, release_buffer
+from .blocking_io import BUFFER_SIZE, check_buffer_size, check_stream_version, read_all, write_all
+from .typing import Bytes
+
+
+__all__ = (
+    'encrypt_stream',
+)
+
+
+def encrypt_stream(output_streams: Sequence[RawIOBase], input_stream: RawIOBase,
+                   keys: Sequence[bytes], buffer_size: int = BUFFER_SIZE, version: int = 1,
+                   buffer_pool: Optional[SecureBufferPool] = None,
+                   compression: Optional[str] = None) \
+        -> List[Union[Encrypter, SegmentedEncrypter]]:
+    """
+    Encrypts a single read of the input into one stream per key, each with its own nonce.
+    Every chunk is encrypted and written for all the keys on a thread per key, while the next
+    chunk is read. A compressed payload is compressed once. See blocking_io.encrypt_stream().
+    """
+    check_buffer_size(buffer_size)
+    if len(output_streams) != len(keys) or not keys:
+        raise ValueError('Every key requires its own output stream.')
+    if compression and version != 2:
+        raise ValueError('Compression requires the stream version 2.')
+    if check_stream_version(version) == 2:
+        buffer_size = SEGMENT_PAYLOAD_LENGTH
+    if compression:
+        from .compression import CompressingReader
+        with CompressingReader(input_stream, compression) as reader:
+            encrypters = _encrypt_stream(output_streams, reader, keys, buffer_size, version,
+                                         buffer_pool, reader.codec)
+            for encrypter in encrypters:
+                encrypter.uncompressed_length = reader.input_length
+            return encrypters
+    return _encrypt_stream(output_streams, input_stream, keys, buffer_size, version, buffer_pool)
+
+
+def _encrypt_stream(output_streams: Sequence[RawIOBase], input_stream: RawIOBase,
+                    keys: Sequence[bytes], chunk_size: int, version: int,
+                    buffer_pool: Optional[SecureBufferPool], compression: Optional[str] = None) \
+        -> List[Union[Encrypter, SegmentedEncrypter]]:
+    recipients = []
+    buffers = []
+    try:
+        for output_stream, key in zip(output_streams, keys):
+            recipients.append(_Recipient(output_stream, key, version, chunk_size, buffer_pool,
+                                         compression))
+        # The current chunk is encrypted while the following one is known and the spare is read.
+        for _ in range(3):
+            buffers.append(acquire_buffer(buffer_pool, chunk_size))
+        with ThreadPoolExecutor(len(recipients)) as executor:
+            current, following, spare = buffers
+            current_length = read_all(current, input_stream)
+            following_length = read_all(following, input_stream) \
+                if current_length == chunk_size else 0
+            index = 0
+            while True:
+                final = not following_length
+                chunk = memoryview(current)[:current_length]
+                futures = [executor.submit(recipient.process, index, chunk, final)
+                           for recipient in recipients]
+                spare_length = read_all(spare, input_stream) \
+                    if following_length == chunk_size else 0
+                for future in futures:
+                    future.result()
+                chunk.release()
+                if final:
+                    break
+                index += 1
+                current, following, spare = following, spare, current
+                current_length, following_length = following_length, spare_length
+    finally:
+        for buffer in buffers:
+            release_buffer(buffer_pool, buffer)
+        for recipient in recipients:
+            recipient.clear()
+    return [recipient.encrypter for recipient in recipients]
+
+
+class _Recipient:
+    """Encrypts the chunks for a single key, in order, into its own output stream."""
+
+    def __init__(self, output_stream: RawIOBase, key: bytes, version: int, chunk_size: int,
+                 buffer_pool: Optional[SecureBufferPool], compression: Optional[str]):
+        self.output_stream = output_stream
+        self.buffer_pool = buffer_pool
+        if version == 2:
+            self.encrypter = SegmentedEncrypter(key)
+            write_all(output_stream, self.encrypter.initialize(compression=compression))
+            self.output_buffer = acquire_buffer(buffer_pool, SEGMENT_LENGTH)
+        else:
+            self.encrypter = Encrypter(key)
+            write_all(output_stream, self.encrypter.initialize())
+            self.output_buffer = acquire_buffer(buffer_pool, chunk_size)
+
+    def process(self, index: int, chunk: Bytes, final: bool) -> None:
+        encrypter = self.encrypter
+        if isinstance(encrypter, SegmentedEncrypter):
+            if final:
+                write_all(self.output_stream, encrypter.finalize(index, chunk))
+            else:
+                write_all(self.output_stream,
+                          encrypter.encrypt_segment(index, chunk, self.output_buffer))
+            return
+        if chunk:
+            output = memoryview(self.output_buffer)[:len(chunk)]
+            write_all(self.output_stream, encrypter.process_chunk(chunk, output))
+        if final:
+            write_all(self.output_stream, encrypter.finalize())
+
+    def clear(self) -> None:
+        release_buffer(self.buffer_pool, self.output_buffer)
@@ -0,0 +1,75 @@
+import os
+import stat
+from io import RawIOBase
+from typing import NamedTuple, Optional, Tuple
+
+from .constants import *
+from .segmented_decrypter import SegmentedDecrypter
+from .segments import final_segment_length, split_segments
+from .blocking_io import create_decrypter
+
+
+__all__ = (
+    'StreamInfo',
+    'inspect_stream',
+    'payload_length_range',
+)
+
+
+class StreamInfo(NamedTuple):
+    version: int
+    stream_timestamp_ns: int
+    stream_length: Optional[int] = None
+    min_payload_length: Optional[int] = None
+    max_payload_length: Optional[int] = None
+    compression: Optional[str] = None
+
+
+def inspect_stream(input_stream: RawIOBase, key: bytes, after_ns: Optional[int] = None) \
+        -> StreamInfo:
+    """
+    Reads the stream header only, so the time does not depend on the stream length. The length
+    of a regular file is checked and turned into the payload length range, since the padding
+    length is known after decrypting the final chunk. Nothing is authenticated in version 1.
+    The payload length of a compressed stream is the compressed one.
+    """
+    start = _get_regular_file_position(input_stream)
+    decrypter = create_decrypter(input_stream, key, after_ns)
+    version = 2 if isinstance(decrypter, SegmentedDecrypter) else 1
+    if start is None:
+        return StreamInfo(version, decrypter.stream_timestamp_ns,
+                          compression=decrypter.compression)
+    stream_length = os.fstat(input_stream.fileno()).st_size - start
+    return StreamInfo(version, decrypter.stream_timestamp_ns, stream_length,
+                      *payload_length_range(stream_length, version),
+                      compression=decrypter.compression)
+
+
+def payload_length_range(stream_length: int, version: int) -> Tuple[int, int]:
+    """Returns the shortest and the longest payload a valid stream of the length may carry."""
+    if stream_length % STREAM_LENGTH_MULTIPLICAND:
+        raise ValueError('Stream length is not a multiple of {:,} B.'.format(M))
+    if version == 1:
+        body_length = stream_length - STREAM_METADATA_LENGTH
+        if body_length < 0:
+            raise ValueError('Not enough data.')
+        return max(0, body_length - (M - 1)), body_length
+    count, final_length = split_segments(stream_length - STREAM_V2_HEADER_LENGTH)
+    # The final segment is the shortest one fitting the payload tail, see final_segment_length().
+    max_tail_length = min(final_length - STREAM_FOOTER_LENGTH, SEGMENT_PAYLOAD_LENGTH)
+    min_tail_length = 0 if final_length == final_segment_length(0) \
+        else final_length - STREAM_FOOTER_LENGTH - (M - 1)
+    if min_tail_length > max_tail_length:
+        raise ValueError('Invalid final segment length.')
+    return (count * SEGMENT_PAYLOAD_LENGTH + min_tail_length,
+            count * SEGMENT_PAYLOAD_LENGTH + max_tail_length)
+
+
+def _get_regular_file_position(stream: RawIOBase) -> Optional[int]:
+    try:
+        fd = stream.fileno()
+        if stat.S_ISREG(os.fstat(fd).st_mode):
+            return os.lseek(fd, 0, os.SEEK_CUR)
+    except (AttributeError, OSError, ValueError):
+        pass
+    return None
@@ -0,0 +1,191 @@
+from typing import Callable, Generator, Iterable, Optional, Union
+
+from .constants import *
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter, check_uncompressed
+from .blocking_io import BUFFER_SIZE, check_stream_version
+from .bytes_utils import clear_secret
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'encrypt_iter',
+    'decrypt_iter',
+)
+
+
+def encrypt_iter(chunks: Iterable[Bytes], key: bytes, chunk_size: int = BUFFER_SIZE,
+                 version: int = 1, reuse_buffer: bool = False) \
+        -> Generator[Bytes, None, Union[Encrypter, SegmentedEncrypter]]:
+    """
+    Encrypts bytes-like chunks of any sizes into chunks of chunk_size bytes, except the last one.
+    With reuse_buffer, the yielded chunks are memoryviews of a single buffer, valid until the next
+    chunk is requested. The generator returns the encrypter, e.g. as the value of yield from.
+    """
+    output = _ChunkedOutput(chunk_size, reuse_buffer)
+    try:
+        if check_stream_version(version) == 2:
+            return (yield from _encrypt_segments(chunks, key, output))
+        encrypter = Encrypter(key)
+        yield from output.put(encrypter.initialize())
+        for chunk in chunks:
+            with memoryview(chunk) as original, original.cast('B') as view:
+                yield from output.put(view, encrypter.process_chunk)
+        yield from output.put(encrypter.finalize())
+        yield from output.flush()
+        return encrypter
+    finally:
+        output.clear()
+
+
+def decrypt_iter(chunks: Iterable[Bytes], key: bytes, chunk_size: int = BUFFER_SIZE,
+                 reuse_buffer: bool = False) \
+        -> Generator[Bytes, None, Union[Decrypter, SegmentedDecrypter]]:
+    """
+    Decrypts a stream of any version given as bytes-like chunks of any sizes. See encrypt_iter()
+    for the output chunks. The final chunk of the stream is held back until the input ends,
+    which is when the MAC is verified. At most chunk_size plus two segments are buffered.
+    """
+    output = _ChunkedOutput(chunk_size, reuse_buffer)
+    pending = bytearray()
+    plain_buffer = bytearray()
+    try:
+        decrypter = None
+        capacity = STREAM_V2_HEADER_LENGTH
+        index = 0
+        for chunk in chunks:
+            with memoryview(chunk) as original, original.cast('B') as view:
+                while view:
+                    length = min(len(view), capacity - len(pending))
+                    pending += view[:length]
+                    view = view[length:]
+                    if decrypter is None:
+                        decrypter = _initialize_decrypter(pending, key)
+                        if decrypter is None:
+                            continue
+                        if isinstance(decrypter, SegmentedDecrypter):
+                            capacity = SEGMENT_LOOKAHEAD
+                            plain_buffer = bytearray(SEGMENT_LOOKAHEAD)
+                        else:
+                            capacity = chunk_size + FINAL_CHUNK_HOLDBACK
+                            plain_buffer = bytearray(FINAL_CHUNK_HOLDBACK)
+                    if isinstance(decrypter, SegmentedDecrypter):
+                        while len(pending) >= SEGMENT_LOOKAHEAD:
+                            with memoryview(pending) as segments:
+                                decrypter.decrypt_segment(
+                                    index, segments[:SEGMENT_LENGTH], plain_buffer
+                                )
+                            del pending[:SEGMENT_LENGTH]
+                            index += 1
+                            with memoryview(plain_buffer) as plain:
+                                yield from output.put(plain[:SEGMENT_PAYLOAD_LENGTH])
+                    elif len(pending) > FINAL_CHUNK_HOLDBACK:
+                        length = len(pending) - FINAL_CHUNK_HOLDBACK
+                        with memoryview(pending) as processed:
+                            yield from output.put(processed[:length], decrypter.process_chunk)
+                        del pending[:length]
+        if decrypter is None:
+            decrypter = _initialize_decrypter(pending, key, True)
+            plain_buffer = bytearray(SEGMENT_LOOKAHEAD)
+        if isinstance(decrypter, SegmentedDecrypter):
+            tail = decrypter.finalize(index, pending, plain_buffer)
+        else:
+            if len(pending) < STREAM_FOOTER_LENGTH:
+                raise ValueError('Not enough data.')
+            tail = decrypter.finalize(pending, plain_buffer)
+        yield from output.put(tail)
+        yield from output.flush()
+        return decrypter
+    finally:
+        output.clear()
+        clear_secret(plain_buffer)
+
+
+def _initialize_decrypter(pending: bytearray, key: bytes, final: bool = False) \
+        -> Optional[Union[Decrypter, SegmentedDecrypter]]:
+    """Consumes the header from pending. Returns None if more data is needed to recognize it."""
+    if len(pending) < STREAM_SIGNATURE_LENGTH and not final:
+        return None
+    if pending.startswith(STREAM_V2_SIGNATURE):
+        decrypter, header_length = SegmentedDecrypter(key), STREAM_V2_HEADER_LENGTH
+    else:
+        decrypter, header_length = Decrypter(key), STREAM_HEADER_LENGTH
+    if len(pending) < header_length:
+        if final:
+            raise ValueError('Not enough data.')
+        return None
+    decrypter.initialize(bytes(pending[:header_length]))
+    check_uncompressed(decrypter)
+    del pending[:header_length]
+    return decrypter
+
+
+def _encrypt_segments(chunks: Iterable[Bytes], key: bytes, output: '_ChunkedOutput') \
+        -> Generator[Bytes, None, SegmentedEncrypter]:
+    encrypter = SegmentedEncrypter(key)
+    yield from output.put(encrypter.initialize())
+    segment = bytearray(SEGMENT_LENGTH)
+    segment_view = memoryview(segment)
+    length = 0
+    index = 0
+    try:
+        for chunk in chunks:
+            with memoryview(chunk) as original, original.cast('B') as view:
+                while view:
+                    if length == SEGMENT_PAYLOAD_LENGTH:
+                        # More data follows, so the collected segment is not the final one.
+                        encrypter.encrypt_segment(
+                            index, segment_view[:SEGMENT_PAYLOAD_LENGTH], segment_view
+                        )
+                        yield from output.put(segment_view)
+                        index += 1
+                        length = 0
+                    copied = min(SEGMENT_PAYLOAD_LENGTH - length, len(view))
+                    segment_view[length:length+copied] = view[:copied]
+                    length += copied
+                    view = view[copied:]
+        yield from output.put(encrypter.finalize(index, segment_view[:length]))
+        yield from output.flush()
+        return encrypter
+    finally:
+        segment_view.release()
+        clear_secret(segment)
+
+
+class _ChunkedOutput:
+    """Collects output data into chunks of the given size, which are yielded when full."""
+
+    def __init__(self, chunk_size: int, reuse_buffer: bool):
+        if chunk_size <= 0:
+            raise ValueError('Chunk size must be positive.')
+        self._buffer = bytearray(chunk_size)
+        self._view = memoryview(self._buffer)
+        self._length = 0
+        self._reuse_buffer = reuse_buffer
+
+    def put(self, data: Bytes,
+            process: Optional[Callable[[Bytes, MutableBytes], Bytes]] = None) \
+            -> Generator[Bytes, None, None]:
+        """Copies the data, or processes it by process(data, output) straight into the buffer."""
+        data = memoryview(data)
+        while data:
+            length = min(len(self._view) - self._length, len(data))
+            output = self._view[self._length:self._length+length]
+            if process is None:
+                output[:] = data[:length]
+            else:
+                process(data[:length], output)
+            self._length += length
+            data = data[length:]
+            if self._length == len(self._view):
+                yield from self.flush()
+
+    def flush(self) -> Generator[Bytes, None, None]:
+        if self._length:
+            length, self._length = self._length, 0
+            yield self._view[:length] if self._reuse_buffer else bytes(self._view[:length])
+
+    def clear(self) -> None:
+        clear_secret(self._buffer)
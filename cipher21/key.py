@@ -1,3 +1,10 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Iterator, Optional, Tuple, Union
+
 from .constants import KEY_LENGTH
 from .bytes_utils import *
 from .typing import Bytes, MutableBytes, Openable
@@ -66,3 +73,164 @@ class Cipher21Key:
 
     def __del__(self):
         self.clear()
+
+
+class KeyStore:
+    """
+    Resolves key references: env:NAME, file:PATH, fd:NUMBER and dir:NAME, the latter being
+    a file NAME in the key directory. lease() caches the validated keys of all but fd:
+    references, up to capacity least recently used ones, each for at most ttl seconds.
+    File keys are reloaded when the file's modification time, size or inode changes.
+    Evicted keys are cleared, the leased ones once released.
+    """
+
+    SCHEMES = ('env', 'file', 'fd', 'dir')
+
+    def __init__(self, directory: Optional[str] = None, capacity: int = 1024,
+                 ttl: Optional[float] = 300.0):
+        if capacity <= 0:
+            raise ValueError('Key store capacity must be positive.')
+        self.directory = directory
+        self.capacity = capacity
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # type: OrderedDict[str, _KeyStoreEntry]
+        self._lock = threading.Lock()
+        self._version_salt = os.urandom(16)
+
+    @staticmethod
+    def get_monotonic_time() -> float:
+        return time.monotonic()
+
+    def parse_reference(self, reference: str) -> Tuple[str, str]:
+        scheme, separator, location = reference.partition(':')
+        if not separator:
+            raise ValueError('No key location scheme. Use env: or file: or fd: or dir: prefix.')
+        if scheme not in self.SCHEMES:
+            raise ValueError('Unsupported secret source scheme `' + scheme + ':`.')
+        return scheme, location
+
+    def locate(self, scheme: str, location: str) -> Openable:
+        """Returns the file path or descriptor of a file:, fd: or dir: key."""
+        if scheme == 'fd':
+            try:
+                return int(location)
+            except ValueError:
+                raise ValueError('Malformed file descriptor number `' + location + '`.')
+        if scheme == 'dir':
+            if self.directory is None:
+                raise ValueError('No key directory for the dir: keys.')
+            if not location or location.startswith('.') or '/' in location \
+                    or os.sep in location or '\0' in location:
+                raise ValueError('Malformed key name `' + location + '`.')
+            return os.path.join(self.directory, location)
+        return location
+
+    def load(self, reference: str) -> Cipher21Key:
+        """Reads and validates a key bypassing the cache. The caller has to clear it."""
+        scheme, location = self.parse_reference(reference)
+        if scheme == 'env':
+            hex_key = os.environ.get(location)
+            if not hex_key:
+                raise ValueError('No value under ' + location + ' environment variable.')
+            try:
+                return Cipher21Key.from_hexes(hex_key.encode('UTF-8'))
+            except Exception as error:
+                raise ValueError('Error occurred while reading key from ' + location
+                                 + ' environment variable: ' + str(error))
+        file = self.locate(scheme, location)
+        try:
+            return Cipher21Key.from_hex_file(file)
+        except Exception as error:
+            raise ValueError('Error occurred while reading ' + str(file) + ' file: ' + str(error))
+
+    @contextmanager
+    def lease(self, reference: str) -> Iterator[Cipher21Key]:
+        """Provides a cached key, which is not cleared before the lease ends."""
+        entry = self._acquire(reference)
+        try:
+            yield entry.key
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                if entry.evicted and not entry.leases:
+                    entry.key.clear()
+
+    def _acquire(self, reference: str) -> '_KeyStoreEntry':
+        scheme, location = self.parse_reference(reference)
+        if scheme == 'fd':
+            # Reading consumes the descriptor, so there is nothing to validate a cached key with.
+            entry = _KeyStoreEntry(self.load(reference), None, 0.0)
+            entry.evicted = True
+            return entry
+        version = self._get_version(scheme, location)
+        now = self.get_monotonic_time()
+        with self._lock:
+            entry = self._entries.get(reference)
+            if entry is not None and entry.version == version and now < entry.expiry:
+                self._entries.move_to_end(reference)
+                entry.leases += 1
+                self.hits += 1
+                return entry
+            self.misses += 1
+        # Loaded without holding the lock, so other keys are served meanwhile.
+        key = self.load(reference)
+        entry = _KeyStoreEntry(key, version, float('inf') if self.ttl is None else now + self.ttl)
+        with self._lock:
+            if reference in self._entries:
+                self._evict(reference)
+            self._entries[reference] = entry
+            while len(self._entries) > self.capacity:
+                self._evict(next(iter(self._entries)))
+        return entry
+
+    def _get_version(self, scheme: str, location: str) -> Union[None, bytes, Tuple[int, int, int]]:
+        if scheme == 'env':
+            value = os.environ.get(location)
+            if value is None:
+                return None
+            # A salted digest, so the cache keeps no copy of the hexadecimal key beside the key.
+            from hashlib import blake2b
+            return blake2b(value.encode(), digest_size=16, key=self._version_salt).digest()
+        try:
+            stat = os.stat(self.locate(scheme, location))
+        except OSError:
+            return None  # load() reports the error.
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _evict(self, reference: str) -> None:
+        entry = self._entries.pop(reference)
+        entry.evicted = True
+        if not entry.leases:
+            entry.key.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            for reference in list(self._entries):
+                self._evict(reference)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.clear()
+
+    def __del__(self):
+        if hasattr(self, '_lock'):
+            self.clear()
+
+
+class _KeyStoreEntry:
+
+    __slots__ = ('key', 'version', 'expiry', 'leases', 'evicted')
+
+    def __init__(self, key: Cipher21Key, version, expiry: float):
+        self.key = key
+        self.version = version
+        self.expiry = expiry
+        self.leases = 1
+        self.evicted = False
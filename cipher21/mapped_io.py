@@ -0,0 +1,222 @@
+import os
+import stat
+import mmap
+from io import IOBase
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Union
+
+from .constants import *
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter
+from .segments import split_segments
+from . import blocking_io
+from .blocking_io import check_stream_version
+from .bytes_utils import clear_secret
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+__all__ = (
+    'is_mappable',
+    'encrypt_file',
+    'decrypt_file',
+)
+
+
+CHUNK_SIZE = 64 * STREAM_LENGTH_MULTIPLICAND
+
+
+def is_mappable(output_file: IOBase, input_file: IOBase) -> bool:
+    """
+    Tells whether the input is a readable and the output a readable and writable regular file.
+    Wrappers observing every call, e.g. the drop-behind ones, are unseekable, so they are not.
+    """
+    if fcntl is None:
+        return False
+    try:
+        if not (output_file.seekable() and input_file.seekable()):
+            return False
+        output_fd, input_fd = output_file.fileno(), input_file.fileno()
+        return stat.S_ISREG(os.fstat(input_fd).st_mode) \
+            and stat.S_ISREG(os.fstat(output_fd).st_mode) \
+            and _get_access_mode(input_fd) in (os.O_RDONLY, os.O_RDWR) \
+            and _get_access_mode(output_fd) == os.O_RDWR
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def encrypt_file(output_file: IOBase, input_file: IOBase, key: bytes, version: int = 1,
+                 workers: Optional[int] = None) -> Union[Encrypter, SegmentedEncrypter]:
+    """
+    Encrypts between memory mapped regular files. The output file is preallocated
+    with the exact stream length and the cipher writes straight into its mapping.
+    """
+    with _map(input_file, False) as input_view:
+        if check_stream_version(version) == 2:
+            encrypter = SegmentedEncrypter(key)
+        else:
+            encrypter = Encrypter(key)
+        stream_length = encrypter.stream_length(len(input_view))
+        _preallocate(output_file, stream_length)
+        with _map(output_file, True) as output_view:
+            if version == 2:
+                _encrypt_segments(output_view, input_view, encrypter, workers)
+            else:
+                _encrypt_chunks(output_view, input_view, encrypter)
+    return encrypter
+
+
+def decrypt_file(output_file: IOBase, input_file: IOBase, key: bytes,
+                 workers: Optional[int] = None, after_ns: Optional[int] = None) \
+        -> Union[Decrypter, SegmentedDecrypter]:
+    """
+    Decrypts between memory mapped regular files. The output file is preallocated for
+    the longest possible payload and truncated to the actual one at the end, or to zero
+    on any failure, so no unverified plaintext is left. Compressed streams are decrypted
+    by blocking_io, as the decompressed length is unknown beforehand.
+    """
+    try:
+        return _decrypt_file(output_file, input_file, key, workers, after_ns)
+    except BaseException:
+        output_file.truncate(0)
+        raise
+
+
+def _decrypt_file(output_file: IOBase, input_file: IOBase, key: bytes, workers: Optional[int],
+                  after_ns: Optional[int]) -> Union[Decrypter, SegmentedDecrypter]:
+    with _map(input_file, False) as input_view:
+        if input_view[:STREAM_SIGNATURE_LENGTH] == STREAM_V2_SIGNATURE:
+            decrypter, header_length = SegmentedDecrypter(key, after_ns), STREAM_V2_HEADER_LENGTH
+        else:
+            decrypter, header_length = Decrypter(key, after_ns), STREAM_HEADER_LENGTH
+        if len(input_view) < header_length + STREAM_FOOTER_LENGTH:
+            raise ValueError('Not enough data.')
+        decrypter.initialize(bytes(input_view[:header_length]))
+        if decrypter.compression:
+            return _decrypt_compressed_file(output_file, input_file, key, workers, after_ns)
+        _preallocate(output_file, len(input_view) - header_length - STREAM_FOOTER_LENGTH)
+        with _map(output_file, True) as output_view:
+            if header_length == STREAM_V2_HEADER_LENGTH:
+                _decrypt_segments(output_view, input_view[header_length:], decrypter, workers)
+            else:
+                _decrypt_chunks(output_view, input_view[header_length:], decrypter)
+    output_file.truncate(decrypter.payload_length)
+    return decrypter
+
+
+def _decrypt_compressed_file(output_file: IOBase, input_file: IOBase, key: bytes,
+                             workers: Optional[int], after_ns: Optional[int]) -> SegmentedDecrypter:
+    input_file.seek(0)
+    output_file.seek(0)
+    output_file.truncate(0)
+    return blocking_io.decrypt_stream(output_file, input_file, key, workers=workers,
+                                      after_ns=after_ns)
+
+
+def _encrypt_chunks(output_view: memoryview, input_view: memoryview, encrypter: Encrypter) -> None:
+    output_view[:STREAM_HEADER_LENGTH] = encrypter.initialize()
+    output_view = output_view[STREAM_HEADER_LENGTH:]
+    for offset in range(0, len(input_view), CHUNK_SIZE):
+        end = min(offset + CHUNK_SIZE, len(input_view))
+        encrypter.process_chunk(input_view[offset:end], output_view[offset:end])
+    output_view[len(input_view):] = encrypter.finalize()
+
+
+def _decrypt_chunks(output_view: memoryview, input_view: memoryview, decrypter: Decrypter) -> None:
+    # The final chunk has to cover the whole padding, which is shorter than M.
+    final_offset = max(0, len(input_view) - 2*STREAM_LENGTH_MULTIPLICAND)
+    for offset in range(0, final_offset, CHUNK_SIZE):
+        end = min(offset + CHUNK_SIZE, final_offset)
+        decrypter.process_chunk(input_view[offset:end], output_view[offset:end])
+    _finalize_into(output_view[final_offset:], decrypter.finalize, input_view[final_offset:])
+
+
+def _encrypt_segments(output_view: memoryview, input_view: memoryview,
+                      encrypter: SegmentedEncrypter, workers: Optional[int]) -> None:
+    output_view[:STREAM_V2_HEADER_LENGTH] = encrypter.initialize()
+    output_view = output_view[STREAM_V2_HEADER_LENGTH:]
+    count, _ = encrypter.split_payload(len(input_view))
+
+    def encrypt_segment(index: int):
+        encrypter.encrypt_segment(
+            index,
+            input_view[index*SEGMENT_PAYLOAD_LENGTH:(index+1)*SEGMENT_PAYLOAD_LENGTH],
+            output_view[index*SEGMENT_LENGTH:(index+1)*SEGMENT_LENGTH]
+        )
+
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        for _ in executor.map(encrypt_segment, range(count)):
+            pass
+    output_view[count*SEGMENT_LENGTH:] \
+        = encrypter.finalize(count, input_view[count*SEGMENT_PAYLOAD_LENGTH:])
+
+
+def _decrypt_segments(output_view: memoryview, input_view: memoryview,
+                      decrypter: SegmentedDecrypter, workers: Optional[int]) -> None:
+    count, _ = split_segments(len(input_view))
+
+    def decrypt_segment(index: int):
+        decrypter.decrypt_segment(
+            index,
+            input_view[index*SEGMENT_LENGTH:(index+1)*SEGMENT_LENGTH],
+            output_view[index*SEGMENT_PAYLOAD_LENGTH:(index+1)*SEGMENT_PAYLOAD_LENGTH]
+        )
+
+    with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+        for _ in executor.map(decrypt_segment, range(count)):
+            pass
+    _finalize_into(
+        output_view[count*SEGMENT_PAYLOAD_LENGTH:],
+        lambda segment, output: decrypter.finalize(count, segment, output),
+        input_view[count*SEGMENT_LENGTH:]
+    )
+
+
+def _finalize_into(output_view: memoryview, finalize, final_chunk: memoryview) -> None:
+    # The decrypted padding does not fit into the preallocated output, so it goes through a buffer.
+    buffer = bytearray(len(final_chunk))
+    try:
+        payload_tail = finalize(final_chunk, buffer)
+        output_view[:len(payload_tail)] = payload_tail
+    finally:
+        clear_secret(buffer)
+
+
+@contextmanager
+def _map(file: IOBase, writable: bool):
+    length = os.fstat(file.fileno()).st_size
+    if not length:
+        yield memoryview(bytearray())
+        return
+    access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+    mapping = mmap.mmap(file.fileno(), length, access=access)
+    try:
+        with memoryview(mapping) as view:
+            yield view
+        if writable:
+            mapping.flush()
+    finally:
+        try:
+            mapping.close()
+        except BufferError:
+            pass  # Views kept alive by an exception traceback, the mapping is closed by GC then.
+
+
+def _preallocate(file: IOBase, length: int) -> None:
+    file.truncate(0)
+    if length and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(file.fileno(), 0, length)
+        except OSError:
+            pass
+    file.truncate(length)
+
+
+def _get_access_mode(fd: int) -> int:
+    return fcntl.fcntl(fd, fcntl.F_GETFL) & os.O_ACCMODE
@@ -0,0 +1,99 @@
+from os import urandom as token_bytes
+from typing import Optional
+
+from .constants import *
+from .backends import new_cipher
+from .encrypter import Encrypter, time_ns
+from .verifier import Verifier, CHACHA20_BLOCK_LENGTH
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'encrypted_length',
+    'encrypt_bytes',
+    'decrypt_bytes',
+    'decrypt_into',
+)
+
+
+def encrypted_length(payload_length: int) -> int:
+    return Encrypter.stream_length(payload_length)
+
+
+def encrypt_bytes(data: Bytes, key: bytes, output: Optional[MutableBytes] = None) \
+        -> MutableBytes:
+    """
+    Encrypts a whole message into a version 1 stream with a single cipher call, in place of the
+    output. The output, e.g. reused by the caller, has to be exactly encrypted_length(len(data))
+    bytes long. A new bytearray by default.
+    """
+    with memoryview(data) as original, original.cast('B') as data:
+        payload_length = len(data)
+        stream_length = encrypted_length(payload_length)
+        padding_length = stream_length - STREAM_METADATA_LENGTH - payload_length
+        if output is None:
+            output = bytearray(stream_length)
+        elif len(output) != stream_length:
+            raise ValueError('The output must be ' + str(stream_length) + ' bytes long.')
+        nonce = token_bytes(NONCE_LENGTH)
+        padding_offset = STREAM_HEADER_LENGTH + payload_length
+        with memoryview(output) as view:
+            view[:NONCE_OFFSET] = STREAM_SIGNATURE
+            view[NONCE_OFFSET:TIMESTAMP_OFFSET] = nonce
+            view[TIMESTAMP_OFFSET:STREAM_HEADER_LENGTH] \
+                = time_ns().to_bytes(TIMESTAMP_LENGTH, 'little')
+            view[STREAM_HEADER_LENGTH:padding_offset] = data
+            view[padding_offset:padding_offset+padding_length] = token_bytes(padding_length)
+            view[-STREAM_FOOTER_LENGTH:-MAC_LENGTH] \
+                = padding_length.to_bytes(PADDING_LENGTH_LENGTH, 'little', signed=False)
+            cipher = new_cipher(key, nonce)
+            with view[TIMESTAMP_OFFSET:-MAC_LENGTH] as plaintext:
+                cipher.encrypt(plaintext, plaintext)
+            view[-MAC_LENGTH:] = cipher.digest()
+    return output
+
+
+def decrypt_bytes(blob: Bytes, key: bytes, after_ns: Optional[int] = None) -> bytearray:
+    """
+    Decrypts a whole version 1 stream into an exactly sized bytearray. The MAC is verified
+    before any payload is decrypted, so no unauthenticated plaintext is ever produced.
+    """
+    with memoryview(blob) as original, original.cast('B') as blob:
+        verifier = _verify(blob, key, after_ns)
+        output = bytearray(verifier.payload_length)
+        _decrypt_payload(verifier, blob, output)
+    return output
+
+
+def decrypt_into(blob: Bytes, key: bytes, output: MutableBytes,
+                 after_ns: Optional[int] = None) -> int:
+    """
+    Decrypts a whole version 1 stream into the beginning of the output, e.g. reused by the caller,
+    and returns the payload length. See decrypt_bytes().
+    """
+    with memoryview(blob) as original, original.cast('B') as blob:
+        verifier = _verify(blob, key, after_ns)
+        if verifier.payload_length > len(output):
+            raise ValueError('The output is shorter than the ' + str(verifier.payload_length)
+                             + ' bytes long payload.')
+        _decrypt_payload(verifier, blob, output)
+    return verifier.payload_length
+
+
+def _verify(blob: memoryview, key: bytes, after_ns: Optional[int]) -> Verifier:
+    if len(blob) < STREAM_METADATA_LENGTH:
+        raise ValueError('Not enough data.')
+    verifier = Verifier(key, after_ns)
+    verifier.initialize(bytes(blob[:STREAM_HEADER_LENGTH]))
+    verifier.finalize(blob[STREAM_HEADER_LENGTH:])
+    return verifier
+
+
+def _decrypt_payload(verifier: Verifier, blob: memoryview, output: MutableBytes) -> None:
+    length = verifier.payload_length
+    # The keystream of the payload follows the Poly1305 key block and the timestamp. It is XORed
+    # either way, and the cipher has already been used to encrypt.
+    verifier.cipher.seek(CHACHA20_BLOCK_LENGTH + TIMESTAMP_LENGTH)
+    with memoryview(output) as original, original.cast('B') as view:
+        verifier.cipher.encrypt(blob[STREAM_HEADER_LENGTH:STREAM_HEADER_LENGTH+length],
+                                output=view[:length])
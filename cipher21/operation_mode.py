@@ -5,3 +5,4 @@ class OperationMode(Enum):
     ENCRYPTION = 'encryption'
     VERIFICATION = 'verification'
     DECRYPTION = 'decryption'
+    REKEYING = 'rekeying'
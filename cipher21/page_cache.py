@@ -0,0 +1,162 @@
+import os
+import sys
+import stat
+import ctypes
+import logging
+from io import RawIOBase, IOBase
+from typing import Optional
+
+from .constants import STREAM_LENGTH_MULTIPLICAND
+
+
+__all__ = (
+    'DropBehindReader',
+    'DropBehindWriter',
+    'drop_behind',
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+DROP_INTERVAL = 512 * STREAM_LENGTH_MULTIPLICAND
+
+SYNC_FILE_RANGE_WAIT_BEFORE = 1
+SYNC_FILE_RANGE_WRITE = 2
+SYNC_FILE_RANGE_WAIT_AFTER = 4
+
+
+def _load_sync_file_range():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        function = ctypes.CDLL(None, use_errno=True).sync_file_range
+    except (OSError, AttributeError):
+        return None
+    function.argtypes = (ctypes.c_int, ctypes.c_int64, ctypes.c_int64, ctypes.c_uint)
+    function.restype = ctypes.c_int
+    return function
+
+
+_sync_file_range = _load_sync_file_range()
+
+
+def drop_behind(stream: IOBase, writable: bool) -> IOBase:
+    """
+    Wraps a regular file stream, so the processed part of the file is evicted from the page cache.
+    Other streams, such as pipes, are returned as they are.
+    """
+    if not hasattr(os, 'posix_fadvise'):
+        logger.debug('page cache: posix_fadvise is not available')
+        return stream
+    try:
+        if not stat.S_ISREG(os.fstat(stream.fileno()).st_mode):
+            return stream
+    except (OSError, ValueError, AttributeError):
+        return stream
+    return DropBehindWriter(stream) if writable else DropBehindReader(stream)
+
+
+class _DropBehind(RawIOBase):
+
+    def __init__(self, stream: IOBase, interval: int = DROP_INTERVAL):
+        super().__init__()
+        self.stream = stream
+        self.fd = stream.fileno()
+        self.interval = interval
+        self.offset = stream.tell()
+        self.dropped_offset = self.offset
+        self.dropped = 0
+        os.posix_fadvise(self.fd, self.offset, 0, os.POSIX_FADV_SEQUENTIAL)
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def seekable(self) -> bool:
+        return False
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self.stream.truncate(size)
+
+    def finish(self) -> int:
+        """Drops the rest of the file, including parts processed bypassing this stream."""
+        self._drop(max(self.offset, os.fstat(self.fd).st_size))
+        return self.dropped
+
+    def _drop(self, end: int) -> None:
+        if end <= self.dropped_offset:
+            return
+        try:
+            os.posix_fadvise(self.fd, self.dropped_offset, end - self.dropped_offset,
+                             os.POSIX_FADV_DONTNEED)
+        except OSError as e:
+            logger.debug('page cache: cannot drop file {} range: {}'.format(self.fd, e))
+        self.dropped += end - self.dropped_offset
+        self.dropped_offset = end
+
+
+class DropBehindReader(_DropBehind):
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> Optional[int]:
+        length = self.stream.readinto(buffer)
+        if length:
+            self.offset += length
+            if self.offset - self.dropped_offset >= self.interval:
+                self._drop(self.offset)
+        return length
+
+
+class DropBehindWriter(_DropBehind):
+    """
+    Starts the write-back of every written interval right away and drops the previous interval
+    once it has been written, so dirty pages neither pile up nor stay cached.
+    """
+
+    def __init__(self, stream: IOBase, interval: int = DROP_INTERVAL):
+        super().__init__(stream, interval)
+        self.synced_offset = self.offset
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> Optional[int]:
+        length = self.stream.write(b)
+        if length:
+            self.offset += length
+            if self.offset - self.synced_offset >= self.interval:
+                self.stream.flush()
+                self._drop(self.synced_offset)
+                self._sync(self.synced_offset, self.offset, SYNC_FILE_RANGE_WRITE)
+                self.synced_offset = self.offset
+        return length
+
+    def flush(self) -> None:
+        if not self.stream.closed:
+            self.stream.flush()
+
+    def finish(self) -> int:
+        self.stream.flush()
+        self._drop(max(self.offset, os.fstat(self.fd).st_size))
+        return self.dropped
+
+    def _drop(self, end: int) -> None:
+        self._sync(
+            self.dropped_offset, end,
+            SYNC_FILE_RANGE_WAIT_BEFORE | SYNC_FILE_RANGE_WRITE | SYNC_FILE_RANGE_WAIT_AFTER
+        )
+        super()._drop(end)
+
+    def _sync(self, start: int, end: int, flags: int) -> None:
+        if end <= start:
+            return
+        if _sync_file_range is None:
+            if flags & SYNC_FILE_RANGE_WAIT_AFTER:
+                os.fdatasync(self.fd)
+            return
+        if _sync_file_range(self.fd, start, end - start, flags):
+            logger.debug('page cache: cannot sync file {} range: {}'.format(
+                self.fd, os.strerror(ctypes.get_errno())
+            ))
@@ -0,0 +1,207 @@
+from io import RawIOBase
+from queue import Queue
+from threading import Thread
+from typing import Optional, Tuple, Union
+
+from . import blocking_io
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter
+from .bytes_utils import clear_secret, zero_fill
+from .buffer_pool import SecureBufferPool, acquire_buffer, release_buffer
+from .blocking_io import BUFFER_SIZE, check_buffer_size, check_stream_version, read_all, write_all, \
+    create_decrypter, _decrypt_segmented_stream
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'encrypt_stream',
+    'decrypt_stream',
+)
+
+
+RING_SIZE = 4
+JOIN_TIMEOUT = 5.0  # Seconds to wait on the error path for a thread blocked in I/O.
+
+
+def encrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes,
+                   buffer_size: int = BUFFER_SIZE, version: int = 1,
+                   workers: Optional[int] = None, buffer_pool: Optional[SecureBufferPool] = None,
+                   compression: Optional[str] = None) -> Union[Encrypter, SegmentedEncrypter]:
+    check_buffer_size(buffer_size)
+    if compression or check_stream_version(version) == 2:
+        # Segments are encrypted on a thread pool already, which overlaps I/O with the cipher.
+        return blocking_io.encrypt_stream(
+            output_stream, input_stream, key, buffer_size, version, workers, buffer_pool,
+            compression
+        )
+    with _Pipeline(output_stream, input_stream, buffer_size, buffer_pool=buffer_pool) as pipeline:
+        buffer, length = pipeline.read()
+        encrypter = Encrypter(key)
+        pipeline.write(encrypter.initialize())
+        while length:
+            output = pipeline.acquire_output()
+            pipeline.write(
+                encrypter.process_chunk(memoryview(buffer)[:length], memoryview(output)[:length]),
+                output
+            )
+            pipeline.recycle_input(buffer)
+            if length < len(buffer):
+                break
+            buffer, length = pipeline.read()
+        pipeline.write(encrypter.finalize())
+    return encrypter
+
+
+def decrypt_stream(output_stream: RawIOBase, input_stream: RawIOBase, key: bytes,
+                   buffer_size: int = BUFFER_SIZE, workers: Optional[int] = None,
+                   buffer_pool: Optional[SecureBufferPool] = None, after_ns: Optional[int] = None) \
+        -> Union[Decrypter, SegmentedDecrypter]:
+    check_buffer_size(buffer_size)
+    decrypter = create_decrypter(input_stream, key, after_ns)
+    if isinstance(decrypter, SegmentedDecrypter):
+        return _decrypt_segmented_stream(output_stream, input_stream, decrypter, workers,
+                                         buffer_pool)
+    out_buffer = bytearray()
+    try:
+        with _Pipeline(output_stream, input_stream, buffer_size,
+                       buffer_pool=buffer_pool) as pipeline:
+            prev_buffer, prev_length = pipeline.read()
+            next_buffer, next_length = bytearray(), 0
+            if prev_length == len(prev_buffer):
+                next_buffer, next_length = pipeline.read()
+            while next_length and next_length == len(next_buffer):
+                assert prev_length == next_length, (prev_length, next_length)
+                output = pipeline.acquire_output()
+                pipeline.write(decrypter.process_chunk(prev_buffer, output), output)
+                pipeline.recycle_input(prev_buffer)
+                prev_buffer, prev_length = next_buffer, next_length
+                next_buffer, next_length = pipeline.read()
+            out_buffer = decrypter.finalize(
+                b''.join((prev_buffer[:prev_length], next_buffer[:next_length]))
+            )
+            pipeline.write(out_buffer)
+    finally:
+        clear_secret(out_buffer)
+    return decrypter
+
+
+class _Pipeline:
+    """
+    Runs reading and writing on separate threads around the cipher stage of the calling thread.
+
+    Both directions pass buffers from a bounded ring of RING_SIZE preallocated buffers, so the
+    reader can be at most RING_SIZE buffers ahead of the cipher and the cipher at most RING_SIZE
+    buffers ahead of the writer. Ring buffers are zeroed when recycled and wiped when the pipeline
+    is left. On an error the queued writes are dropped and both threads are joined before the
+    wipe.
+    """
+
+    _STOP = None
+
+    def __init__(self, output_stream: RawIOBase, input_stream: RawIOBase,
+                 buffer_size: int = BUFFER_SIZE, ring_size: int = RING_SIZE,
+                 buffer_pool: Optional[SecureBufferPool] = None):
+        self._input_stream = input_stream
+        self._output_stream = output_stream
+        self._buffer_pool = buffer_pool
+        self._input_ring = []
+        self._output_ring = []
+        try:
+            for _ in range(ring_size):
+                self._input_ring.append(acquire_buffer(buffer_pool, buffer_size))
+                self._output_ring.append(acquire_buffer(buffer_pool, buffer_size))
+        except BaseException:
+            self.clear()
+            raise
+        self._free_inputs = Queue()
+        self._free_outputs = Queue()
+        self._read_queue = Queue()
+        self._write_queue = Queue()
+        for buffer in self._input_ring:
+            self._free_inputs.put(buffer)
+        for buffer in self._output_ring:
+            self._free_outputs.put(buffer)
+        self._write_error = None  # type: Optional[BaseException]
+        self._aborted = False
+        self._reader = Thread(target=self._read_loop, name='cipher21-reader', daemon=True)
+        self._writer = Thread(target=self._write_loop, name='cipher21-writer', daemon=True)
+
+    def __enter__(self):
+        self._reader.start()
+        self._writer.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._aborted = exc_type is not None
+        self._free_inputs.put(self._STOP)
+        self._write_queue.put(self._STOP)
+        try:
+            if exc_type is None:
+                self._writer.join()
+                if self._write_error:
+                    raise self._write_error
+                self._reader.join()
+            else:
+                self._writer.join(JOIN_TIMEOUT)
+                self._reader.join(JOIN_TIMEOUT)
+        finally:
+            # A thread still blocked in I/O may touch its buffer, which must not be reused then.
+            self.clear(reuse=not (self._reader.is_alive() or self._writer.is_alive()))
+
+    def clear(self, reuse: bool = False) -> None:
+        """Wipes the ring. Buffers go back to the pool for reuse only if no thread can touch them."""
+        for buffer in self._input_ring + self._output_ring:
+            release_buffer(self._buffer_pool, buffer, reuse)
+        self._input_ring, self._output_ring = [], []
+
+    def read(self) -> Tuple[MutableBytes, int]:
+        """Returns the next filled input buffer. A length shorter than the buffer means EOF."""
+        item = self._read_queue.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def recycle_input(self, buffer: MutableBytes) -> None:
+        zero_fill(buffer)
+        self._free_inputs.put(buffer)
+
+    def acquire_output(self) -> MutableBytes:
+        item = self._free_outputs.get()
+        if isinstance(item, BaseException):
+            raise item
+        return item
+
+    def write(self, data: Bytes, recycled: Optional[MutableBytes] = None) -> None:
+        """Queues data for writing. The recycled output ring buffer is released afterwards."""
+        self._write_queue.put((data, recycled))
+
+    def _read_loop(self) -> None:
+        try:
+            while True:
+                buffer = self._free_inputs.get()
+                if buffer is self._STOP or self._aborted:
+                    return
+                length = read_all(buffer, self._input_stream)
+                self._read_queue.put((buffer, length))
+                if length < len(buffer):
+                    return
+        except BaseException as e:
+            self._read_queue.put(e)
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._write_queue.get()
+            if item is self._STOP:
+                return
+            data, recycled = item
+            if not (self._write_error or self._aborted):
+                try:
+                    write_all(self._output_stream, data)
+                except BaseException as e:
+                    self._write_error = e
+                    self._free_outputs.put(e)
+            if recycled is not None:
+                zero_fill(recycled)
+                self._free_outputs.put(recycled)
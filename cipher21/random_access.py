@@ -0,0 +1,117 @@
+import os
+import stat
+from io import RawIOBase
+from typing import Optional, Union
+
+from .constants import *
+from .segments import split_segments
+from .segmented_decrypter import SegmentedDecrypter, check_uncompressed
+from .blocking_io import write_all, _SegmentPool
+from .bytes_utils import clear_secret
+from .buffer_pool import SecureBufferPool
+from .typing import MutableBytes
+
+
+__all__ = (
+    'decrypt_range',
+)
+
+
+def decrypt_range(output_stream: RawIOBase, input_file: Union[RawIOBase, int], key: bytes,
+                  start: int = 0, end: Optional[int] = None, workers: Optional[int] = None,
+                  buffer_pool: Optional[SecureBufferPool] = None, after_ns: Optional[int] = None) \
+        -> SegmentedDecrypter:
+    """
+    Decrypts and writes the payload bytes [start, end) of a version 2 stream stored in a regular
+    file. Only the segments covering the range are read and authenticated, so the cost does not
+    depend on the file size. The resulting decrypter payload_length is the written length.
+    """
+    fd = input_file if isinstance(input_file, int) else input_file.fileno()
+    if start < 0 or (end is not None and end < start):
+        raise ValueError('Invalid byte range.')
+    file_stat = os.fstat(fd)
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise ValueError('Byte range decryption requires a regular file.')
+    decrypter = SegmentedDecrypter(key, after_ns)
+    header = os.pread(fd, STREAM_V2_HEADER_LENGTH, 0)
+    if header.startswith(STREAM_SIGNATURE):
+        raise ValueError('Byte range decryption requires the stream version 2.')
+    if len(header) != STREAM_V2_HEADER_LENGTH:
+        raise ValueError('Not enough data.')
+    decrypter.initialize(header)
+    check_uncompressed(decrypter)
+    count, final_length = split_segments(file_stat.st_size - STREAM_V2_HEADER_LENGTH)
+    written = 0
+    with _SegmentPool(output_stream, SEGMENT_LENGTH, SEGMENT_PAYLOAD_LENGTH, workers,
+                      buffer_pool) as pool:
+        index = start // SEGMENT_PAYLOAD_LENGTH
+        while index < count and _overlaps(index, start, end):
+            segment_start = index * SEGMENT_PAYLOAD_LENGTH
+            lo = max(start - segment_start, 0)
+            hi = SEGMENT_PAYLOAD_LENGTH
+            if end is not None:
+                hi = min(end - segment_start, hi)
+            buffer = pool.acquire_input()
+            _pread_into(fd, buffer, _segment_offset(index))
+            pool.submit(_SliceDecryption(decrypter, lo, hi), index, buffer)
+            written += hi - lo
+            index += 1
+        pool.drain()
+        if index == count and _overlaps(index, start, end):
+            written += _decrypt_final_segment_range(
+                output_stream, fd, decrypter, count, final_length, start, end
+            )
+    decrypter.payload_length = written
+    return decrypter
+
+
+class _SliceDecryption:
+
+    def __init__(self, decrypter: SegmentedDecrypter, lo: int, hi: int):
+        self.decrypter = decrypter
+        self.lo = lo
+        self.hi = hi
+
+    def __call__(self, index: int, segment: MutableBytes, output: MutableBytes) -> memoryview:
+        return self.decrypter.decrypt_segment(index, segment, output)[self.lo:self.hi]
+
+
+def _decrypt_final_segment_range(output_stream: RawIOBase, fd: int, decrypter: SegmentedDecrypter,
+                                 index: int, length: int, start: int, end: Optional[int]) -> int:
+    buffer = bytearray(length)
+    _pread_into(fd, buffer, _segment_offset(index))
+    output = bytearray(length)
+    try:
+        payload_tail = decrypter.finalize(index, buffer, output)
+        segment_start = index * SEGMENT_PAYLOAD_LENGTH
+        lo = max(start - segment_start, 0)
+        hi = len(payload_tail) if end is None else min(end - segment_start, len(payload_tail))
+        if lo >= hi:
+            return 0
+        write_all(output_stream, payload_tail[lo:hi])
+        return hi - lo
+    finally:
+        clear_secret(output)
+
+
+def _overlaps(index: int, start: int, end: Optional[int]) -> bool:
+    return end is None or max(start, index * SEGMENT_PAYLOAD_LENGTH) < end
+
+
+def _segment_offset(index: int) -> int:
+    return STREAM_V2_HEADER_LENGTH + index * SEGMENT_LENGTH
+
+
+def _pread_into(fd: int, buffer: MutableBytes, offset: int) -> None:
+    view = memoryview(buffer)
+    done = 0
+    while done < len(buffer):
+        if hasattr(os, 'preadv'):
+            length = os.preadv(fd, (view[done:],), offset + done)
+        else:
+            chunk = os.pread(fd, len(buffer) - done, offset + done)
+            length = len(chunk)
+            view[done:done+length] = chunk
+        if not length:
+            raise ValueError('Not enough data.')
+        done += length
@@ -0,0 +1,276 @@
+from io import RawIOBase
+from queue import Queue
+from tempfile import TemporaryFile
+from threading import Thread
+from typing import Iterator, Optional, Union
+
+from .constants import *
+from .encrypter import Encrypter
+from .decrypter import Decrypter
+from .segmented_encrypter import SegmentedEncrypter
+from .segmented_decrypter import SegmentedDecrypter
+from .bytes_utils import clear_secret, zero_fill
+from .buffer_pool import SecureBufferPool, acquire_buffer, release_buffer
+from .pipelined_io import JOIN_TIMEOUT
+from .blocking_io import BUFFER_SIZE, check_buffer_size, check_stream_version, read_all, \
+    write_all, create_decrypter
+from .typing import Bytes, MutableBytes
+
+
+__all__ = (
+    'rekey_stream',
+)
+
+
+RING_SIZE = 4
+
+
+def rekey_stream(output_stream: RawIOBase, input_stream: RawIOBase, old_key: bytes,
+                 new_key: bytes, version: Optional[int] = None, buffer_size: int = BUFFER_SIZE,
+                 buffer_pool: Optional[SecureBufferPool] = None, after_ns: Optional[int] = None,
+                 keep_timestamp: bool = False) -> Union[Encrypter, SegmentedEncrypter]:
+    """
+    Decrypts a stream with the old key and encrypts its payload with the new key, in the given
+    version or in the one of the input. Decryption runs on a separate thread ahead of encryption.
+    The new stream gets its final MAC only after the old one verifies, so it cannot authenticate
+    unless the input does. Version 2 segments authenticate on their own, so re-keying a version 1
+    stream into version 2 spools the new stream into a temporary file and writes it out only after
+    the old MAC verifies. A compressed payload is passed through as it is.
+    """
+    check_buffer_size(buffer_size)
+    decrypter = create_decrypter(input_stream, old_key, after_ns)
+    if version is None:
+        version = 2 if isinstance(decrypter, SegmentedDecrypter) else 1
+    if decrypter.compression and check_stream_version(version) != 2:
+        raise ValueError('Compressed streams can be re-keyed into the stream version 2 only.')
+    timestamp_ns = decrypter.stream_timestamp_ns if keep_timestamp else None
+    if version == 2:
+        encrypter = SegmentedEncrypter(new_key)
+        header = encrypter.initialize(compression=decrypter.compression, timestamp_ns=timestamp_ns)
+    else:
+        encrypter = Encrypter(new_key)
+        header = encrypter.initialize(timestamp_ns=timestamp_ns)
+    if version == 2 and not isinstance(decrypter, SegmentedDecrypter):
+        with TemporaryFile() as spool:
+            _rekey(spool, input_stream, decrypter, encrypter, header, buffer_size, buffer_pool)
+            spool.seek(0)
+            _copy(output_stream, spool, buffer_size, buffer_pool)
+    else:
+        _rekey(output_stream, input_stream, decrypter, encrypter, header, buffer_size,
+               buffer_pool)
+    return encrypter
+
+
+def _rekey(output_stream: RawIOBase, input_stream: RawIOBase,
+           decrypter: Union[Decrypter, SegmentedDecrypter],
+           encrypter: Union[Encrypter, SegmentedEncrypter], header: Bytes, buffer_size: int,
+           buffer_pool: Optional[SecureBufferPool]) -> None:
+    with _DecryptingThread(input_stream, decrypter, buffer_size, buffer_pool) as decrypting:
+        write_all(output_stream, header)
+        if isinstance(encrypter, SegmentedEncrypter):
+            _encrypt_segments(output_stream, decrypting.pieces(), encrypter, buffer_pool)
+        else:
+            _encrypt_chunks(output_stream, decrypting.pieces(), encrypter, buffer_size,
+                            buffer_pool)
+
+
+def _copy(output_stream: RawIOBase, input_stream: RawIOBase, buffer_size: int,
+          buffer_pool: Optional[SecureBufferPool]) -> None:
+    buffer = acquire_buffer(buffer_pool, buffer_size)
+    try:
+        with memoryview(buffer) as view:
+            length = len(buffer)
+            while length == len(buffer):
+                length = read_all(buffer, input_stream)
+                write_all(output_stream, view[:length])
+    finally:
+        release_buffer(buffer_pool, buffer)
+
+
+def _encrypt_chunks(output_stream: RawIOBase, pieces: Iterator[memoryview], encrypter: Encrypter,
+                    buffer_size: int, buffer_pool: Optional[SecureBufferPool]) -> None:
+    output_buffer = acquire_buffer(buffer_pool, buffer_size)
+    output_view = memoryview(output_buffer)
+    try:
+        for piece in pieces:
+            # The payload tail released by the final MAC check may exceed the buffer.
+            for offset in range(0, len(piece), buffer_size):
+                chunk = piece[offset:offset + buffer_size]
+                write_all(output_stream,
+                          encrypter.process_chunk(chunk, output_view[:len(chunk)]))
+    finally:
+        output_view.release()
+        release_buffer(buffer_pool, output_buffer)
+    write_all(output_stream, encrypter.finalize())
+
+
+def _encrypt_segments(output_stream: RawIOBase, pieces: Iterator[memoryview],
+                      encrypter: SegmentedEncrypter,
+                      buffer_pool: Optional[SecureBufferPool]) -> None:
+    segment = acquire_buffer(buffer_pool, SEGMENT_PAYLOAD_LENGTH)
+    segment_view = memoryview(segment)
+    output_buffer = acquire_buffer(buffer_pool, SEGMENT_LENGTH)
+    try:
+        index, length = 0, 0
+        for piece in pieces:
+            while piece:
+                # A full segment is known not to be the final one only when more payload follows.
+                if length == SEGMENT_PAYLOAD_LENGTH:
+                    write_all(output_stream,
+                              encrypter.encrypt_segment(index, segment, output_buffer))
+                    index, length = index + 1, 0
+                count = min(len(piece), SEGMENT_PAYLOAD_LENGTH - length)
+                segment_view[length:length + count] = piece[:count]
+                length += count
+                piece = piece[count:]
+        write_all(output_stream, encrypter.finalize(index, segment_view[:length]))
+    finally:
+        segment_view.release()
+        release_buffer(buffer_pool, segment)
+        release_buffer(buffer_pool, output_buffer)
+
+
+class _DecryptingThread:
+    """
+    Decrypts the input on a separate thread into a ring of RING_SIZE buffers, which pieces()
+    yields in order and takes back, zeroed, once the caller asks for the next piece. The end of
+    the pieces is reached only after the final MAC verification. All ring buffers are wiped when
+    the thread is left.
+    """
+
+    _STOP = None
+    _END = object()
+
+    def __init__(self, input_stream: RawIOBase, decrypter: Union[Decrypter, SegmentedDecrypter],
+                 buffer_size: int, buffer_pool: Optional[SecureBufferPool] = None):
+        self._input_stream = input_stream
+        self._decrypter = decrypter
+        self._buffer_pool = buffer_pool
+        if isinstance(decrypter, SegmentedDecrypter):
+            self._input_size, self._output_size = SEGMENT_LENGTH, SEGMENT_PAYLOAD_LENGTH
+        else:
+            self._input_size, self._output_size = buffer_size, buffer_size
+        self._ring = []
+        try:
+            for _ in range(RING_SIZE):
+                self._ring.append(acquire_buffer(buffer_pool, self._output_size))
+        except BaseException:
+            self.clear()
+            raise
+        self._free_outputs = Queue()
+        self._pieces = Queue()
+        for buffer in self._ring:
+            self._free_outputs.put(buffer)
+        self._thread = Thread(target=self._run, name='cipher21-decrypter', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._free_outputs.put(self._STOP)
+        try:
+            # The buffers the thread still holds are settled before they are drained and wiped.
+            self._thread.join(None if exc_type is None else JOIN_TIMEOUT)
+        finally:
+            while not self._pieces.empty():
+                item = self._pieces.get()
+                if isinstance(item, tuple) and item[1] is None:
+                    clear_secret(item[0])
+            self.clear(reuse=not self._thread.is_alive())
+
+    def clear(self, reuse: bool = False) -> None:
+        """Wipes the ring. Buffers go back to the pool for reuse only if no thread can touch them."""
+        for buffer in self._ring:
+            release_buffer(self._buffer_pool, buffer, reuse)
+        self._ring = []
+
+    def pieces(self) -> Iterator[memoryview]:
+        while True:
+            item = self._pieces.get()
+            if item is self._END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            piece, buffer = item
+            try:
+                yield piece
+            finally:
+                if buffer is None:
+                    clear_secret(piece)
+                else:
+                    zero_fill(buffer)
+                    self._free_outputs.put(buffer)
+
+    def _run(self) -> None:
+        input_buffers = []
+        final_buffer = bytearray()
+        try:
+            for _ in range(2):
+                input_buffers.append(acquire_buffer(self._buffer_pool, self._input_size))
+            if isinstance(self._decrypter, SegmentedDecrypter):
+                final_buffer = self._decrypt_segments(*input_buffers)
+            else:
+                final_buffer = self._decrypt_chunks(*input_buffers)
+            if final_buffer is not None:
+                self._pieces.put(self._END)
+        except BaseException as e:
+            clear_secret(final_buffer)
+            self._pieces.put(e)
+        finally:
+            for buffer in input_buffers:
+                release_buffer(self._buffer_pool, buffer)
+
+    def _put(self, length: int, decrypt) -> bool:
+        output_buffer = self._free_outputs.get()
+        if output_buffer is self._STOP:
+            return False
+        decrypt(output_buffer)
+        self._pieces.put((memoryview(output_buffer)[:length], output_buffer))
+        return True
+
+    def _decrypt_chunks(self, prev_buffer: MutableBytes, next_buffer: MutableBytes) \
+            -> Optional[MutableBytes]:
+        decrypter = self._decrypter
+        prev_length = read_all(prev_buffer, self._input_stream)
+        next_length = read_all(next_buffer, self._input_stream)
+        while next_length == len(next_buffer):
+            if not self._put(prev_length,
+                             lambda output: decrypter.process_chunk(prev_buffer, output)):
+                return None
+            prev_buffer, next_buffer = next_buffer, prev_buffer
+            next_length = read_all(next_buffer, self._input_stream)
+        final_buffer = decrypter.finalize(
+            b''.join((prev_buffer[:prev_length], next_buffer[:next_length]))
+        )
+        self._pieces.put((memoryview(final_buffer), None))
+        return final_buffer
+
+    def _decrypt_segments(self, prev_buffer: MutableBytes, next_buffer: MutableBytes) \
+            -> Optional[MutableBytes]:
+        decrypter = self._decrypter
+        index = 0
+        prev_length = read_all(prev_buffer, self._input_stream)
+        next_length = 0
+        if prev_length == len(prev_buffer):
+            next_length = read_all(next_buffer, self._input_stream)
+        while next_length and next_length == len(next_buffer):
+            if not self._put(SEGMENT_PAYLOAD_LENGTH,
+                             lambda output: decrypter.decrypt_segment(index, prev_buffer, output)):
+                return None
+            index += 1
+            prev_buffer, next_buffer = next_buffer, prev_buffer
+            prev_length = next_length
+            next_length = read_all(next_buffer, self._input_stream)
+        # See README.md: the final segment is never shorter than MIN_FINAL_SEGMENT_LENGTH.
+        if next_length >= MIN_FINAL_SEGMENT_LENGTH:
+            if not self._put(SEGMENT_PAYLOAD_LENGTH,
+                             lambda output: decrypter.decrypt_segment(index, prev_buffer, output)):
+                return None
+            index += 1
+            final_segment = bytes(memoryview(next_buffer)[:next_length])
+        else:
+            final_segment = b''.join((prev_buffer[:prev_length], next_buffer[:next_length]))
+        final_buffer = decrypter.finalize(index, final_segment)
+        self._pieces.put((memoryview(final_buffer), None))
+        return final_buffer
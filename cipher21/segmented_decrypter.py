@@ -0,0 +1,90 @@
+from typing import Optional
+
+from .constants import *
+from .backends import new_cipher
+from .decrypter import DecryptingError, check_stream_timestamp
+from .segments import segment_nonce, header_block_nonce
+from .typing import Bytes, MutableBytes
+from .stream_attributes import StreamAttributes
+
+
+def check_uncompressed(attrs: StreamAttributes) -> None:
+    """For the I/O functions which do not decompress the payload."""
+    if attrs.compression:
+        raise ValueError('Compressed streams are decrypted by the blocking, pipelined and mapped '
+                         'I/O functions only.')
+
+
+class SegmentedDecrypter(StreamAttributes):
+    """
+    Decrypts the stream format version 2, where every segment is authenticated independently.
+    Segments may be decrypted in any order and concurrently, see README.md.
+    See Decrypter for after_ns, which is checked against the authenticated header here.
+    The compression attribute is the codec name of the payload recorded in the header or None.
+    The I/O functions which decompress the payload set the uncompressed_length attribute.
+    """
+
+    def __init__(self, key: Bytes, after_ns: Optional[int] = None):
+        super().__init__(key)
+        self.after_ns = after_ns
+
+    def initialize(self, stream_header: Bytes) -> None:
+        self.reset()
+        assert len(stream_header) == STREAM_V2_HEADER_LENGTH, \
+            (len(stream_header), STREAM_V2_HEADER_LENGTH)
+        if not stream_header.startswith(STREAM_V2_SIGNATURE):
+            raise ValueError('Unrecognized Cipher21 header.')
+        self.nonce = bytes(stream_header[NONCE_PREFIX_OFFSET:HEADER_BLOCK_OFFSET])
+        cipher = new_cipher(self.key, header_block_nonce(self.nonce))
+        header_block = cipher.decrypt(
+            stream_header[HEADER_BLOCK_OFFSET:HEADER_BLOCK_OFFSET+HEADER_BLOCK_LENGTH]
+        )
+        try:
+            cipher.verify(stream_header[-MAC_LENGTH:])
+        except ValueError as e:
+            raise DecryptingError('Header MAC check failed') from e
+        self.stream_timestamp_ns = int.from_bytes(header_block[:TIMESTAMP_LENGTH], 'little')
+        codec_id = header_block[COMPRESSION_CODEC_OFFSET]
+        if codec_id >= len(COMPRESSION_CODECS) or any(header_block[COMPRESSION_CODEC_OFFSET+1:]):
+            raise DecryptingError('Unsupported stream options')
+        self.compression = COMPRESSION_CODECS[codec_id]
+        check_stream_timestamp(self, self.after_ns)
+        self.payload_length = 0
+
+    def decrypt_segment(self, index: int, segment: Bytes, output: Optional[MutableBytes] = None) \
+            -> MutableBytes:
+        assert self.nonce
+        assert len(segment) == SEGMENT_LENGTH, (len(segment), SEGMENT_LENGTH)
+        if not output:
+            output = bytearray(SEGMENT_PAYLOAD_LENGTH)
+        output = memoryview(output)[:SEGMENT_PAYLOAD_LENGTH]
+        self._decrypt_and_verify(index, segment, output, False)
+        return output
+
+    def finalize(self, index: int, segment: Bytes, output: Optional[MutableBytes] = None) \
+            -> memoryview:
+        assert self.nonce
+        if len(segment) < MIN_FINAL_SEGMENT_LENGTH:
+            raise ValueError('The final stream segment is too small.')
+        if output:
+            output = memoryview(output)[:len(segment) - MAC_LENGTH]
+        else:
+            output = memoryview(bytearray(len(segment) - MAC_LENGTH))
+        self.mac = bytes(segment[-MAC_LENGTH:])
+        self._decrypt_and_verify(index, segment, output, True)
+        self.padding_length = int.from_bytes(output[-PADDING_LENGTH_LENGTH:], 'little')
+        payload_tail_length = len(output) - PADDING_LENGTH_LENGTH - self.padding_length
+        if payload_tail_length < 0:
+            raise DecryptingError('Invalid padding')
+        self.payload_length = index * SEGMENT_PAYLOAD_LENGTH + payload_tail_length
+        return output[:payload_tail_length]
+
+    def _decrypt_and_verify(self, index: int, segment: Bytes, output: MutableBytes, final: bool) \
+            -> None:
+        cipher = new_cipher(self.key, segment_nonce(self.nonce, index, final))
+        segment = memoryview(segment)
+        cipher.decrypt(segment[:-MAC_LENGTH], output)
+        try:
+            cipher.verify(segment[-MAC_LENGTH:])
+        except ValueError as e:
+            raise DecryptingError('MAC check failed') from e
@@ -0,0 +1,84 @@
+from os import urandom as token_bytes
+from typing import Optional, Tuple
+
+from .constants import *
+from .backends import new_cipher
+from .encrypter import time_ns
+from .segments import segment_nonce, header_block_nonce, final_segment_length
+from .typing import Bytes, MutableBytes
+from .stream_attributes import StreamAttributes
+
+
+class SegmentedEncrypter(StreamAttributes):
+    """
+    Encrypts the stream format version 2, where every segment is authenticated independently.
+    Segments may be encrypted in any order and concurrently, see README.md.
+    """
+
+    @staticmethod
+    def split_payload(payload_length: int) -> Tuple[int, int]:
+        """Returns the number of non-final segments and the final segment payload tail length."""
+        count = max(0, (payload_length - 1) // SEGMENT_PAYLOAD_LENGTH)
+        return count, payload_length - count * SEGMENT_PAYLOAD_LENGTH
+
+    @classmethod
+    def stream_length(cls, payload_length: int) -> int:
+        count, tail_length = cls.split_payload(payload_length)
+        return STREAM_V2_HEADER_LENGTH + count * SEGMENT_LENGTH + final_segment_length(tail_length)
+
+    def initialize(self, nonce_prefix: Optional[Bytes] = None, compression: Optional[str] = None,
+                   timestamp_ns: Optional[int] = None) -> bytearray:
+        """
+        The compression codec name is recorded in the header. The caller compresses the payload.
+        The encryption timestamp is the current time unless given, e.g. kept when re-keying.
+        """
+        self.reset()
+        if compression not in COMPRESSION_CODECS:
+            raise ValueError('Unsupported compression codec `' + str(compression) + '`.')
+        self.nonce = bytes(nonce_prefix) if nonce_prefix else token_bytes(NONCE_PREFIX_LENGTH)
+        if len(self.nonce) != NONCE_PREFIX_LENGTH:
+            raise ValueError('Nonce prefix must be ' + str(NONCE_PREFIX_LENGTH) + ' bytes long.')
+        self.compression = compression
+        self.stream_timestamp_ns = time_ns() if timestamp_ns is None else timestamp_ns
+        header_block = bytearray(HEADER_BLOCK_LENGTH)
+        header_block[:TIMESTAMP_LENGTH] = self.stream_timestamp_ns.to_bytes(TIMESTAMP_LENGTH, 'little')
+        header_block[COMPRESSION_CODEC_OFFSET] = COMPRESSION_CODECS.index(compression)
+        stream_header = bytearray(STREAM_V2_HEADER_LENGTH)
+        stream_header[:HEADER_BLOCK_OFFSET] = STREAM_V2_SIGNATURE + self.nonce
+        cipher = new_cipher(self.key, header_block_nonce(self.nonce))
+        cipher.encrypt(
+            header_block,
+            memoryview(stream_header)[HEADER_BLOCK_OFFSET:HEADER_BLOCK_OFFSET+HEADER_BLOCK_LENGTH]
+        )
+        stream_header[-MAC_LENGTH:] = cipher.digest()
+        self.payload_length = 0
+        return stream_header
+
+    def encrypt_segment(self, index: int, chunk: Bytes, output: Optional[MutableBytes] = None) \
+            -> MutableBytes:
+        assert self.nonce
+        assert len(chunk) == SEGMENT_PAYLOAD_LENGTH, (len(chunk), SEGMENT_PAYLOAD_LENGTH)
+        if not output:
+            output = bytearray(SEGMENT_LENGTH)
+        output = memoryview(output)[:SEGMENT_LENGTH]
+        cipher = new_cipher(self.key, segment_nonce(self.nonce, index))
+        cipher.encrypt(chunk, output[:SEGMENT_PAYLOAD_LENGTH])
+        output[SEGMENT_PAYLOAD_LENGTH:] = cipher.digest()
+        return output
+
+    def finalize(self, index: int, chunk: Bytes) -> bytearray:
+        assert self.nonce
+        length = final_segment_length(len(chunk))
+        self.padding_length = length - len(chunk) - STREAM_FOOTER_LENGTH
+        result = bytearray(length)
+        result[:len(chunk)] = chunk
+        result[len(chunk):-STREAM_FOOTER_LENGTH] = token_bytes(self.padding_length)
+        result[-STREAM_FOOTER_LENGTH:-MAC_LENGTH] \
+            = self.padding_length.to_bytes(PADDING_LENGTH_LENGTH, 'little', signed=False)
+        view = memoryview(result)[:-MAC_LENGTH]
+        cipher = new_cipher(self.key, segment_nonce(self.nonce, index, True))
+        cipher.encrypt(view, view)
+        self.mac = cipher.digest()
+        result[-MAC_LENGTH:] = self.mac
+        self.payload_length = index * SEGMENT_PAYLOAD_LENGTH + len(chunk)
+        return result
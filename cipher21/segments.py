@@ -0,0 +1,44 @@
+from typing import Tuple
+
+from .constants import *
+
+
+__all__ = (
+    'segment_nonce',
+    'header_block_nonce',
+    'final_segment_length',
+    'split_segments',
+)
+
+
+SEGMENT_FLAG = 0x00
+FINAL_SEGMENT_FLAG = 0x01
+HEADER_BLOCK_FLAG = 0x02
+
+
+def segment_nonce(nonce_prefix: bytes, index: int, final: bool = False) -> bytes:
+    assert len(nonce_prefix) == NONCE_PREFIX_LENGTH, (len(nonce_prefix), NONCE_PREFIX_LENGTH)
+    if index >= 256**SEGMENT_INDEX_LENGTH:
+        raise OverflowError('Too many stream segments.')
+    return nonce_prefix + index.to_bytes(SEGMENT_INDEX_LENGTH, 'big') \
+        + bytes((FINAL_SEGMENT_FLAG if final else SEGMENT_FLAG,))
+
+
+def header_block_nonce(nonce_prefix: bytes) -> bytes:
+    assert len(nonce_prefix) == NONCE_PREFIX_LENGTH, (len(nonce_prefix), NONCE_PREFIX_LENGTH)
+    return nonce_prefix + SEGMENT_INDEX_LENGTH*b'\x00' + bytes((HEADER_BLOCK_FLAG,))
+
+
+def final_segment_length(payload_tail_length: int) -> int:
+    # See README.md
+    assert 0 <= payload_tail_length <= SEGMENT_PAYLOAD_LENGTH, payload_tail_length
+    length = max(MIN_FINAL_SEGMENT_LENGTH, payload_tail_length + STREAM_FOOTER_LENGTH)
+    return length + (-STREAM_V2_HEADER_LENGTH - length) % STREAM_LENGTH_MULTIPLICAND
+
+
+def split_segments(body_length: int) -> Tuple[int, int]:
+    """Returns the number of non-final segments and the final segment length of a stream body."""
+    if body_length < MIN_FINAL_SEGMENT_LENGTH:
+        raise ValueError('Not enough data.')
+    count, remainder = divmod(body_length - MIN_FINAL_SEGMENT_LENGTH, SEGMENT_LENGTH)
+    return count, MIN_FINAL_SEGMENT_LENGTH + remainder
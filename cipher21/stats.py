@@ -0,0 +1,170 @@
+import sys
+import time
+import logging
+from io import IOBase, RawIOBase
+from typing import Optional
+
+from .stream_attributes import StreamAttributes
+
+
+__all__ = (
+    'IoCounters',
+    'ProcessingStats',
+    'peak_rss',
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class IoCounters:
+    """Totals of the calls made on a stream, updated by a single thread."""
+
+    __slots__ = ('bytes', 'calls', 'stalls', 'seconds')
+
+    def __init__(self):
+        self.bytes = 0
+        self.calls = 0
+        # Calls on a non-blocking stream which returned None, so read_all()/write_all() waited.
+        self.stalls = 0
+        self.seconds = 0.0
+
+
+class ProcessingStats:
+    """
+    Collects counters of a single stream processing through wrapped input and output streams.
+    Every call costs two clock reads, so the counters may stay enabled in production.
+    The wrappers are unseekable, so regular files are processed through them instead of being
+    memory mapped, see mapped_io.is_mappable().
+    """
+
+    def __init__(self, progress_interval: Optional[float] = None):
+        self.start_time = time.perf_counter()
+        self.input = IoCounters()
+        self.output = IoCounters()
+        self.progress_interval = progress_interval
+        self.next_progress_time = self.start_time + (progress_interval or 0)
+
+    def wrap_input(self, stream: IOBase) -> '_CountingReader':
+        return _CountingReader(stream, self.input, self)
+
+    def wrap_output(self, stream: IOBase) -> '_CountingWriter':
+        return _CountingWriter(stream, self.output, self)
+
+    def log_progress(self, now: float) -> None:
+        self.next_progress_time = now + self.progress_interval
+        elapsed = now - self.start_time
+        logger.info('progress: {:,} B read, {:,} B written, {:.1f} MB/s'.format(
+            self.input.bytes, self.output.bytes, self.input.bytes / elapsed / 1e6 if elapsed else 0
+        ))
+
+    def report(self, attrs: StreamAttributes, operation: str, mapped: bool = False,
+               input_length: Optional[int] = None, output_length: Optional[int] = None) -> dict:
+        """
+        Returns the counters as a JSON object. Mapped files are counted with the given lengths.
+        The crypto time is the processing time not spent in I/O calls, so it includes the
+        overhead of the loops, and with --pipeline the I/O overlaps with it.
+        """
+        processing_time = time.perf_counter() - self.start_time
+        io_time = self.input.seconds + self.output.seconds
+        return {
+            'operation': operation,
+            'mapped': mapped,
+            'bytes_in': self.input.bytes if input_length is None else input_length,
+            'bytes_out': self.output.bytes if output_length is None else output_length,
+            'payload_length': attrs.payload_length,
+            'padding_length': attrs.padding_length,
+            'processing_time': processing_time,
+            'read_time': self.input.seconds,
+            'write_time': self.output.seconds,
+            'crypto_time': max(0.0, processing_time - io_time),
+            'read_calls': self.input.calls,
+            'write_calls': self.output.calls,
+            'read_stalls': self.input.stalls,
+            'write_stalls': self.output.stalls,
+            'peak_rss': peak_rss(),
+            'throughput': attrs.payload_length / processing_time / 1e6
+            if attrs.payload_length and processing_time else None,
+        }
+
+
+def peak_rss() -> Optional[int]:
+    """Returns the peak resident set size of the process in bytes, if it is available."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 2**10
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 2**10
+
+
+class _Counting(RawIOBase):
+
+    def __init__(self, stream: IOBase, counters: IoCounters, stats: ProcessingStats):
+        super().__init__()
+        self.stream = stream
+        self.counters = counters
+        self.stats = stats
+
+    def __getattr__(self, name: str):
+        # Exposes e.g. finish() of a drop-behind stream.
+        if name == 'stream':
+            raise AttributeError(name)
+        return getattr(self.stream, name)
+
+    def fileno(self) -> int:
+        return self.stream.fileno()
+
+    def seekable(self) -> bool:
+        return False
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        return self.stream.truncate(size)
+
+    def _count(self, length: Optional[int], start_time: float) -> None:
+        now = time.perf_counter()
+        counters = self.counters
+        counters.calls += 1
+        counters.seconds += now - start_time
+        if length is None:
+            counters.stalls += 1
+        else:
+            counters.bytes += length
+        if self.stats.progress_interval and now >= self.stats.next_progress_time:
+            self.stats.log_progress(now)
+
+
+class _CountingReader(_Counting):
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> Optional[int]:
+        start_time = time.perf_counter()
+        length = self.stream.readinto(buffer)
+        self._count(length, start_time)
+        return length
+
+
+class _CountingWriter(_Counting):
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> Optional[int]:
+        start_time = time.perf_counter()
+        length = self.stream.write(b)
+        self._count(length, start_time)
+        return length
+
+    def flush(self) -> None:
+        if not self.stream.closed:
+            self.stream.flush()
@@ -11,6 +11,8 @@ class StreamAttributes:
         self.payload_length = None
         self.padding_length = None
         self.mac = None
+        self.compression = None
+        self.uncompressed_length = None
 
     def reset(self):
         self.cipher = None
@@ -19,3 +21,5 @@ class StreamAttributes:
         self.payload_length = None
         self.padding_length = None
         self.mac = None
+        self.compression = None
+        self.uncompressed_length = None
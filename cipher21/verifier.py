@@ -0,0 +1,285 @@
+import os
+import stat
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import IOBase, RawIOBase
+from typing import Optional, Tuple, Union
+
+from Crypto.Cipher import ChaCha20
+from Crypto.Hash import Poly1305
+
+from .constants import *
+from .decrypter import Decrypter, DecryptingError, check_stream_timestamp
+from .segmented_decrypter import SegmentedDecrypter
+from .segments import segment_nonce, split_segments
+from .buffer_pool import SecureBufferPool, acquire_buffer, release_buffer
+from .blocking_io import BUFFER_SIZE, check_buffer_size, read_all, create_decrypter
+from .bytes_utils import clear_secret
+from .typing import Bytes
+
+
+__all__ = (
+    'Verifier',
+    'SegmentedVerifier',
+    'verify_stream',
+    'verify_file',
+    'is_mappable',
+)
+
+
+CHACHA20_BLOCK_LENGTH = 64
+POLY1305_KEY_LENGTH = 32
+
+
+class Verifier(Decrypter):
+    """
+    Authenticates the stream format version 1 without decrypting the payload. Poly1305 covers
+    the ciphertext, so only the one-time Poly1305 key, the timestamp and the padding length
+    are taken from the keystream. The attributes and the errors are the ones of Decrypter,
+    yet process_chunk() and finalize() return no payload.
+    """
+
+    def initialize(self, stream_header: Bytes) -> None:
+        assert not self.cipher
+        self.reset()
+        assert len(stream_header) == STREAM_HEADER_LENGTH, (len(stream_header), STREAM_HEADER_LENGTH)
+        if not stream_header.startswith(STREAM_SIGNATURE):
+            raise ValueError('Unrecognized Cipher21 header.')
+        self.nonce = bytes(stream_header[NONCE_OFFSET:NONCE_OFFSET+NONCE_LENGTH])
+        self.cipher, self._authenticator = _start_authentication(self.key, self.nonce)
+        encrypted_timestamp_ns = stream_header[TIMESTAMP_OFFSET:TIMESTAMP_OFFSET+TIMESTAMP_LENGTH]
+        self._authenticator.update(encrypted_timestamp_ns)
+        self._ciphertext_length = TIMESTAMP_LENGTH
+        self.stream_timestamp_ns = int.from_bytes(
+            _decrypt_at(self.cipher, 0, encrypted_timestamp_ns), 'little'
+        )
+        check_stream_timestamp(self, self.after_ns)
+        self.payload_length = 0
+
+    def process_chunk(self, chunk: Bytes, output=None) -> bytes:
+        assert self.cipher
+        self._authenticator.update(chunk)
+        self._ciphertext_length += len(chunk)
+        self.payload_length += len(chunk)
+        return b''
+
+    def finalize(self, chunk: Bytes, output=None) -> bytes:
+        assert self.cipher
+        assert len(chunk) >= STREAM_FOOTER_LENGTH, (len(chunk), STREAM_FOOTER_LENGTH)
+        chunk = memoryview(chunk)
+        self._authenticator.update(chunk[:-MAC_LENGTH])
+        self._ciphertext_length += len(chunk) - MAC_LENGTH
+        self.mac = bytes(chunk[-MAC_LENGTH:])
+        _finish_authentication(self._authenticator, self._ciphertext_length, self.mac)
+        self.padding_length = int.from_bytes(_decrypt_at(
+            self.cipher, self._ciphertext_length - PADDING_LENGTH_LENGTH,
+            chunk[-STREAM_FOOTER_LENGTH:-MAC_LENGTH]
+        ), 'little')
+        if self.padding_length >= STREAM_LENGTH_MULTIPLICAND:
+            raise DecryptingError('Invalid padding')
+        payload_tail_length = len(chunk) - MAC_LENGTH - PADDING_LENGTH_LENGTH - self.padding_length
+        if payload_tail_length < 0:
+            raise ValueError('The final stream chunk is too small to properly cut off the padding.')
+        self.payload_length += payload_tail_length
+        return b''
+
+
+class SegmentedVerifier(SegmentedDecrypter):
+    """
+    Authenticates the stream format version 2 without decrypting the payload, see Verifier.
+    Only the header block and the padding length of the final segment are decrypted.
+    """
+
+    def verify_segment(self, index: int, segment: Bytes) -> None:
+        assert self.nonce
+        assert len(segment) == SEGMENT_LENGTH, (len(segment), SEGMENT_LENGTH)
+        self._authenticate(index, segment, False)
+
+    def finalize(self, index: int, segment: Bytes, output=None) -> bytes:
+        assert self.nonce
+        if len(segment) < MIN_FINAL_SEGMENT_LENGTH:
+            raise ValueError('The final stream segment is too small.')
+        segment = memoryview(segment)
+        self.mac = bytes(segment[-MAC_LENGTH:])
+        cipher = self._authenticate(index, segment, True)
+        ciphertext_length = len(segment) - MAC_LENGTH
+        self.padding_length = int.from_bytes(_decrypt_at(
+            cipher, ciphertext_length - PADDING_LENGTH_LENGTH,
+            segment[ciphertext_length-PADDING_LENGTH_LENGTH:ciphertext_length]
+        ), 'little')
+        payload_tail_length = ciphertext_length - PADDING_LENGTH_LENGTH - self.padding_length
+        if payload_tail_length < 0:
+            raise DecryptingError('Invalid padding')
+        self.payload_length = index * SEGMENT_PAYLOAD_LENGTH + payload_tail_length
+        return b''
+
+    def _authenticate(self, index: int, segment: Bytes, final: bool) -> ChaCha20.ChaCha20Cipher:
+        cipher, authenticator = _start_authentication(
+            self.key, segment_nonce(self.nonce, index, final)
+        )
+        segment = memoryview(segment)
+        authenticator.update(segment[:-MAC_LENGTH])
+        _finish_authentication(authenticator, len(segment) - MAC_LENGTH, segment[-MAC_LENGTH:])
+        return cipher
+
+
+def verify_stream(input_stream: RawIOBase, key: bytes, buffer_size: int = BUFFER_SIZE,
+                  workers: Optional[int] = None, buffer_pool: Optional[SecureBufferPool] = None,
+                  after_ns: Optional[int] = None) -> Union[Verifier, SegmentedVerifier]:
+    """
+    Verifies a stream of any version with the same results as decryption into a NullStream,
+    but neither decrypting nor buffering the payload. Version 2 segments are verified on
+    workers threads.
+    """
+    check_buffer_size(buffer_size)
+    verifier = create_decrypter(input_stream, key, after_ns, (Verifier, SegmentedVerifier))
+    if isinstance(verifier, SegmentedVerifier):
+        return _verify_segmented_stream(input_stream, verifier, workers, buffer_pool)
+    prev_buffer = acquire_buffer(buffer_pool, buffer_size)
+    next_buffer = acquire_buffer(buffer_pool, buffer_size)
+    try:
+        prev_length = read_all(prev_buffer, input_stream)
+        next_length = read_all(next_buffer, input_stream)
+        while next_length == len(next_buffer):
+            verifier.process_chunk(prev_buffer)
+            prev_buffer, next_buffer = next_buffer, prev_buffer
+            next_length = read_all(next_buffer, input_stream)
+        verifier.finalize(b''.join((prev_buffer[:prev_length], next_buffer[:next_length])))
+    finally:
+        for buffer in (prev_buffer, next_buffer):
+            release_buffer(buffer_pool, buffer)
+    return verifier
+
+
+def verify_file(input_file: IOBase, key: bytes, workers: Optional[int] = None,
+                after_ns: Optional[int] = None) -> Union[Verifier, SegmentedVerifier]:
+    """Verifies a memory mapped regular file, see verify_stream()."""
+    from .mapped_io import _map
+    with _map(input_file, False) as input_view:
+        if input_view[:STREAM_SIGNATURE_LENGTH] == STREAM_V2_SIGNATURE:
+            verifier, header_length = SegmentedVerifier(key, after_ns), STREAM_V2_HEADER_LENGTH
+        else:
+            verifier, header_length = Verifier(key, after_ns), STREAM_HEADER_LENGTH
+        if len(input_view) < header_length + STREAM_FOOTER_LENGTH:
+            raise ValueError('Not enough data.')
+        verifier.initialize(bytes(input_view[:header_length]))
+        with input_view[header_length:] as body:
+            if isinstance(verifier, Verifier):
+                verifier.finalize(body)
+                return verifier
+            count, _ = split_segments(len(body))
+            with ThreadPoolExecutor(workers or os.cpu_count() or 1) as executor:
+                for _ in executor.map(
+                    lambda index: verifier.verify_segment(
+                        index, body[index*SEGMENT_LENGTH:(index+1)*SEGMENT_LENGTH]
+                    ),
+                    range(count)
+                ):
+                    pass
+            verifier.finalize(count, body[count*SEGMENT_LENGTH:])
+    return verifier
+
+
+def is_mappable(input_file: IOBase) -> bool:
+    """
+    Tells whether verify_file() accepts the input, i.e. whether it is a regular file not wrapped
+    into an unseekable stream observing every call, see mapped_io.is_mappable().
+    """
+    try:
+        return input_file.seekable() and stat.S_ISREG(os.fstat(input_file.fileno()).st_mode)
+    except (OSError, ValueError, AttributeError):
+        return False
+
+
+def _verify_segmented_stream(input_stream: RawIOBase, verifier: SegmentedVerifier,
+                             workers: Optional[int], buffer_pool: Optional[SecureBufferPool]) \
+        -> SegmentedVerifier:
+    workers = workers or os.cpu_count() or 1
+    buffers = []
+    free_buffers = []
+    pending = deque()
+
+    def acquire() -> bytearray:
+        if free_buffers:
+            return free_buffers.pop()
+        buffers.append(acquire_buffer(buffer_pool, SEGMENT_LENGTH))
+        return buffers[-1]
+
+    def submit(index: int, segment: bytearray) -> None:
+        pending.append((executor.submit(verifier.verify_segment, index, segment), segment))
+        while len(pending) > 2 * workers:
+            wait_oldest()
+
+    def wait_oldest() -> None:
+        future, segment = pending[0]
+        future.result()
+        pending.popleft()
+        free_buffers.append(segment)
+
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            try:
+                index = 0
+                prev_buffer = acquire()
+                prev_length = read_all(prev_buffer, input_stream)
+                next_buffer, next_length = bytearray(), 0
+                if prev_length == len(prev_buffer):
+                    next_buffer = acquire()
+                    next_length = read_all(next_buffer, input_stream)
+                while next_length and next_length == len(next_buffer):
+                    submit(index, prev_buffer)
+                    index += 1
+                    prev_buffer, prev_length = next_buffer, next_length
+                    next_buffer = acquire()
+                    next_length = read_all(next_buffer, input_stream)
+                # See README.md: the final segment is never shorter than MIN_FINAL_SEGMENT_LENGTH.
+                if next_length >= MIN_FINAL_SEGMENT_LENGTH:
+                    submit(index, prev_buffer)
+                    index += 1
+                    final_segment = memoryview(next_buffer)[:next_length]
+                else:
+                    final_segment = b''.join((prev_buffer[:prev_length], next_buffer[:next_length]))
+                while pending:
+                    wait_oldest()
+                verifier.finalize(index, final_segment)
+            finally:
+                for future, _ in pending:
+                    future.cancel()
+    finally:
+        for buffer in buffers:
+            release_buffer(buffer_pool, buffer)
+    return verifier
+
+
+def _start_authentication(key: bytes, nonce: bytes) \
+        -> Tuple[ChaCha20.ChaCha20Cipher, Poly1305.Poly1305_MAC]:
+    # As in RFC 8439, the one-time Poly1305 key is the first keystream block,
+    # and the ciphertext is encrypted starting from the second one.
+    cipher = ChaCha20.new(key=key, nonce=nonce)
+    one_time_key = bytearray(POLY1305_KEY_LENGTH)
+    try:
+        cipher.encrypt(bytes(POLY1305_KEY_LENGTH), output=one_time_key)
+        with memoryview(one_time_key) as view:
+            authenticator = Poly1305.Poly1305_MAC(view[:16], view[16:], b'')
+    finally:
+        clear_secret(one_time_key)
+    return cipher, authenticator
+
+
+def _finish_authentication(authenticator: Poly1305.Poly1305_MAC, ciphertext_length: int,
+                           mac: Bytes) -> None:
+    # There is no associated data, so it is the ciphertext padding and both lengths only.
+    if ciphertext_length % 16:
+        authenticator.update(bytes(16 - ciphertext_length % 16))
+    authenticator.update(struct.pack('<QQ', 0, ciphertext_length))
+    try:
+        authenticator.verify(bytes(mac))
+    except ValueError as e:
+        raise DecryptingError('MAC check failed') from e
+
+
+def _decrypt_at(cipher: ChaCha20.ChaCha20Cipher, offset: int, ciphertext: Bytes) -> bytes:
+    # The keystream is XORed either way, and the cipher has already been used to encrypt.
+    cipher.seek(CHACHA20_BLOCK_LENGTH + offset)
+    return cipher.encrypt(ciphertext)
@@ -0,0 +1,151 @@
+import asyncio
+import socket
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+
+from cipher21 import aio, blocking_io
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+
+
+class AioTest(TestCase):
+
+    TEST_SIZES = (0, 1, 2*M - STREAM_METADATA_LENGTH, 5*M + 3, SEGMENT_PAYLOAD_LENGTH + 1)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x6E5D4C3B2A190817F6E5D4C3B2A19081, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def _run(self, coroutine_function, data: bytes, **kwargs):
+        """Runs the coroutine between a fed StreamReader and a socket backed StreamWriter."""
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            output_socket, input_socket = socket.socketpair()
+            _, writer = await asyncio.open_connection(sock=output_socket)
+            peer_reader, peer_writer = await asyncio.open_connection(sock=input_socket)
+            received = asyncio.ensure_future(peer_reader.read())
+            try:
+                attrs = await coroutine_function(reader, writer, self.key, **kwargs)
+            finally:
+                writer.close()
+            result = await received
+            peer_writer.close()
+            return attrs, result
+        return self.loop.run_until_complete(run())
+
+    def test_round_trip(self):
+        for size in self.TEST_SIZES:
+            plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+            for version in (1, 2):
+                for offload_size in (None, M):
+                    with self.subTest(size=size, version=version, offload_size=offload_size):
+                        encrypter, encrypted = self._run(
+                            aio.encrypt_stream, plain, version=version, offload_size=offload_size
+                        )
+                        self.assertEqual(0, len(encrypted) % STREAM_LENGTH_MULTIPLICAND)
+                        decrypted = BytesIO()
+                        blocking_io.decrypt_stream(decrypted, BytesIO(encrypted), self.key)
+                        self.assertEqual(plain, decrypted.getvalue())
+                        decrypter, decrypted = self._run(
+                            aio.decrypt_stream, encrypted, offload_size=offload_size
+                        )
+                        self.assertEqual(plain, decrypted)
+                        self.assertEqual(encrypter.stream_timestamp_ns,
+                                         decrypter.stream_timestamp_ns)
+                        self.assertEqual(size, decrypter.payload_length)
+                        self.assertEqual(encrypter.mac, decrypter.mac)
+
+    def test_tampered(self):
+        encrypted = BytesIO()
+        blocking_io.encrypt_stream(encrypted, BytesIO(4*M*b'a'), self.key)
+        tampered = bytearray(encrypted.getvalue())
+        tampered[2*M] ^= 0x01
+        with self.assertRaises(DecryptingError):
+            self._run(aio.decrypt_stream, bytes(tampered))
+
+    def test_plaintext_wiped(self):
+        plain = 5*M*b'p' + 3*b'q'
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = BytesIO()
+                blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=version)
+                wiped = []
+                with patch('cipher21.aio.clear_secret', lambda chunk: wiped.append(bytes(chunk))):
+                    _, decrypted = self._run(aio.decrypt_stream, encrypted.getvalue(),
+                                             buffer_size=M)
+                self.assertEqual(plain, decrypted)
+                self.assertEqual(plain, b''.join(wiped))
+
+    def test_plaintext_wiped_when_stalled(self):
+        plain = 3*SEGMENT_PAYLOAD_LENGTH*b'p'
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = BytesIO()
+                blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=version)
+                written, wiped = [], []
+
+                async def run():
+                    reader = asyncio.StreamReader()
+                    reader.feed_data(encrypted.getvalue())
+                    reader.feed_eof()
+                    output_socket, input_socket = socket.socketpair()
+                    _, writer = await asyncio.open_connection(sock=output_socket)
+                    write = writer.write
+                    writer.write = lambda data: (written.append(len(data)), write(data))
+                    try:
+                        # The peer never reads, so the decryption stalls on chunks not sent yet.
+                        await asyncio.wait_for(aio.decrypt_stream(reader, writer, self.key,
+                                                                  buffer_size=M), 0.5)
+                    finally:
+                        writer.transport.abort()
+                        input_socket.close()
+
+                with patch('cipher21.aio.clear_secret', lambda chunk: wiped.append(len(chunk))):
+                    with self.assertRaises(asyncio.TimeoutError):
+                        self.loop.run_until_complete(run())
+                self.assertLess(0, len(wiped))
+                self.assertEqual(sum(written), sum(wiped))
+
+    def test_plaintext_sent_before_wiped(self):
+        plain = 3*SEGMENT_PAYLOAD_LENGTH*b'p' + 3*b'q'
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = BytesIO()
+                blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=version)
+                wiped = []
+
+                async def run():
+                    reader = asyncio.StreamReader()
+                    reader.feed_data(encrypted.getvalue())
+                    reader.feed_eof()
+                    output_socket, input_socket = socket.socketpair()
+                    output_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, M)
+                    _, writer = await asyncio.open_connection(sock=output_socket)
+                    peer_reader, peer_writer = await asyncio.open_connection(sock=input_socket)
+
+                    async def receive():
+                        # The peer starts late, so the final chunks wait in the transport buffer.
+                        await asyncio.sleep(0.2)
+                        return await peer_reader.read()
+
+                    received = asyncio.ensure_future(receive())
+                    try:
+                        await aio.decrypt_stream(reader, writer, self.key, buffer_size=M)
+                        self.assertEqual(0, writer.transport.get_write_buffer_size())
+                    finally:
+                        writer.close()
+                    result = await received
+                    peer_writer.close()
+                    return result
+
+                with patch('cipher21.aio.clear_secret', lambda chunk: wiped.append(bytes(chunk))):
+                    decrypted = self.loop.run_until_complete(run())
+                self.assertEqual(plain, decrypted)
+                self.assertEqual(plain, b''.join(wiped))
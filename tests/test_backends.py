@@ -0,0 +1,156 @@
+from unittest import TestCase, skipUnless
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryDirectory
+import argparse
+import json
+import os
+
+from cipher21 import backends, blocking_io
+from cipher21.backends import BACKENDS, DEFAULT_BACKEND, AUTO_BACKEND, set_backend, \
+    get_backend, choose_fastest
+from cipher21.encrypter import Encrypter
+from cipher21.segmented_encrypter import SegmentedEncrypter
+from cipher21.oneshot import encrypt_bytes, decrypt_bytes
+from cipher21.arguments_parser import ArgumentsParser
+from cipher21.decrypter import DecryptingError
+from cipher21.constants import *
+
+
+class BackendsTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, 100, M - STREAM_METADATA_LENGTH, M, 3*M + 5, S - 1, S + 1)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x4D8B2F6A1C9E3705BD1F48A2C6E0935D, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def tearDown(self) -> None:
+        set_backend(DEFAULT_BACKEND)
+
+    def random_bytes(self, length: int) -> bytes:
+        return self.prng.getrandbits(8 * length).to_bytes(length, 'little')
+
+    def encrypt(self, plain: bytes, version: int) -> bytes:
+        # Fixed nonce, timestamp and padding make the stream a function of the payload only.
+        if version == 2:
+            encrypter = SegmentedEncrypter(self.key)
+            header = encrypter.initialize(nonce_prefix=bytes(NONCE_PREFIX_LENGTH), timestamp_ns=1)
+            segments = [plain[i:i+self.S] for i in range(0, len(plain), self.S)] or [b'']
+            if len(segments[-1]) == self.S:
+                segments.append(b'')
+            body = [encrypter.encrypt_segment(i, s) for i, s in enumerate(segments[:-1])]
+            body.append(encrypter.finalize(len(segments) - 1, segments[-1]))
+        else:
+            encrypter = Encrypter(self.key)
+            header = encrypter.initialize(nonce=bytes(NONCE_LENGTH), timestamp_ns=1)
+            body = [encrypter.process_chunk(plain), encrypter.finalize()]
+        return bytes(header) + b''.join(bytes(b) for b in body)
+
+    @skipUnless(len(BACKENDS) > 1, 'A single backend is available.')
+    def test_identical_streams(self):
+        with patch('cipher21.encrypter.token_bytes', bytes), \
+                patch('cipher21.segmented_encrypter.token_bytes', bytes):
+            for version in (1, 2):
+                for size in self.TEST_SIZES:
+                    plain = self.random_bytes(size)
+                    streams = {}
+                    for name in sorted(BACKENDS):
+                        set_backend(name)
+                        streams[name] = self.encrypt(plain, version)
+                    with self.subTest(version=version, size=size):
+                        self.assertEqual(1, len(set(streams.values())))
+                        for name in sorted(BACKENDS):
+                            set_backend(name)
+                            output = BytesIO()
+                            blocking_io.decrypt_stream(output, BytesIO(streams[DEFAULT_BACKEND]),
+                                                       self.key)
+                            self.assertEqual(plain, output.getvalue())
+
+    @skipUnless(len(BACKENDS) > 1, 'A single backend is available.')
+    def test_chunked_ciphers(self):
+        for _ in range(20):
+            plain = self.random_bytes(self.prng.randrange(1000))
+            nonce = self.random_bytes(24)
+            results = []
+            for backend in BACKENDS.values():
+                cipher = backend.new(self.key, nonce)
+                ciphertext, offset = bytearray(), 0
+                while offset < len(plain):
+                    length = self.prng.randrange(1, 150)
+                    output = bytearray(len(plain[offset:offset+length]))
+                    cipher.encrypt(plain[offset:offset+length], output)
+                    ciphertext += output
+                    offset += length
+                results.append((bytes(ciphertext), cipher.digest()))
+                decrypting = backend.new(self.key, nonce)
+                self.assertEqual(plain, decrypting.decrypt(bytes(ciphertext)))
+                decrypting.verify(results[-1][1])
+            self.assertEqual(1, len(set(results)))
+
+    def test_tampered_streams(self):
+        for name in sorted(BACKENDS):
+            with self.subTest(backend=name):
+                set_backend(name)
+                blob = bytearray(encrypt_bytes(b'abc', self.key))
+                self.assertEqual(b'abc', decrypt_bytes(blob, self.key))
+                blob[-1] ^= 1
+                with self.assertRaises(DecryptingError):
+                    blocking_io.decrypt_stream(BytesIO(), BytesIO(blob), self.key)
+                cipher = get_backend().new(self.key, bytes(24))
+                cipher.decrypt(b'abc')
+                with self.assertRaises(ValueError):
+                    cipher.verify(bytes(MAC_LENGTH))
+
+    def test_set_backend(self):
+        self.assertEqual(DEFAULT_BACKEND, get_backend().name)
+        with self.assertRaises(ValueError):
+            set_backend('none')
+        self.assertEqual(DEFAULT_BACKEND, get_backend().name)
+        with TemporaryDirectory() as directory:
+            with patch.dict(os.environ, {'XDG_CACHE_HOME': directory}):
+                self.assertIn(set_backend(AUTO_BACKEND).name, BACKENDS)
+                self.assertTrue(os.path.isfile(os.path.join(directory, 'cipher21',
+                                                            'backend.json')))
+
+    def test_choose_fastest(self):
+        with TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, 'backend.json')
+            fastest = choose_fastest(cache_path)
+            self.assertIn(fastest, BACKENDS)
+            with open(cache_path) as f:
+                cache = json.load(f)
+            self.assertEqual(fastest, cache['fastest'])
+            self.assertEqual(sorted(BACKENDS), sorted(cache['seconds']))
+            # The cached result is reused while the fingerprint matches.
+            cache['fastest'] = DEFAULT_BACKEND
+            with open(cache_path, 'w') as f:
+                json.dump(cache, f)
+            with patch.object(backends, 'measure_backend') as measure_backend:
+                self.assertEqual(DEFAULT_BACKEND, choose_fastest(cache_path))
+                measure_backend.assert_not_called()
+            cache['fingerprint']['python'] = 'other'
+            with open(cache_path, 'w') as f:
+                json.dump(cache, f)
+            with patch.object(backends, 'measure_backend', return_value=1.0) as measure_backend:
+                self.assertIn(choose_fastest(cache_path), BACKENDS)
+                self.assertEqual(len(BACKENDS), measure_backend.call_count)
+
+    def test_arguments(self):
+        parser = ArgumentsParser()
+        with patch.dict(os.environ, {'CIPHER21_KEY': self.key.hex()}):
+            for name in sorted(BACKENDS) + [AUTO_BACKEND]:
+                with self.subTest(backend=name):
+                    parsed_args = parser.parse(('-e', '-k', 'env:CIPHER21_KEY', '--backend', name))
+                    self.assertEqual(name, parsed_args.backend)
+                    parsed_args.key.clear()
+            for args in (
+                ('-e', '-k', 'env:CIPHER21_KEY', '--backend', 'none'),
+                ('-e', '--via', 'localhost:2121', '--backend', DEFAULT_BACKEND),
+            ):
+                with self.subTest(args=args):
+                    with self.assertRaises(argparse.ArgumentError):
+                        parser.parse(args)
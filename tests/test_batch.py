@@ -0,0 +1,137 @@
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from copy import copy
+import subprocess
+import sys
+import os
+
+from cipher21.batch import list_batch_files, process_file, process_files
+from cipher21.operation_mode import OperationMode
+from cipher21.bytes_utils import clear_secret
+from cipher21.constants import *
+
+
+class BatchTest(TestCase):
+
+    PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+    TEST_SIZES = (0, 1, 3*M + 5, SEGMENT_LENGTH + 7)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x93A1C2E47B6D58F0112233445566778F, version=2)
+        self.key = bytearray(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        self.directory = TemporaryDirectory()
+        self.plains = {}
+        for i, size in enumerate(self.TEST_SIZES):
+            path = os.path.join(self.directory.name, 'file{}.log'.format(i))
+            self.plains[path] = bytes(self.prng.getrandbits(8) for _ in range(size))
+            with open(path, 'wb') as f:
+                f.write(self.plains[path])
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        for version in (1, 2):
+            with self.subTest(version=version):
+                paths = list_batch_files(self.directory.name, OperationMode.ENCRYPTION)
+                self.assertEqual(sorted(self.plains), paths)
+                results = list(process_files(
+                    paths, self.key, OperationMode.ENCRYPTION, version, processes=2
+                ))
+                self.assertEqual([None] * len(paths), [r.error for r in results])
+                self.assertEqual([p + '.c21' for p in paths], [r.output_path for r in results])
+                for path in paths:
+                    os.unlink(path)
+                encrypted_paths = list_batch_files(self.directory.name, OperationMode.DECRYPTION)
+                self.assertEqual([p + '.c21' for p in paths], encrypted_paths)
+                for mode in (OperationMode.VERIFICATION, OperationMode.DECRYPTION):
+                    results = list(process_files(encrypted_paths, self.key, mode, processes=2))
+                    self.assertEqual([None] * len(paths), [r.error for r in results])
+                    self.assertEqual([len(self.plains[p]) for p in paths],
+                                     [r.payload_length for r in results])
+                for path, plain in self.plains.items():
+                    with open(path, 'rb') as f:
+                        self.assertEqual(plain, f.read())
+                    os.unlink(path + '.c21')
+
+    def test_worker_keys_wiped(self):
+        log_path = os.path.join(self.directory.name, 'wiped.bin')
+
+        def logging_clear_secret(secret):
+            # The forked workers inherit the patch, and append to the log as they exit.
+            with open(log_path, 'ab') as f:
+                f.write(bytes(secret))
+            clear_secret(secret)
+
+        old_key = bytearray(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        paths = sorted(self.plains)
+        with patch('cipher21.batch.clear_secret', logging_clear_secret):
+            results = list(process_files(paths, self.key, OperationMode.ENCRYPTION, 2,
+                                         processes=2))
+            self.assertEqual([None] * len(paths), [r.error for r in results])
+            with open(log_path, 'rb') as f:
+                self.assertEqual(bytes(self.key) * 2, f.read())
+            os.unlink(log_path)
+            results = list(process_files([p + '.c21' for p in paths], self.key,
+                                         OperationMode.REKEYING, 2, processes=1, old_key=old_key))
+            with open(log_path, 'rb') as f:
+                self.assertEqual(bytes(self.key) + bytes(old_key), f.read())
+        # The parent keeps its copies.
+        self.assertNotEqual(bytes(KEY_LENGTH), bytes(self.key))
+
+    def test_errors(self):
+        path = sorted(self.plains)[-1]
+        self.assertIsNone(process_file(path, self.key, OperationMode.ENCRYPTION).error)
+        with open(path + '.c21', 'r+b') as f:
+            f.seek(3*M)
+            f.write(b'\x00\x01')
+        os.unlink(path)
+        result = process_file(path + '.c21', self.key, OperationMode.DECRYPTION)
+        self.assertEqual('MAC check failed', result.error)
+        expected_names = [os.path.basename(p) for p in sorted(self.plains)[:-1]]
+        expected_names.append(os.path.basename(path) + '.c21')
+        self.assertEqual(expected_names, sorted(os.listdir(self.directory.name)))
+        result = process_file(sorted(self.plains)[0], self.key, OperationMode.DECRYPTION)
+        self.assertIn('.c21', result.error)
+        result = process_file(os.path.join(self.directory.name, 'missing.c21'), self.key,
+                              OperationMode.VERIFICATION)
+        self.assertIsNotNone(result.error)
+
+    def test_manifest(self):
+        paths = sorted(self.plains)
+        manifest = BytesIO(b'\0'.join(os.fsencode(p) for p in paths) + b'\0')
+        self.assertEqual(paths, list_batch_files('-', OperationMode.ENCRYPTION, manifest, True))
+        manifest = BytesIO(b'\n'.join(os.fsencode(p) for p in paths))
+        self.assertEqual(paths, list_batch_files('-', OperationMode.ENCRYPTION, manifest))
+        pattern = os.path.join(self.directory.name, 'file[13].log')
+        self.assertEqual([paths[1], paths[3]],
+                         list_batch_files(pattern, OperationMode.ENCRYPTION))
+
+    def test_application(self):
+        env = copy(os.environ)
+        env.update(KEY=self.key.hex())
+        result = subprocess.run(
+            (sys.executable, '-m', 'cipher21.application', '-e', '-k', 'env:KEY',
+             '--batch', self.directory.name, '-j', '2'),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=self.PROJECT_DIR
+        )
+        self.assertEqual(0, result.returncode, result.stderr)
+        lines = result.stdout.decode().splitlines()
+        self.assertEqual(len(self.plains) + 1, len(lines))
+        for line, path in zip(lines[1:], sorted(self.plains)):
+            columns = line.split('\t')
+            self.assertEqual(path, columns[0])
+            self.assertEqual('{:,} B'.format(len(self.plains[path])), columns[3])
+            self.assertEqual('', columns[5])
+        result = subprocess.run(
+            (sys.executable, '-m', 'cipher21.application', '-v', '-k', 'env:KEY',
+             '--batch', '-', '-0'),
+            input=os.fsencode(sorted(self.plains)[0]) + b'\0', stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE, env=env, cwd=self.PROJECT_DIR
+        )
+        self.assertEqual(1, result.returncode, result.stderr)
+        self.assertIn(b'Processing of 1 files failed.', result.stderr)
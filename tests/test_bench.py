@@ -0,0 +1,63 @@
+from unittest import TestCase
+from tempfile import TemporaryDirectory
+from contextlib import redirect_stdout
+from io import StringIO
+import json
+import os
+
+from cipher21 import bench
+
+
+class BenchTest(TestCase):
+
+    def setUp(self) -> None:
+        self.directory = TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def run_bench(self, *args: str) -> int:
+        with redirect_stdout(StringIO()):
+            return bench.main(args)
+
+    def test_parse_size(self):
+        self.assertEqual([0, 1, 2**10, 3*2**20, 2**31], bench.parse_sizes('0,1,1K,3M,2G'))
+        for text in ('', '1T', '-1', '1.5M'):
+            with self.subTest(text=text):
+                with self.assertRaises(Exception):
+                    bench.parse_size(text)
+
+    def test_run_and_compare(self):
+        path = os.path.join(self.directory.name, 'baseline.json')
+        self.assertEqual(0, self.run_bench(
+            '--sizes', '0,64K', '--buffer-sizes', '32K', '--stream-versions', '1,2', '--no-cli',
+            '--min-time', '0.01', '--quiet', '-o', path
+        ))
+        with open(path) as f:
+            document = json.load(f)
+        results = document['results']
+        streams = [r for r in results if r['mode'] == 'in-process']
+        self.assertEqual(2 * 2 * 4, len(streams))
+        self.assertTrue(all(r['throughput'] > 0 for r in streams if r['size']))
+        self.assertTrue(all(r['peak_tracemalloc'] > 0 for r in streams))
+        self.assertIn('Cipher21Key.from_hexes', {r['name'] for r in results})
+        messages = [r for r in results if r['mode'] == 'message']
+        self.assertEqual(2 * 2 * len(bench.MESSAGE_SIZES), len(messages))
+        self.assertIn('decrypt_bytes', {r['name'] for r in messages})
+        self.assertEqual(0, self.run_bench('compare', path, path))
+        slower = os.path.join(self.directory.name, 'slower.json')
+        results[-1]['seconds'] *= 1.5
+        with open(slower, 'w') as f:
+            json.dump(document, f)
+        self.assertEqual(1, self.run_bench('compare', path, slower))
+        self.assertEqual(0, self.run_bench('compare', path, slower, '--tolerance', '0.6'))
+
+    def test_compare_memory(self):
+        baseline = [bench.Result('encrypt', 'cli', 2**20, 1.0, 2**15, 1, 20 * 2**20)]
+        current = [bench.Result('encrypt', 'cli', 2**20, 0.5, 2**15, 1, 30 * 2**20),
+                   bench.Result('encrypt', 'cli', 2**20, 0.5, 2**15, 2, 30 * 2**20)]
+        comparison = bench.compare_results(baseline, current)
+        self.assertEqual(1, len(comparison))
+        self.assertEqual(['peak_rss'], comparison[0][2])
+        current[0]['peak_rss'] = 21 * 2**20
+        self.assertEqual([], bench.compare_results(baseline, current)[0][2])
@@ -0,0 +1,175 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+from threading import Thread, Event
+from time import monotonic, sleep
+from unittest import mock
+import os
+
+from cipher21 import blocking_io, pipelined_io
+from cipher21.buffer_tuning import choose_buffer_size
+from cipher21.constants import *
+
+
+class BufferSizeTest(TestCase):
+
+    BUFFER_SIZES = (M, 2*M, 3*M, 8*M)
+    TEST_SIZES = (0, M - STREAM_METADATA_LENGTH, M - STREAM_METADATA_LENGTH + 1,
+                  3*M - STREAM_METADATA_LENGTH, 3*M, 8*M - STREAM_HEADER_LENGTH, 25*M + 7)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x0F1E2D3C4B5A69788796A5B4C3D2E1F0, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def test_round_trip(self):
+        for size in self.TEST_SIZES:
+            plain = bytes(self.prng.getrandbits(8) for _ in range(size))
+            for module in (blocking_io, pipelined_io):
+                for buffer_size in self.BUFFER_SIZES:
+                    with self.subTest(size=size, module=module.__name__, buffer_size=buffer_size):
+                        encrypted = BytesIO()
+                        module.encrypt_stream(encrypted, BytesIO(plain), self.key, buffer_size)
+                        decrypted = BytesIO()
+                        encrypted.seek(0)
+                        module.decrypt_stream(decrypted, encrypted, self.key, buffer_size)
+                        self.assertEqual(plain, decrypted.getvalue())
+
+    def test_invalid_size(self):
+        for size in (0, -M, M - 1, M + 1, 3*M // 2):
+            with self.subTest(size=size):
+                with self.assertRaises(ValueError):
+                    blocking_io.encrypt_stream(BytesIO(), BytesIO(), self.key, size)
+
+    def test_auto_size(self):
+        self.assertEqual(blocking_io.BUFFER_SIZE, choose_buffer_size(BytesIO()))
+        r, w = os.pipe()
+        with open(r, 'rb') as reader, open(w, 'wb') as writer:
+            size = choose_buffer_size(reader, writer)
+        self.assertGreaterEqual(size, blocking_io.BUFFER_SIZE)
+        self.assertEqual(0, size % M)
+        with open(__file__, 'rb') as f:
+            size = choose_buffer_size(f)
+        self.assertGreaterEqual(size, blocking_io.BUFFER_SIZE)
+        self.assertEqual(0, size % M)
+
+
+class NonBlockingPipeTest(TestCase):
+
+    ROUNDS = 8
+    PIECE_SIZE = 4096
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x5A4B3C2D1E0F9988776655443322110F, version=2)
+
+    def test_read_latency(self):
+        latency = self._measure_read_rounds()
+        with self._sleep_polling():
+            polling_latency = self._measure_read_rounds()
+        self.assertLess(latency, blocking_io.SLEEP_INTERVAL / 2)
+        self.assertLess(latency, polling_latency / 2)
+
+    def test_write_latency(self):
+        latency = self._measure_write_rounds()
+        with self._sleep_polling():
+            polling_latency = self._measure_write_rounds()
+        self.assertLess(latency, blocking_io.SLEEP_INTERVAL / 2)
+        self.assertLess(latency, polling_latency / 2)
+
+    def test_without_fileno(self):
+        class Stalling(BytesIO):
+            stalled = False
+
+            def fileno(self):
+                raise OSError('No file descriptor.')
+
+            def readinto(self, b):
+                if not self.stalled:
+                    self.stalled = True
+                    return None
+                return super().readinto(b)
+
+        buffer = bytearray(8)
+        self.assertEqual(3, blocking_io.read_all(buffer, Stalling(b'abc')))
+        self.assertEqual(b'abc', buffer[:3])
+
+    def _measure_read_rounds(self) -> float:
+        """Returns the median time between a write and the read_all() return in ping-pong rounds."""
+        pieces = [bytes(self.prng.getrandbits(8) for _ in range(self.PIECE_SIZE))
+                  for _ in range(self.ROUNDS)]
+        r, w = os.pipe()
+        os.set_blocking(r, False)
+        written_at = []
+        received = Event()
+
+        def produce():
+            for piece in pieces:
+                sleep(0.002)
+                written_at.append(monotonic())
+                os.write(w, piece)
+                received.wait()
+                received.clear()
+
+        latencies = []
+        with open(r, 'rb', buffering=0) as reader:
+            producer = Thread(target=produce)
+            producer.start()
+            try:
+                for piece in pieces:
+                    buffer = bytearray(self.PIECE_SIZE)
+                    self.assertEqual(self.PIECE_SIZE, blocking_io.read_all(buffer, reader))
+                    latencies.append(monotonic() - written_at[-1])
+                    self.assertEqual(piece, buffer)
+                    received.set()
+            finally:
+                producer.join()
+                os.close(w)
+        return sorted(latencies)[len(latencies) // 2]
+
+    def _measure_write_rounds(self) -> float:
+        """Returns the median time between a read from a full pipe and the write_all() return."""
+        pieces = [bytes(self.prng.getrandbits(8) for _ in range(self.PIECE_SIZE))
+                  for _ in range(self.ROUNDS)]
+        r, w = os.pipe()
+        os.set_blocking(w, False)
+        filling = 0
+        try:
+            while True:
+                filling += os.write(w, bytes(self.PIECE_SIZE))
+        except BlockingIOError:
+            pass
+        read_at = []
+        written = Event()
+
+        def consume():
+            for _ in pieces:
+                sleep(0.002)
+                read_at.append(monotonic())
+                os.read(r, self.PIECE_SIZE)
+                written.wait()
+                written.clear()
+
+        latencies = []
+        with open(w, 'wb', buffering=0) as writer:
+            consumer = Thread(target=consume)
+            consumer.start()
+            try:
+                for piece in pieces:
+                    blocking_io.write_all(writer, piece)
+                    latencies.append(monotonic() - read_at[-1])
+                    written.set()
+            finally:
+                consumer.join()
+        try:
+            received = b''.join(iter(lambda: os.read(r, M), b''))
+        finally:
+            os.close(r)
+        self.assertEqual(filling, len(received))
+        self.assertEqual(b''.join(pieces), received[-self.ROUNDS*self.PIECE_SIZE:])
+        return sorted(latencies)[len(latencies) // 2]
+
+    @staticmethod
+    def _sleep_polling():
+        return mock.patch.object(blocking_io, 'wait_until_ready',
+                                 lambda f, events: sleep(blocking_io.SLEEP_INTERVAL))
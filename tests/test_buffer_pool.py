@@ -0,0 +1,105 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+from threading import Thread
+import mmap
+
+from cipher21 import blocking_io, pipelined_io
+from cipher21.buffer_pool import SecureBufferPool
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+
+
+class SecureBufferPoolTest(TestCase):
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x2B7E151628AED2A6ABF7158809CF4F3C, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def test_reuse(self):
+        with SecureBufferPool() as pool:
+            buffer = pool.acquire(M + 1)
+            self.assertEqual(M + 1, len(buffer))
+            self.assertFalse(any(buffer))
+            buffer[:] = b'\xA5' * len(buffer)
+            pool.release(buffer)
+            with self.assertRaises(ValueError):
+                buffer[0] = 0  # Released views cannot be used anymore.
+            self.assertEqual(-(-(M + 1) // mmap.PAGESIZE) * mmap.PAGESIZE, pool.idle_size)
+            reused = pool.acquire(M + 1)
+            self.assertEqual(0, pool.idle_size)
+            self.assertNotIn(b'\xA5' * 16, reused.tobytes())
+            pool.release(reused)
+        self.assertEqual(0, pool.idle_size)
+        self.assertEqual(0, pool.locked_size)
+
+    def test_eviction(self):
+        with SecureBufferPool(max_size=3*mmap.PAGESIZE) as pool:
+            buffers = [pool.acquire(mmap.PAGESIZE) for _ in range(5)]
+            for buffer in buffers:
+                pool.release(buffer)
+            self.assertEqual(3*mmap.PAGESIZE, pool.idle_size)
+            big = pool.acquire(4*mmap.PAGESIZE)
+            pool.release(big)
+            self.assertEqual(3*mmap.PAGESIZE, pool.idle_size)
+
+    def test_lock_limit(self):
+        with SecureBufferPool(lock=False) as pool:
+            pool.release(pool.acquire(M))
+            self.assertEqual(0, pool.locked_size)
+        with SecureBufferPool() as pool:
+            pool.lock_limit = mmap.PAGESIZE
+            buffers = [pool.acquire(mmap.PAGESIZE) for _ in range(3)]
+            self.assertLessEqual(pool.locked_size, mmap.PAGESIZE)
+            for buffer in buffers:
+                pool.release(buffer)
+
+    def test_foreign_buffer(self):
+        with SecureBufferPool() as pool:
+            with self.assertRaises(ValueError):
+                pool.release(memoryview(bytearray(M)))
+            with self.assertRaises(ValueError):
+                pool.acquire(0)
+
+    def test_shared_by_streams(self):
+        plains = [bytes(self.prng.getrandbits(8) for _ in range(size))
+                  for size in (0, 1, 3*M + 5, 2*SEGMENT_LENGTH + 7)]
+        errors = []
+
+        def round_trip(module, plain, version):
+            try:
+                encrypted = BytesIO()
+                module.encrypt_stream(encrypted, BytesIO(plain), self.key, version=version,
+                                      workers=2, buffer_pool=pool)
+                encrypted.seek(0)
+                decrypted = BytesIO()
+                module.decrypt_stream(decrypted, encrypted, self.key, workers=2, buffer_pool=pool)
+                self.assertEqual(plain, decrypted.getvalue())
+            except BaseException as e:
+                errors.append(e)
+
+        with SecureBufferPool() as pool:
+            threads = [Thread(target=round_trip, args=(module, plain, version))
+                       for module in (blocking_io, pipelined_io)
+                       for plain in plains for version in (1, 2)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual([], errors)
+            self.assertEqual({}, pool._active)
+            self.assertGreater(pool.idle_size, 0)
+
+    def test_released_on_error(self):
+        encrypted = BytesIO()
+        blocking_io.encrypt_stream(encrypted, BytesIO(5*M*b'\x5A'), self.key)
+        tampered = bytearray(encrypted.getvalue())
+        tampered[2*M] ^= 0x01
+        with SecureBufferPool() as pool:
+            for module in (blocking_io, pipelined_io):
+                with self.subTest(module=module.__name__):
+                    with self.assertRaises(DecryptingError):
+                        module.decrypt_stream(BytesIO(), BytesIO(tampered), self.key,
+                                              buffer_pool=pool)
+                    self.assertEqual({}, pool._active)
@@ -0,0 +1,128 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+import tarfile
+
+from cipher21 import blocking_io
+from cipher21.buffered_io import Cipher21Writer, Cipher21Reader
+from cipher21.buffer_pool import SecureBufferPool
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+
+
+class BufferedIoTest(TestCase):
+
+    TEST_SIZES = (0, 1, M - STREAM_METADATA_LENGTH, M - STREAM_METADATA_LENGTH + 1, 5*M + 3,
+                  SEGMENT_PAYLOAD_LENGTH, SEGMENT_PAYLOAD_LENGTH + 1, 2*SEGMENT_LENGTH + 12345)
+    WRITE_SIZES = (333, 3*M + 1, SEGMENT_LENGTH + 1)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x6C1B0E5A72D943F8A0B1C2D3E4F50617, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def test_compatibility(self):
+        for size in self.TEST_SIZES:
+            plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+            for version in (1, 2):
+                write_size = self.prng.choice(self.WRITE_SIZES)
+                with self.subTest(size=size, version=version, write_size=write_size):
+                    encrypted = BytesIO()
+                    with Cipher21Writer(encrypted, self.key, version=version) as writer:
+                        for i in range(0, size, write_size):
+                            self.assertEqual(len(plain[i:i+write_size]),
+                                             writer.write(plain[i:i+write_size]))
+                    self.assertFalse(encrypted.closed)
+                    self.assertEqual(size, writer.encrypter.payload_length)
+                    decrypted = BytesIO()
+                    encrypted.seek(0)
+                    decrypter = blocking_io.decrypt_stream(decrypted, encrypted, self.key)
+                    self.assertEqual(plain, decrypted.getvalue())
+                    self.assertEqual(writer.encrypter.mac, decrypter.mac)
+                    encrypted.seek(0)
+                    with Cipher21Reader(encrypted, self.key) as reader:
+                        self.assertEqual(plain, reader.read())
+                        self.assertEqual(b'', reader.read(1))
+                    self.assertEqual(writer.encrypter.mac, reader.decrypter.mac)
+
+    def test_read_sizes(self):
+        plain = self.prng.getrandbits(8 * 3*SEGMENT_LENGTH).to_bytes(3*SEGMENT_LENGTH, 'little')
+        for version in (1, 2):
+            encrypted = BytesIO()
+            blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=version)
+            for read_size in (333, M, SEGMENT_PAYLOAD_LENGTH + 1):
+                with self.subTest(version=version, read_size=read_size):
+                    reader = Cipher21Reader(BytesIO(encrypted.getvalue()), self.key)
+                    buffer = bytearray(read_size)
+                    chunks = []
+                    length = reader.readinto(buffer)
+                    while length:
+                        self.assertTrue(length == read_size or len(plain) - len(chunks) * read_size
+                                        == length)
+                        chunks.append(bytes(buffer[:length]))
+                        length = reader.readinto(buffer)
+                    self.assertEqual(plain, b''.join(chunks))
+
+    def test_tarfile(self):
+        encrypted = BytesIO()
+        members = {'a.txt': b'alpha' * 1000, 'b.bin': bytes(range(256)) * 5000}
+        with Cipher21Writer(encrypted, self.key, version=2) as writer:
+            with tarfile.open(fileobj=writer, mode='w|') as archive:
+                for name, data in members.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    archive.addfile(info, BytesIO(data))
+        encrypted.seek(0)
+        with Cipher21Reader(encrypted, self.key) as reader:
+            with tarfile.open(fileobj=reader, mode='r|') as archive:
+                for info in archive:
+                    self.assertEqual(members[info.name], archive.extractfile(info).read())
+
+    def test_tampered(self):
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = BytesIO()
+                with Cipher21Writer(encrypted, self.key, version=version) as writer:
+                    writer.write(b'\xA5' * 5*M)
+                tampered = bytearray(encrypted.getvalue())
+                tampered[-MAC_LENGTH - 1] ^= 0x01
+                with self.assertRaises(DecryptingError):
+                    Cipher21Reader(BytesIO(tampered), self.key).read()
+
+    def test_abort(self):
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = BytesIO()
+                with self.assertRaises(RuntimeError):
+                    with Cipher21Writer(encrypted, self.key, version=version) as writer:
+                        writer.write(b'\x5A' * 5*M)
+                        raise RuntimeError()
+                self.assertTrue(writer.closed)
+                with self.assertRaises(ValueError):
+                    writer.write(b'x')
+                with self.assertRaises((ValueError, AssertionError)):
+                    blocking_io.decrypt_stream(BytesIO(), BytesIO(encrypted.getvalue()), self.key)
+
+    def test_caller_buffers(self):
+        plain = self.prng.getrandbits(8 * 3*SEGMENT_LENGTH).to_bytes(3*SEGMENT_LENGTH, 'little')
+        with SecureBufferPool() as pool:
+            for version, size in ((1, 4*M), (2, SEGMENT_LENGTH + 2*M)):
+                with self.subTest(version=version):
+                    buffer = pool.acquire(size)
+                    encrypted = BytesIO()
+                    with Cipher21Writer(encrypted, self.key, version=version,
+                                        buffer=buffer) as writer:
+                        writer.write(plain)
+                    encrypted.seek(0)
+                    with Cipher21Reader(encrypted, self.key, buffer=buffer) as reader:
+                        self.assertEqual(plain, reader.read())
+                    pool.release(buffer)
+        with self.assertRaises(ValueError):
+            Cipher21Writer(BytesIO(), self.key, buffer=bytearray(M + 1))
+        with self.assertRaises(ValueError):
+            Cipher21Writer(BytesIO(), self.key, version=2, buffer=bytearray(SEGMENT_LENGTH - 1))
+        encrypted = BytesIO()
+        blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=2)
+        encrypted.seek(0)
+        with self.assertRaises(ValueError):
+            Cipher21Reader(encrypted, self.key, buffer=bytearray(4*M)).read()
@@ -65,3 +65,25 @@ class BytesUtilsTest(TestCase):
         b = bytearray(2**12)
         clear_secret(b)
         self.assertEqual(256, count_unique_bytes(b))
+
+    def test_zero_fill(self):
+        b = bytearray(b'secret' * 100)
+        zero_fill(memoryview(b)[6:])
+        self.assertEqual(b'secret' + bytes(594), b)
+        zero_fill(bytearray())
+
+    def test_buffer_types(self):
+        hexes = b'0123456789abcdef' * 5
+        expected = bytearray.fromhex(hexes.decode())
+        self.assertEqual(expected, unhexlify(hexes))
+        self.assertEqual(expected, unhexlify(bytearray(hexes)))
+        self.assertEqual(expected, unhexlify(memoryview(b'  ' + hexes)[2:]))
+        self.assertEqual(bytearray((0xAB,)), unhexlify(b'a_b', ignored_bytes=b'_'))
+        self.assertEqual(bytearray((0xAB,)), unhexlify(b'a_b', ignored_bytes=range(0x5F, 0x60)))
+        self.assertEqual(16, count_unique_bytes(memoryview(hexes)))
+        self.assertEqual(differentiate_bytes(hexes), differentiate_bytes(memoryview(hexes)))
+        b = bytearray(b'x' * 2**12)
+        clear_secret(memoryview(b)[1024:3072])
+        self.assertEqual(b'x' * 1024, b[:1024])
+        self.assertEqual(b'x' * 1024, b[3072:])
+        self.assertGreater(count_unique_bytes(b[1024:3072]), 200)
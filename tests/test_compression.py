@@ -0,0 +1,156 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryFile
+from unittest.mock import patch
+import argparse
+import subprocess
+import sys
+import os
+import zlib
+
+from cipher21 import blocking_io, pipelined_io, mapped_io, iter_io
+from cipher21.compression import parse_compression, CompressingReader, DecompressingWriter, \
+    CODECS
+from cipher21.arguments_parser import ArgumentsParser
+from cipher21.random_access import decrypt_range
+from cipher21.verifier import verify_stream
+from cipher21.constants import *
+
+
+class CompressionTest(TestCase):
+
+    PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, M, 2*S + 12345)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x9E3C5A7B1D2F40618293A4B5C6D7E8F9, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        words = [self.prng.getrandbits(8 * 6).to_bytes(6, 'little') for _ in range(50)]
+        self.text = b' '.join(self.prng.choice(words) for _ in range(2 * 10**6 // 7))
+
+    def test_parse_compression(self):
+        self.assertEqual(('zlib', None), parse_compression('zlib'))
+        self.assertEqual(('bz2', 9), parse_compression('bz2:9'))
+        self.assertEqual(('lzma', 0), parse_compression('lzma:0'))
+        for text in ('', 'gzip', 'zlib:', 'zlib:10', 'bz2:0', 'lzma:-1', 'lzma:x'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    parse_compression(text)
+
+    def test_round_trip(self):
+        for compression in ('zlib', 'zlib:1', 'bz2:1', 'lzma:0'):
+            for size in self.TEST_SIZES + (len(self.text),):
+                plain = self.text[:size]
+                for module in (blocking_io, pipelined_io):
+                    with self.subTest(compression=compression, size=size, module=module.__name__):
+                        stream = BytesIO()
+                        encrypter = module.encrypt_stream(stream, BytesIO(plain), self.key,
+                                                          version=2, workers=2,
+                                                          compression=compression)
+                        self.assertEqual(compression.partition(':')[0], encrypter.compression)
+                        if size == len(self.text):
+                            self.assertLess(len(stream.getvalue()), size // 2)
+                        output = BytesIO()
+                        decrypter = module.decrypt_stream(output, BytesIO(stream.getvalue()),
+                                                          self.key)
+                        self.assertEqual(plain, output.getvalue())
+                        self.assertEqual(encrypter.compression, decrypter.compression)
+                        self.assertEqual(len(plain), encrypter.uncompressed_length)
+                        self.assertEqual(len(plain), decrypter.uncompressed_length)
+                        self.assertLess(decrypter.payload_length, max(len(plain), 100))
+                        self.assertEqual(encrypter.mac, decrypter.mac)
+                with self.subTest(compression=compression, size=size, module='mapped_io'), \
+                        TemporaryFile() as input_file, TemporaryFile() as output_file:
+                    input_file.write(stream.getvalue())
+                    input_file.flush()
+                    mapped_io.decrypt_file(output_file, input_file, self.key)
+                    output_file.seek(0)
+                    self.assertEqual(plain, output_file.read())
+
+    def test_uncompressed_header(self):
+        stream = BytesIO()
+        blocking_io.encrypt_stream(stream, BytesIO(b'abc'), self.key, version=2)
+        self.assertIsNone(verify_stream(BytesIO(stream.getvalue()), self.key).compression)
+        with self.assertRaises(ValueError):
+            blocking_io.encrypt_stream(BytesIO(), BytesIO(b'abc'), self.key, compression='zlib')
+
+    def test_unsupported_readers(self):
+        stream = BytesIO()
+        blocking_io.encrypt_stream(stream, BytesIO(self.text[:M]), self.key, version=2,
+                                   compression='zlib')
+        with self.assertRaises(ValueError):
+            list(iter_io.decrypt_iter([stream.getvalue()], self.key))
+        with TemporaryFile() as f:
+            f.write(stream.getvalue())
+            f.flush()
+            with self.assertRaises(ValueError):
+                decrypt_range(BytesIO(), f, self.key, 0, 10)
+
+    def test_compressing_reader(self):
+        block_length = CODECS['zlib'].block_length
+        plain = (self.text * 2)[:3*block_length + 5]
+        with CompressingReader(BytesIO(plain), 'zlib:9', workers=2) as reader:
+            compressed = reader.read()
+            self.assertEqual(len(plain), reader.input_length)
+        members = []
+        while compressed:
+            decompressor = zlib.decompressobj()
+            members.append(decompressor.decompress(compressed))
+            self.assertTrue(decompressor.eof)
+            compressed = decompressor.unused_data
+        self.assertEqual(4, len(members))
+        self.assertEqual(plain, b''.join(members))
+
+    def test_decompressing_writer(self):
+        compressed = zlib.compress(self.text) + zlib.compress(b'') + zlib.compress(b'tail')
+        output = BytesIO()
+        writer = DecompressingWriter(output, 'zlib')
+        for offset in range(0, len(compressed), 1000):
+            writer.write(memoryview(compressed)[offset:offset + 1000])
+        writer.finish()
+        self.assertEqual(self.text + b'tail', output.getvalue())
+        self.assertEqual(len(output.getvalue()), writer.output_length)
+        writer = DecompressingWriter(BytesIO(), 'zlib')
+        writer.write(compressed[:len(compressed) // 2])
+        with self.assertRaises(ValueError):
+            writer.finish()
+        for codec in CODECS:
+            with self.subTest(codec=codec):
+                with self.assertRaises(ValueError):
+                    DecompressingWriter(BytesIO(), codec).write(b'not compressed at all')
+
+    def test_arguments(self):
+        parser = ArgumentsParser()
+        with patch.dict(os.environ, CIPHER21_TEST_KEY=self.key.hex()):
+            parsed_args = parser.parse(('-e', '--compress', 'lzma:6', '-k',
+                                        'env:CIPHER21_TEST_KEY'))
+            self.assertEqual(2, parsed_args.stream_version)
+            self.assertEqual('lzma:6', parsed_args.compress)
+            parsed_args.key.clear()
+            for args in (('-e', '--compress', 'xz'), ('-e', '--compress', 'zlib:12'),
+                         ('-d', '--compress', 'zlib'),
+                         ('-e', '--compress', 'zlib', '--stream-version', '1')):
+                with self.subTest(args=args):
+                    with self.assertRaises(argparse.ArgumentError):
+                        parser.parse(args + ('-k', 'env:CIPHER21_TEST_KEY'))
+
+    def test_logged_lengths(self):
+        env = dict(os.environ, KEY=self.key.hex())
+        command = (sys.executable, '-m', 'cipher21.application', '-k', 'env:KEY')
+        plain = self.text[:M]
+        encrypted = subprocess.run(command + ('-e', '--compress', 'zlib'), input=plain,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                   cwd=self.PROJECT_DIR, check=True)
+        decrypted = subprocess.run(command + ('-d',), input=encrypted.stdout,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                                   cwd=self.PROJECT_DIR, check=True)
+        self.assertEqual(plain, decrypted.stdout)
+        compressed_length = verify_stream(BytesIO(encrypted.stdout), self.key).payload_length
+        self.assertLess(compressed_length, M)
+        for log in (encrypted.stderr, decrypted.stderr):
+            self.assertIn('compressed payload length: {:,} B'.format(compressed_length).encode(),
+                          log)
+            self.assertIn('uncompressed length: {:,} B'.format(M).encode(), log)
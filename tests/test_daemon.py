@@ -0,0 +1,218 @@
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from tempfile import TemporaryDirectory
+from threading import Thread
+import subprocess
+import signal
+import socket
+import time
+import sys
+import os
+
+from cipher21 import daemon as daemon_module
+from cipher21.daemon import Daemon, send_request
+from cipher21.key import KeyStore
+from cipher21.constants import *
+
+
+class DaemonTest(TestCase):
+
+    PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+    TEST_SIZES = (0, 1, 3*M + 5, SEGMENT_LENGTH + 7)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x5D0E3A9C71B24F86A0C1E2D3F4051627, version=2)
+        self.key = bytearray(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        self.directory = TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, 'cipher21.sock')
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def start_daemon(self, workers: int = 2, key_store: KeyStore = None) -> Daemon:
+        daemon = Daemon(self.socket_path, self.key, workers, key_store)
+        thread = Thread(target=daemon.serve, args=(False,))
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(daemon.stop)
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+        return daemon
+
+    def process(self, mode: str, data: bytes, version: int = 1, **request) -> (dict, bytes):
+        input_path = os.path.join(self.directory.name, 'input')
+        output_path = os.path.join(self.directory.name, 'output')
+        with open(input_path, 'wb') as f:
+            f.write(data)
+        with open(input_path, 'rb') as input_file, open(output_path, 'w+b') as output_file:
+            fds = [input_file.fileno()] if mode == 'verification' \
+                else [input_file.fileno(), output_file.fileno()]
+            response = send_request(self.socket_path, {
+                'mode': mode, 'version': version, 'after_ns': 0, 'buffer_size': 2*M,
+                'no_cache': False, **request
+            }, fds)
+            output_file.seek(0)
+            return response, output_file.read()
+
+    def test_round_trip(self):
+        self.start_daemon()
+        for version in (1, 2):
+            for size in self.TEST_SIZES:
+                with self.subTest(version=version, size=size):
+                    plain = bytes(self.prng.getrandbits(8) for _ in range(size))
+                    response, cipher = self.process('encryption', plain, version)
+                    self.assertTrue(response['ok'], response)
+                    self.assertEqual(size, response['payload_length'])
+                    response, _ = self.process('verification', cipher)
+                    self.assertTrue(response['ok'], response)
+                    response, decrypted = self.process('decryption', cipher)
+                    self.assertTrue(response['ok'], response)
+                    self.assertEqual(plain, decrypted)
+
+    def test_pipes(self):
+        self.start_daemon()
+        plain = bytes(self.prng.getrandbits(8) for _ in range(5*M + 3))
+        input_reader, input_writer = os.pipe()
+        output_reader, output_writer = os.pipe()
+        writer = Thread(target=lambda: (os.write(input_writer, plain), os.close(input_writer)))
+        writer.start()
+        chunks = []
+        reader = Thread(target=lambda: chunks.extend(iter(lambda: os.read(output_reader, M), b'')))
+        reader.start()
+        try:
+            response = send_request(self.socket_path, {'mode': 'encryption'},
+                                    [input_reader, output_writer])
+        finally:
+            os.close(input_reader)
+            os.close(output_writer)
+            writer.join()
+            reader.join()
+            os.close(output_reader)
+        self.assertTrue(response['ok'], response)
+        _, decrypted = self.process('decryption', b''.join(chunks))
+        self.assertEqual(plain, decrypted)
+
+    def test_concurrent_clients(self):
+        self.start_daemon(workers=3)
+        plains = [bytes(self.prng.getrandbits(8) for _ in range(2*M + i)) for i in range(6)]
+        sources, sinks = [], []
+        for i, plain in enumerate(plains):
+            path = os.path.join(self.directory.name, 'plain{}'.format(i))
+            with open(path, 'wb') as f:
+                f.write(plain)
+            sources.append(open(path, 'rb'))
+            sinks.append(open(path + '.c21', 'w+b'))
+            self.addCleanup(sources[-1].close)
+            self.addCleanup(sinks[-1].close)
+        responses = [None] * len(plains)
+
+        def encrypt(i):
+            responses[i] = send_request(self.socket_path, {'mode': 'encryption'},
+                                        [sources[i].fileno(), sinks[i].fileno()])
+
+        threads = [Thread(target=encrypt, args=(i,)) for i in range(len(plains))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([True] * len(plains), [r['ok'] for r in responses])
+        for plain, sink in zip(plains, sinks):
+            sink.seek(0)
+            _, decrypted = self.process('decryption', sink.read())
+            self.assertEqual(plain, decrypted)
+
+    def test_stats_and_errors(self):
+        daemon = self.start_daemon()
+        plain = bytes(self.prng.getrandbits(8) for _ in range(3*M))
+        _, cipher = self.process('encryption', plain)
+        tampered = bytearray(cipher)
+        tampered[STREAM_HEADER_LENGTH + 5] ^= 1
+        response, _ = self.process('decryption', bytes(tampered))
+        self.assertEqual({'ok': False, 'error': 'MAC check failed'}, response)
+        response = send_request(self.socket_path, {'mode': 'decryption'})
+        self.assertFalse(response['ok'])
+        self.assertIn('file descriptors', response['error'])
+        stats = send_request(self.socket_path, {'mode': 'stats'})
+        self.assertEqual((3, 2, 0), (stats['requests'], stats['failed'], stats['active']))
+        self.assertEqual(3, stats['latency']['samples'])
+        self.assertLessEqual(stats['latency']['p50'], stats['latency']['max'])
+        del stats['uptime']
+        self.assertEqual(stats, {k: v for k, v in daemon.stats().items() if k != 'uptime'})
+        with self.assertRaises(ValueError):
+            Daemon(self.socket_path, self.key).serve(False)
+
+    def test_silent_client(self):
+        with patch.object(daemon_module, 'REQUEST_TIMEOUT', 0.5):
+            self.start_daemon()
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as silent, \
+                    socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as partial:
+                silent.connect(self.socket_path)
+                partial.connect(self.socket_path)
+                partial.sendall(b'{"mode": ')
+                start_time = time.monotonic()
+                self.assertEqual(0, send_request(self.socket_path, {'mode': 'stats'})['requests'])
+                response, _ = self.process('encryption', b'abc')
+                self.assertTrue(response['ok'], response)
+                self.assertLess(time.monotonic() - start_time, 0.5)
+                # Both connections are dropped after the timeout.
+                silent.settimeout(5)
+                partial.settimeout(5)
+                self.assertEqual(b'', silent.recv(1))
+                self.assertEqual(b'', partial.recv(1))
+
+    def test_key_names(self):
+        key_directory = os.path.join(self.directory.name, 'keys')
+        os.mkdir(key_directory)
+        keys = {}
+        for name in ('tenant1', 'tenant2'):
+            keys[name] = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+            with open(os.path.join(key_directory, name), 'w') as f:
+                f.write(keys[name].hex())
+        with KeyStore(key_directory) as key_store:
+            daemon = self.start_daemon(key_store=key_store)
+            plain = bytes(self.prng.getrandbits(8) for _ in range(M + 1))
+            response, cipher = self.process('encryption', plain, key_name='tenant1')
+            self.assertTrue(response['ok'], response)
+            response, _ = self.process('verification', cipher, key_name='tenant2')
+            self.assertEqual('MAC check failed', response['error'])
+            response, _ = self.process('verification', cipher)
+            self.assertEqual('MAC check failed', response['error'])
+            response, decrypted = self.process('decryption', cipher, key_name='tenant1')
+            self.assertEqual(plain, decrypted)
+            response, _ = self.process('verification', cipher, key_name='../keys/tenant1')
+            self.assertIn('Malformed key name', response['error'])
+            self.assertEqual({'cached': 2, 'hits': 1, 'misses': 2}, daemon.stats()['keys'])
+
+    def test_command_line(self):
+        env = dict(os.environ, KEY=self.key.hex())
+        command = (sys.executable, '-m', 'cipher21.application')
+        daemon = subprocess.Popen(
+            command + ('-k', 'env:KEY', '--serve', self.socket_path, '-j', '2'),
+            cwd=self.PROJECT_DIR, env=env, stderr=subprocess.PIPE
+        )
+        try:
+            while not os.path.exists(self.socket_path):
+                self.assertIsNone(daemon.poll())
+                time.sleep(0.01)
+            plain = bytes(self.prng.getrandbits(8) for _ in range(4*M + 9))
+            via = command + ('--via', self.socket_path)
+            cipher = subprocess.run(via + ('-e', '--stream-version', '2'), input=plain, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, cwd=self.PROJECT_DIR, check=True)
+            self.assertIn(b'payload length: 65,545 B', cipher.stderr)
+            decrypted = subprocess.run(via + ('-d',), input=cipher.stdout, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, cwd=self.PROJECT_DIR, check=True)
+            self.assertEqual(plain, decrypted.stdout)
+            refused = subprocess.run(via + ('-d',), input=plain, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, cwd=self.PROJECT_DIR)
+            self.assertEqual(1, refused.returncode)
+            stats = subprocess.run(via + ('--server-stats',), stdout=subprocess.PIPE,
+                                   cwd=self.PROJECT_DIR, check=True)
+            self.assertIn(b'"requests": 3', stats.stdout)
+        finally:
+            daemon.send_signal(signal.SIGTERM)
+            _, stderr = daemon.communicate(timeout=30)
+        self.assertEqual(0, daemon.returncode, stderr)
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertIn(b'stopped after 3 requests, 1 failed', stderr)
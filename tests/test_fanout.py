@@ -0,0 +1,118 @@
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryDirectory
+import argparse
+import os
+
+from cipher21 import blocking_io, fanout
+from cipher21.arguments_parser import ArgumentsParser
+from cipher21.buffer_pool import SecureBufferPool
+from cipher21.constants import *
+
+
+class ReadCountingStream(BytesIO):
+
+    def __init__(self, data: bytes):
+        super().__init__(data)
+        self.read_length = 0
+
+    def readinto(self, b) -> int:
+        length = super().readinto(b)
+        self.read_length += length
+        return length
+
+
+class FanOutTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, M - 58, 3*M + 5, S - 1, S, S + 1, 2*S + 12345)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x5F1B3D7E9A2C4E6081A3C5E7092B4D6F, version=2)
+        self.keys = [bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH)) for _ in range(3)]
+
+    def test_round_trip(self):
+        for version in (1, 2):
+            for size in self.TEST_SIZES:
+                with self.subTest(version=version, size=size):
+                    plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+                    input_stream = ReadCountingStream(plain)
+                    outputs = [BytesIO() for _ in self.keys]
+                    encrypters = fanout.encrypt_stream(outputs, input_stream, self.keys, 2*M,
+                                                       version, SecureBufferPool())
+                    self.assertEqual(size, input_stream.read_length)
+                    self.assertEqual(len(self.keys), len({e.nonce for e in encrypters}))
+                    for output, key, encrypter in zip(outputs, self.keys, encrypters):
+                        self.assertEqual(encrypter.stream_length(size), len(output.getvalue()))
+                        decrypted = BytesIO()
+                        decrypter = blocking_io.decrypt_stream(
+                            decrypted, BytesIO(output.getvalue()), key
+                        )
+                        self.assertEqual(plain, decrypted.getvalue())
+                        self.assertEqual(encrypter.mac, decrypter.mac)
+
+    def test_compression(self):
+        plain = b'fan-out ' * 100000
+        outputs = [BytesIO() for _ in self.keys]
+        encrypters = fanout.encrypt_stream(outputs, BytesIO(plain), self.keys, version=2,
+                                           compression='bz2:1')
+        for output, key, encrypter in zip(outputs, self.keys, encrypters):
+            self.assertEqual('bz2', encrypter.compression)
+            decrypted = BytesIO()
+            blocking_io.decrypt_stream(decrypted, BytesIO(output.getvalue()), key)
+            self.assertEqual(plain, decrypted.getvalue())
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            fanout.encrypt_stream([BytesIO()], BytesIO(b'abc'), self.keys)
+        with self.assertRaises(ValueError):
+            fanout.encrypt_stream([], BytesIO(b'abc'), [])
+        with self.assertRaises(ValueError):
+            fanout.encrypt_stream([BytesIO() for _ in self.keys], BytesIO(b'abc'), self.keys,
+                                  compression='zlib')
+
+    def test_arguments(self):
+        parser = ArgumentsParser()
+        env = {'CIPHER21_KEY_' + str(i): key.hex() for i, key in enumerate(self.keys)}
+        keys = ('-k', 'env:CIPHER21_KEY_0', '-k', 'env:CIPHER21_KEY_1')
+        with patch.dict(os.environ, env):
+            for args in (
+                ('-e',) + keys + ('-o', os.devnull),
+                ('-d',) + keys + ('-o', os.devnull, '-o', '-'),
+                ('-e',) + keys + ('-o', '-', '-o', '-'),
+                ('-e',) + keys + ('-o', os.devnull, '-o', '-', '--pipeline'),
+                ('-e', '-k', 'env:CIPHER21_KEY_0', '-o', os.devnull, '-o', '-'),
+            ):
+                with self.subTest(args=args):
+                    with self.assertRaises(argparse.ArgumentError):
+                        parser.parse(args)
+
+    def test_same_outputs(self):
+        parser = ArgumentsParser()
+        env = {'CIPHER21_KEY_' + str(i): key.hex() for i, key in enumerate(self.keys)}
+        keys = ('-k', 'env:CIPHER21_KEY_0', '-k', 'env:CIPHER21_KEY_1')
+        with TemporaryDirectory() as directory, patch.dict(os.environ, env):
+            first = os.path.join(directory, 'o1')
+            with open(first, 'wb'):
+                pass
+            os.link(first, os.path.join(directory, 'hard'))
+            os.symlink(first, os.path.join(directory, 'soft'))
+            for second in (os.path.join(directory, '.', 'o1'), os.path.join(directory, 'hard'),
+                           os.path.join(directory, 'soft')):
+                with self.subTest(second=second):
+                    with self.assertRaisesRegex(argparse.ArgumentError, 'are the same file'):
+                        parser.parse(('-e',) + keys + ('-i', os.devnull, '-o', first, '-o', second))
+            # A fresh output gets created, then the other path is found to name it too.
+            os.remove(first)
+            with self.assertRaisesRegex(argparse.ArgumentError, 'are the same file'):
+                parser.parse(('-e',) + keys + ('-i', os.devnull, '-o', first,
+                                               '-o', os.path.join(directory, 'soft')))
+            parsed_args = parser.parse(('-e',) + keys + ('-i', os.devnull, '-o', first,
+                                                         '-o', os.path.join(directory, 'o2')))
+            self.assertEqual(2, len(parsed_args.outputs))
+            for output in parsed_args.outputs:
+                output.close()
+            parsed_args.input.close()
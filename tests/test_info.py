@@ -0,0 +1,85 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryFile
+
+from cipher21 import blocking_io, mapped_io, pipelined_io
+from cipher21.info import inspect_stream, payload_length_range
+from cipher21.random_access import decrypt_range
+from cipher21.constants import *
+from cipher21.decrypter import StaleStreamError
+
+
+class InspectStreamTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, M - 58, M - 57, 3*M + 5, S - M, S - 1, S, S + 1, S + M, 2*S + 12345)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x7A1E3C5B9D2F4068E1C3A5B7D9F0E2C4, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def encrypt(self, size: int, version: int) -> (bytes, int):
+        stream = BytesIO()
+        encrypter = blocking_io.encrypt_stream(stream, BytesIO(bytes(size)), self.key,
+                                               version=version)
+        return stream.getvalue(), encrypter.stream_timestamp_ns
+
+    def test_payload_length_range(self):
+        for version in (1, 2):
+            for size in self.TEST_SIZES:
+                with self.subTest(version=version, size=size):
+                    stream, timestamp_ns = self.encrypt(size, version)
+                    low, high = payload_length_range(len(stream), version)
+                    self.assertLessEqual(low, size)
+                    self.assertLessEqual(size, high)
+                    self.assertLess(high - low, M if version == 1 else 2*M)
+        for version in (1, 2):
+            for length in (0, M - 1, M + 1, 2*M - 58):
+                with self.subTest(version=version, length=length):
+                    with self.assertRaises(ValueError):
+                        payload_length_range(length, version)
+
+    def test_inspect_stream(self):
+        for version in (1, 2):
+            stream, timestamp_ns = self.encrypt(3*self.S, version)
+            with self.subTest(version=version):
+                info = inspect_stream(BytesIO(stream), self.key)
+                self.assertEqual((version, timestamp_ns, None), info[:3])
+                with TemporaryFile() as f:
+                    f.write(b'junk' + stream)
+                    f.seek(4)
+                    info = inspect_stream(f, self.key)
+                    self.assertEqual(f.tell(), STREAM_V2_HEADER_LENGTH + 4 if version == 2
+                                     else STREAM_HEADER_LENGTH + 4)
+                self.assertEqual((version, timestamp_ns, len(stream)), info[:3])
+                self.assertLessEqual(info.min_payload_length, 3*self.S)
+                self.assertLessEqual(3*self.S, info.max_payload_length)
+                with self.assertRaises(StaleStreamError):
+                    inspect_stream(BytesIO(stream), self.key, timestamp_ns)
+                self.assertEqual(timestamp_ns, inspect_stream(BytesIO(stream), self.key,
+                                                              timestamp_ns - 1).stream_timestamp_ns)
+
+    def test_early_rejection(self):
+        for version in (1, 2):
+            stream, timestamp_ns = self.encrypt(3*self.S, version)
+            header_length = STREAM_V2_HEADER_LENGTH if version == 2 else STREAM_HEADER_LENGTH
+            for module in (blocking_io, pipelined_io):
+                with self.subTest(version=version, module=module.__name__):
+                    input_stream, output_stream = BytesIO(stream), BytesIO()
+                    with self.assertRaises(StaleStreamError):
+                        module.decrypt_stream(output_stream, input_stream, self.key,
+                                              after_ns=timestamp_ns)
+                    self.assertEqual(header_length, input_stream.tell())
+                    self.assertEqual(b'', output_stream.getvalue())
+            with self.subTest(version=version, module='mapped_io'), \
+                    TemporaryFile() as input_file, TemporaryFile() as output_file:
+                input_file.write(stream)
+                input_file.flush()
+                with self.assertRaises(StaleStreamError):
+                    mapped_io.decrypt_file(output_file, input_file, self.key, after_ns=timestamp_ns)
+                self.assertEqual(0, output_file.seek(0, 2))
+                if version == 2:
+                    with self.assertRaises(StaleStreamError):
+                        decrypt_range(output_file, input_file, self.key, after_ns=timestamp_ns)
@@ -0,0 +1,96 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+
+from cipher21 import blocking_io
+from cipher21.iter_io import encrypt_iter, decrypt_iter
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+
+
+class IterIoTest(TestCase):
+
+    TEST_SIZES = (0, 1, M - STREAM_METADATA_LENGTH, M - STREAM_METADATA_LENGTH + 1, 5*M + 3,
+                  SEGMENT_PAYLOAD_LENGTH, SEGMENT_PAYLOAD_LENGTH + 1, 2*SEGMENT_LENGTH + 12345)
+    CHUNK_SIZES = (333, 3*M + 1, SEGMENT_LENGTH + 1)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x2F8E4D1A6B3C5079E8D7C6B5A4938271, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def split(self, data: bytes, chunk_size: int):
+        return (data[i:i+chunk_size] for i in range(0, len(data), chunk_size))
+
+    def test_compatibility(self):
+        for size in self.TEST_SIZES:
+            plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+            for version in (1, 2):
+                input_size = self.prng.choice(self.CHUNK_SIZES)
+                output_size = self.prng.choice(self.CHUNK_SIZES)
+                with self.subTest(size=size, version=version, input_size=input_size,
+                                  output_size=output_size):
+                    chunks = list(encrypt_iter(self.split(plain, input_size), self.key,
+                                               output_size, version))
+                    self.assertTrue(all(len(c) == output_size for c in chunks[:-1]))
+                    encrypted = b''.join(chunks)
+                    decrypted = BytesIO()
+                    blocking_io.decrypt_stream(decrypted, BytesIO(encrypted), self.key)
+                    self.assertEqual(plain, decrypted.getvalue())
+                    chunks = list(decrypt_iter(self.split(encrypted, input_size), self.key,
+                                               output_size))
+                    self.assertTrue(all(len(c) == output_size for c in chunks[:-1]))
+                    self.assertEqual(plain, b''.join(chunks))
+
+    def test_reused_buffer(self):
+        plain = self.prng.getrandbits(8 * 3*SEGMENT_LENGTH).to_bytes(3*SEGMENT_LENGTH, 'little')
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = bytearray()
+                generator = encrypt_iter(self.split(plain, 5*M + 7), self.key, M, version, True)
+                buffers = set()
+                for chunk in generator:
+                    self.assertIsInstance(chunk, memoryview)
+                    buffers.add(id(chunk.obj))
+                    encrypted += chunk
+                self.assertEqual(1, len(buffers))
+                decrypted = bytearray()
+                for chunk in decrypt_iter([encrypted], self.key, 2*M + 1, True):
+                    decrypted += chunk
+                self.assertEqual(plain, decrypted)
+
+    def test_attributes(self):
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = []
+                chunks = [b'a' * 100, bytearray(b'b' * 200), memoryview(b'c' * 300)]
+                encrypter = drain(encrypt_iter(chunks, self.key, version=version), encrypted)
+                self.assertEqual(600, encrypter.payload_length)
+                decrypter = drain(decrypt_iter(encrypted, self.key), [])
+                self.assertEqual(600, decrypter.payload_length)
+                self.assertEqual(encrypter.mac, decrypter.mac)
+                self.assertEqual(encrypter.stream_timestamp_ns, decrypter.stream_timestamp_ns)
+
+    def test_tampered(self):
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = bytearray(b''.join(encrypt_iter([b'\xA5' * 5*M], self.key,
+                                                            version=version)))
+                encrypted[-MAC_LENGTH - 1] ^= 0x01
+                with self.assertRaises(DecryptingError):
+                    list(decrypt_iter([encrypted], self.key))
+        for length in (0, STREAM_SIGNATURE_LENGTH, STREAM_HEADER_LENGTH + 1):
+            with self.subTest(length=length):
+                with self.assertRaises(ValueError):
+                    list(decrypt_iter([b'\0' * length], self.key))
+        with self.assertRaises(ValueError):
+            list(encrypt_iter([b'x'], self.key, 0))
+
+
+def drain(generator, chunks: list):
+    """Collects the yielded chunks and returns the value returned by the generator."""
+    while True:
+        try:
+            chunks.append(next(generator))
+        except StopIteration as e:
+            return e.value
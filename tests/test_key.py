@@ -1,7 +1,10 @@
 from unittest import TestCase
+from unittest.mock import patch
 from random import Random
+from tempfile import TemporaryDirectory
+import os
 
-from cipher21.key import Cipher21Key
+from cipher21.key import Cipher21Key, KeyStore
 from cipher21.constants import KEY_LENGTH
 
 
@@ -33,3 +36,96 @@ class AssessKeyTest(TestCase):
         key = 2*bytes.fromhex('e521377823342e05bd6fe051a12a8820')
         with self.assertRaises(ValueError):
             Cipher21Key.from_bytes(key)
+
+
+class KeyStoreTest(TestCase):
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x2F6C81D03E5A4B97C8D1E0F2A3B4C5D6, version=2)
+        self.directory = TemporaryDirectory()
+        self.now = 0.0
+        self.store = KeyStore(self.directory.name, capacity=3, ttl=60.0)
+        self.store.get_monotonic_time = lambda: self.now
+
+    def tearDown(self) -> None:
+        self.store.clear()
+        self.directory.cleanup()
+
+    def write_key(self, name: str, mtime_ns: int = 10**18) -> bytes:
+        key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as f:
+            f.write(key.hex())
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+        return key
+
+    def test_references(self):
+        key = self.write_key('tenant')
+        path = os.path.join(self.directory.name, 'tenant')
+        with self.store.lease('dir:tenant') as k:
+            self.assertEqual(key, k.bytes)
+        with self.store.lease('file:' + path) as k:
+            self.assertEqual(key, k.bytes)
+        with patch.dict(os.environ, KEY_STORE_TEST=key.hex()):
+            with self.store.lease('env:KEY_STORE_TEST') as k:
+                self.assertEqual(key, k.bytes)
+            # The cache tells a changed variable by a salted digest, not by a copy of the key.
+            version = self.store._entries['env:KEY_STORE_TEST'].version
+            self.assertNotIn(key.hex().encode(), version)
+            self.assertNotIn(key, version)
+        other_key = self.write_key('other')
+        with patch.dict(os.environ, KEY_STORE_TEST=other_key.hex()):
+            with self.store.lease('env:KEY_STORE_TEST') as k:
+                self.assertEqual(other_key, k.bytes)
+        fd = os.open(path, os.O_RDONLY)
+        with self.store.lease('fd:{}'.format(fd)) as k:
+            self.assertEqual(key, k.bytes)
+        self.assertNotEqual(key, k.bytes)
+        with self.assertRaises(OSError):
+            os.fstat(fd)
+        self.assertEqual(3, len(self.store))
+        for reference in ('tenant', 'ftp:tenant', 'dir:../tenant', 'dir:.tenant', 'dir:a/tenant',
+                          'dir:missing', 'env:KEY_STORE_MISSING', 'fd:x'):
+            with self.subTest(reference=reference):
+                with self.assertRaises(ValueError):
+                    with self.store.lease(reference):
+                        pass
+        with self.assertRaises(ValueError):
+            KeyStore().load('dir:tenant')
+
+    def test_cache(self):
+        keys = [self.write_key('k{}'.format(i)) for i in range(4)]
+        cached = []
+        for i in (0, 1, 2, 0):
+            with self.store.lease('dir:k{}'.format(i)) as k:
+                cached.append(k)
+                self.assertEqual(keys[i], k.bytes)
+        self.assertIs(cached[0], cached[3])
+        self.assertEqual((1, 3), (self.store.hits, self.store.misses))
+        # The least recently used k1 is evicted and cleared.
+        with self.store.lease('dir:k3'):
+            pass
+        self.assertNotEqual(keys[1], cached[1].bytes)
+        self.assertEqual(keys[0], cached[0].bytes)
+        self.assertEqual(3, len(self.store))
+        self.now += 61
+        with self.store.lease('dir:k0') as k:
+            self.assertIsNot(cached[0], k)
+            self.assertEqual(keys[0], k.bytes)
+        self.assertNotEqual(keys[0], cached[0].bytes)
+        self.store.clear()
+        self.assertEqual(0, len(self.store))
+        self.assertNotEqual(keys[0], k.bytes)
+
+    def test_reload_and_leases(self):
+        key = self.write_key('tenant')
+        with self.store.lease('dir:tenant') as leased:
+            replaced = self.write_key('tenant', 2 * 10**18)
+            with self.store.lease('dir:tenant') as k:
+                self.assertEqual(replaced, k.bytes)
+            # Evicted by the reload, but still leased.
+            self.assertEqual(key, leased.bytes)
+            self.store.clear()
+            self.assertEqual(key, leased.bytes)
+        self.assertNotEqual(key, leased.bytes)
@@ -0,0 +1,89 @@
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryFile, NamedTemporaryFile, TemporaryDirectory
+import argparse
+import os
+
+from cipher21 import blocking_io, mapped_io
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+from cipher21.arguments_parser import ArgumentsParser
+
+
+class MappedIoTest(TestCase):
+
+    TEST_SIZES = (0, 1, M - STREAM_METADATA_LENGTH, M - STREAM_METADATA_LENGTH + 1, 5*M + 7,
+                  SEGMENT_PAYLOAD_LENGTH, 2*SEGMENT_PAYLOAD_LENGTH + 3)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x1F2E3D4C5B6A79880716253443526170, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def _temporary_file(self, content: bytes = b''):
+        f = TemporaryFile()
+        self.addCleanup(f.close)
+        f.write(content)
+        f.flush()
+        return f
+
+    def test_round_trip(self):
+        for size in self.TEST_SIZES:
+            plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+            for version in (1, 2):
+                with self.subTest(size=size, version=version):
+                    plain_file = self._temporary_file(plain)
+                    encrypted_file = self._temporary_file()
+                    decrypted_file = self._temporary_file(b'previous content')
+                    self.assertTrue(mapped_io.is_mappable(encrypted_file, plain_file))
+                    encrypter = mapped_io.encrypt_file(encrypted_file, plain_file, self.key, version)
+                    encrypted_file.seek(0)
+                    encrypted = encrypted_file.read()
+                    self.assertEqual(0, len(encrypted) % STREAM_LENGTH_MULTIPLICAND)
+                    decrypted = BytesIO()
+                    blocking_io.decrypt_stream(decrypted, BytesIO(encrypted), self.key)
+                    self.assertEqual(plain, decrypted.getvalue())
+                    decrypter = mapped_io.decrypt_file(decrypted_file, encrypted_file, self.key)
+                    decrypted_file.seek(0)
+                    self.assertEqual(plain, decrypted_file.read())
+                    self.assertEqual(encrypter.mac, decrypter.mac)
+
+    def test_tampered(self):
+        for version in (1, 2):
+            with self.subTest(version=version):
+                encrypted = BytesIO()
+                blocking_io.encrypt_stream(encrypted, BytesIO(3*M*b'x'), self.key, version=version)
+                tampered = bytearray(encrypted.getvalue())
+                tampered[M + 5] ^= 0x80
+                decrypted_file = self._temporary_file(b'previous content')
+                with self.assertRaises(DecryptingError):
+                    mapped_io.decrypt_file(decrypted_file, self._temporary_file(tampered),
+                                           self.key)
+                decrypted_file.seek(0, 2)
+                self.assertEqual(0, decrypted_file.tell())
+
+    def test_not_mappable(self):
+        self.assertFalse(mapped_io.is_mappable(BytesIO(), self._temporary_file()))
+        with NamedTemporaryFile() as f, open(f.name, 'rb') as read_only:
+            self.assertFalse(mapped_io.is_mappable(read_only, self._temporary_file()))
+
+    def test_output_is_input(self):
+        parser = ArgumentsParser()
+        with TemporaryDirectory() as directory, \
+                patch.dict(os.environ, {'CIPHER21_KEY': self.key.hex(),
+                                        'CIPHER21_KEY_2': self.key[::-1].hex()}):
+            path = os.path.join(directory, 'plain')
+            with open(path, 'wb') as f:
+                f.write(b'precious' * 1000)
+            os.link(path, os.path.join(directory, 'link'))
+            for outputs in ((path,), (os.path.join(directory, 'link'),),
+                            (os.path.join(directory, 'other'), path)):
+                keys = ('-k', 'env:CIPHER21_KEY', '-k', 'env:CIPHER21_KEY_2')[:2*len(outputs)]
+                args = ('-e',) + keys + ('-i', path) + sum((('-o', o) for o in outputs), ())
+                with self.subTest(args=args):
+                    with self.assertRaisesRegex(argparse.ArgumentError, 'is the input file'):
+                        parser.parse(args)
+                    with open(path, 'rb') as f:
+                        self.assertEqual(b'precious' * 1000, f.read())
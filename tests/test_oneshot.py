@@ -0,0 +1,63 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+
+from cipher21 import blocking_io
+from cipher21.oneshot import encrypted_length, encrypt_bytes, decrypt_bytes, decrypt_into
+from cipher21.decrypter import DecryptingError, StaleStreamError
+from cipher21.constants import *
+
+
+class OneShotTest(TestCase):
+
+    TEST_SIZES = (0, 1, 100, M - STREAM_METADATA_LENGTH, M - STREAM_METADATA_LENGTH + 1, M,
+                  3*M + 5)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x7A3E1C5B9D0F2468ACE013579BDF8642, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def test_round_trip(self):
+        for size in self.TEST_SIZES:
+            with self.subTest(size=size):
+                plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+                blob = encrypt_bytes(plain, self.key)
+                self.assertEqual(encrypted_length(size), len(blob))
+                output = BytesIO()
+                blocking_io.decrypt_stream(output, BytesIO(blob), self.key)
+                self.assertEqual(plain, output.getvalue())
+                self.assertEqual(plain, decrypt_bytes(blob, self.key))
+                stream = BytesIO()
+                blocking_io.encrypt_stream(stream, BytesIO(plain), self.key)
+                self.assertEqual(plain, decrypt_bytes(stream.getvalue(), self.key))
+
+    def test_reused_buffers(self):
+        stream_output = bytearray(encrypted_length(100))
+        payload_output = bytearray(M)
+        for _ in range(3):
+            plain = self.prng.getrandbits(8 * 100).to_bytes(100, 'little')
+            blob = encrypt_bytes(memoryview(plain), self.key, stream_output)
+            self.assertIs(stream_output, blob)
+            self.assertEqual(100, decrypt_into(blob, self.key, payload_output))
+            self.assertEqual(plain, payload_output[:100])
+        with self.assertRaises(ValueError):
+            encrypt_bytes(b'x' * M, self.key, stream_output)
+        with self.assertRaises(ValueError):
+            decrypt_into(blob, self.key, bytearray(99))
+
+    def test_errors(self):
+        blob = encrypt_bytes(b'abc', self.key)
+        payload_output = bytearray(3)
+        for offset in (TIMESTAMP_OFFSET, STREAM_HEADER_LENGTH, len(blob) - 1):
+            with self.subTest(offset=offset):
+                tampered = bytearray(blob)
+                tampered[offset] ^= 1
+                with self.assertRaises(DecryptingError):
+                    decrypt_into(tampered, self.key, payload_output)
+                self.assertEqual(bytes(3), payload_output)
+        for tampered in (blob[:STREAM_METADATA_LENGTH - 1], b'x' + blob[1:]):
+            with self.assertRaises(ValueError):
+                decrypt_bytes(tampered, self.key)
+        with self.assertRaises(StaleStreamError):
+            decrypt_bytes(blob, self.key, after_ns=2**63)
@@ -0,0 +1,72 @@
+from unittest import TestCase
+from unittest.mock import patch
+from io import BytesIO
+from tempfile import TemporaryFile
+import os
+
+from cipher21 import blocking_io, mapped_io, verifier
+from cipher21.batch import process_streams
+from cipher21.operation_mode import OperationMode
+from cipher21.page_cache import drop_behind, DropBehindReader, DropBehindWriter, DROP_INTERVAL
+from cipher21.constants import *
+
+
+class DropBehindTest(TestCase):
+
+    KEY = bytes.fromhex('8a1f6cb59e2d47f0b3c8d1e6a4f79b25c06e3d8f1a5b7c9e2d4f6a8b0c1e3f5a')
+
+    def test_round_trip(self):
+        plain = bytes(range(256)) * (3*M // 16)
+        with TemporaryFile() as plain_file, TemporaryFile() as encrypted_file:
+            plain_file.write(plain)
+            plain_file.seek(0)
+            reader = drop_behind(plain_file, False)
+            writer = drop_behind(encrypted_file, True)
+            self.assertIsInstance(reader, DropBehindReader)
+            self.assertIsInstance(writer, DropBehindWriter)
+            reader.interval = writer.interval = M
+            blocking_io.encrypt_stream(writer, reader, self.KEY)
+            self.assertEqual(len(plain), reader.finish())
+            self.assertEqual(os.fstat(encrypted_file.fileno()).st_size, writer.finish())
+            encrypted_file.seek(0)
+            decrypted = BytesIO()
+            blocking_io.decrypt_stream(decrypted, encrypted_file, self.KEY)
+            self.assertEqual(plain, decrypted.getvalue())
+
+    def test_not_regular_files(self):
+        stream = BytesIO()
+        self.assertIs(stream, drop_behind(stream, False))
+        r, w = os.pipe()
+        with open(r, 'rb') as reader, open(w, 'wb') as writer:
+            self.assertIs(reader, drop_behind(reader, False))
+            self.assertIs(writer, drop_behind(writer, True))
+
+    def test_regular_files_dropped_while_processed(self):
+        length = 3*DROP_INTERVAL + 5
+        with TemporaryFile() as plain_file, TemporaryFile() as encrypted_file, \
+                TemporaryFile() as decrypted_file:
+            plain_file.write(bytes(length))
+            self.assertTrue(mapped_io.is_mappable(encrypted_file, plain_file))
+            self.assertFalse(mapped_io.is_mappable(drop_behind(encrypted_file, True),
+                                                   drop_behind(plain_file, False)))
+            self.assertFalse(verifier.is_mappable(drop_behind(plain_file, False)))
+            for mode, output_file, input_file in (
+                (OperationMode.ENCRYPTION, encrypted_file, plain_file),
+                (OperationMode.VERIFICATION, decrypted_file, encrypted_file),
+                (OperationMode.DECRYPTION, decrypted_file, encrypted_file),
+            ):
+                with self.subTest(mode=mode):
+                    input_file.seek(0)
+                    output_file.seek(0)
+                    with patch.object(os, 'posix_fadvise', wraps=os.posix_fadvise) as fadvise:
+                        process_streams(output_file, input_file, self.KEY, mode, 1, 0, 4*M,
+                                        True)
+                    dropped = [c[0][1:3] for c in fadvise.call_args_list
+                               if c[0][0] == input_file.fileno()
+                               and c[0][3] == os.POSIX_FADV_DONTNEED]
+                    # finish() drops the rest in one call, the preceding ones happen on the way.
+                    self.assertGreaterEqual(len(dropped), 3)
+                    self.assertEqual(0, dropped[0][0])
+                    self.assertLess(dropped[0][1], 2*DROP_INTERVAL)
+            decrypted_file.seek(0)
+            self.assertEqual(bytes(length), decrypted_file.read())
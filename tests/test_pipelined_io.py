@@ -0,0 +1,67 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+
+from cipher21 import blocking_io, pipelined_io
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+
+
+class PipelinedIoTest(TestCase):
+
+    TEST_SIZES = (0, 1, 2*M - STREAM_METADATA_LENGTH, 2*M - STREAM_METADATA_LENGTH + 1,
+                  4*M, 8*M + 3, 37*M - 5, 123457)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x5D0BE0E4A2C2F1A3B4FB8A6EC2C7D3F1, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def test_compatibility(self):
+        for size in self.TEST_SIZES:
+            plain = bytes(self.prng.getrandbits(8) for _ in range(size))
+            for encrypting, decrypting in ((pipelined_io, blocking_io), (blocking_io, pipelined_io),
+                                           (pipelined_io, pipelined_io)):
+                with self.subTest(size=size, encrypting=encrypting.__name__,
+                                  decrypting=decrypting.__name__):
+                    encrypted = BytesIO()
+                    encrypter = encrypting.encrypt_stream(encrypted, BytesIO(plain), self.key)
+                    self.assertEqual(0, len(encrypted.getvalue()) % STREAM_LENGTH_MULTIPLICAND)
+                    decrypted = BytesIO()
+                    encrypted.seek(0)
+                    decrypter = decrypting.decrypt_stream(decrypted, encrypted, self.key)
+                    self.assertEqual(plain, decrypted.getvalue())
+                    self.assertEqual(size, decrypter.payload_length)
+                    self.assertEqual(encrypter.stream_timestamp_ns, decrypter.stream_timestamp_ns)
+                    self.assertEqual(encrypter.mac, decrypter.mac)
+
+    def test_tampered(self):
+        encrypted = BytesIO()
+        pipelined_io.encrypt_stream(encrypted, BytesIO(5*M*b'\xA5'), self.key)
+        tampered = bytearray(encrypted.getvalue())
+        tampered[3*M] ^= 0x10
+        with self.assertRaises(DecryptingError):
+            pipelined_io.decrypt_stream(BytesIO(), BytesIO(tampered), self.key)
+
+    def test_write_error(self):
+        class BrokenStream(BytesIO):
+            def write(self, b):
+                raise BrokenPipeError()
+        with self.assertRaises(BrokenPipeError):
+            pipelined_io.encrypt_stream(BrokenStream(), BytesIO(9*M*b'\x5A'), self.key)
+
+    def test_cipher_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            with pipelined_io._Pipeline(BytesIO(), BytesIO(9*M*b'\x5A'), M) as pipeline:
+                for _ in range(pipelined_io.RING_SIZE + 1):
+                    buffer, length = pipeline.read()
+                    output = pipeline.acquire_output()
+                    # Recycled buffers come back zeroed, even though the data was written.
+                    self.assertEqual(bytes(M), output)
+                    output[:] = buffer
+                    pipeline.write(memoryview(output)[:length], output)
+                    pipeline.recycle_input(buffer)
+                1 / 0
+        self.assertFalse(pipeline._reader.is_alive())
+        self.assertFalse(pipeline._writer.is_alive())
+        self.assertEqual(([], []), (pipeline._input_ring, pipeline._output_ring))
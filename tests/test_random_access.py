@@ -0,0 +1,55 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryFile
+
+from cipher21 import blocking_io
+from cipher21.random_access import decrypt_range
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+
+
+class DecryptRangeTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x3C1D5E7F90A2B4C6D8E0F1A3B5C7D9E1, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        size = 2*self.S + 12345
+        self.plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+        self.file = TemporaryFile()
+        blocking_io.encrypt_stream(self.file, BytesIO(self.plain), self.key, version=2)
+        self.file.flush()
+
+    def tearDown(self) -> None:
+        self.file.close()
+
+    def test_ranges(self):
+        S = self.S
+        n = len(self.plain)
+        ranges = ((0, 0), (0, 1), (0, None), (5, 17), (S - 3, S + 3), (S, 2*S), (S + 1, n - 1),
+                  (2*S - 1, 2*S + 1), (2*S + 100, None), (n - 1, n), (n, None), (n + 10, n + 20),
+                  (7, 10*S))
+        for start, end in ranges:
+            with self.subTest(start=start, end=end):
+                output = BytesIO()
+                decrypter = decrypt_range(output, self.file, self.key, start, end)
+                self.assertEqual(self.plain[start:end], output.getvalue())
+                self.assertEqual(len(output.getvalue()), decrypter.payload_length)
+
+    def test_tampered(self):
+        self.file.seek(STREAM_V2_HEADER_LENGTH + self.S // 2)
+        self.file.write(b'\x00\x01')
+        self.file.flush()
+        with self.assertRaises(DecryptingError):
+            decrypt_range(BytesIO(), self.file, self.key, 100, 200)
+        decrypt_range(BytesIO(), self.file, self.key, SEGMENT_PAYLOAD_LENGTH, None)
+
+    def test_version_1(self):
+        with TemporaryFile() as f:
+            blocking_io.encrypt_stream(f, BytesIO(b'abc'), self.key)
+            f.flush()
+            with self.assertRaises(ValueError):
+                decrypt_range(BytesIO(), f, self.key, 0, 1)
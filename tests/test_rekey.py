@@ -0,0 +1,183 @@
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryDirectory
+import argparse
+import threading
+import time
+import os
+
+from cipher21 import blocking_io
+from cipher21.rekey import rekey_stream
+from cipher21.batch import list_batch_files, process_files
+from cipher21.operation_mode import OperationMode
+from cipher21.arguments_parser import ArgumentsParser
+from cipher21.decrypter import DecryptingError
+from cipher21.constants import *
+
+
+class SlowStream(BytesIO):
+
+    def readinto(self, b) -> int:
+        time.sleep(0.01)
+        return super().readinto(b)
+
+
+class FailingStream(BytesIO):
+
+    def write(self, b) -> int:
+        raise OSError('No space left on device')
+
+
+class RekeyTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, M - 58, 3*M + 5, S - 1, S, S + 1, 2*S + 12345)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x2C4E6A8B0D1F3A5C7E9B1D3F5A7C9E0B, version=2)
+        self.old_key = bytearray(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        self.new_key = bytearray(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def encrypt(self, plain: bytes, version: int, **kwargs) -> bytes:
+        stream = BytesIO()
+        blocking_io.encrypt_stream(stream, BytesIO(plain), self.old_key, 2*M, version, **kwargs)
+        return stream.getvalue()
+
+    def test_round_trip(self):
+        for version in (1, 2):
+            for new_version in (None, 1, 2):
+                for size in self.TEST_SIZES:
+                    with self.subTest(version=version, new_version=new_version, size=size):
+                        plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+                        output = BytesIO()
+                        encrypter = rekey_stream(output, BytesIO(self.encrypt(plain, version)),
+                                                 self.old_key, self.new_key, new_version, 2*M)
+                        decrypted = BytesIO()
+                        decrypter = blocking_io.decrypt_stream(
+                            decrypted, BytesIO(output.getvalue()), self.new_key
+                        )
+                        self.assertEqual(plain, decrypted.getvalue())
+                        self.assertEqual(encrypter.mac, decrypter.mac)
+                        self.assertEqual(
+                            new_version or version,
+                            2 if output.getvalue().startswith(STREAM_V2_SIGNATURE) else 1
+                        )
+
+    def test_timestamp(self):
+        stream = BytesIO()
+        original = blocking_io.encrypt_stream(stream, BytesIO(b'abc'), self.old_key)
+        for keep_timestamp in (False, True):
+            with self.subTest(keep_timestamp=keep_timestamp):
+                encrypter = rekey_stream(BytesIO(), BytesIO(stream.getvalue()), self.old_key,
+                                         self.new_key, keep_timestamp=keep_timestamp)
+                self.assertEqual(keep_timestamp,
+                                 original.stream_timestamp_ns == encrypter.stream_timestamp_ns)
+
+    def test_compression(self):
+        plain = b're-key ' * 300000
+        stream = self.encrypt(plain, 2, compression='zlib')
+        output = BytesIO()
+        self.assertEqual('zlib', rekey_stream(output, BytesIO(stream), self.old_key,
+                                              self.new_key).compression)
+        self.assertEqual(len(stream), len(output.getvalue()))
+        decrypted = BytesIO()
+        blocking_io.decrypt_stream(decrypted, BytesIO(output.getvalue()), self.new_key)
+        self.assertEqual(plain, decrypted.getvalue())
+        with self.assertRaises(ValueError):
+            rekey_stream(BytesIO(), BytesIO(stream), self.old_key, self.new_key, 1)
+
+    def test_tampered_input(self):
+        size = 2*self.S + 12345
+        plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+        for version in (1, 2):
+            stream = bytearray(self.encrypt(plain, version))
+            for name, tampered in (
+                ('truncated', stream[:-self.S]),
+                ('last byte', stream[:-1] + bytes([stream[-1] ^ 1])),
+                ('wrong key', stream),
+            ):
+                with self.subTest(version=version, tampered=name):
+                    old_key = self.new_key if name == 'wrong key' else self.old_key
+                    output = BytesIO()
+                    with self.assertRaises(DecryptingError):
+                        rekey_stream(output, BytesIO(tampered), old_key, self.new_key)
+                    # Whatever was written, it does not authenticate.
+                    with self.assertRaises((DecryptingError, ValueError)):
+                        blocking_io.decrypt_stream(BytesIO(), BytesIO(output.getvalue()),
+                                                   self.new_key)
+
+    def test_tampered_version_1_into_2(self):
+        size = 3*self.S
+        plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+        tampered = bytearray(self.encrypt(plain, 1))
+        tampered[STREAM_HEADER_LENGTH + 5] ^= 1
+        output = BytesIO()
+        with self.assertRaises(DecryptingError):
+            rekey_stream(output, BytesIO(tampered), self.old_key, self.new_key, 2)
+        # Version 2 segments authenticate on their own, so none may be written before the check.
+        self.assertEqual(b'', output.getvalue())
+
+    def test_failed_output(self):
+        size = 2*self.S + 12345
+        plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+        for version in (1, 2):
+            with self.subTest(version=version):
+                with self.assertRaises(OSError):
+                    rekey_stream(FailingStream(), SlowStream(self.encrypt(plain, version)),
+                                 self.old_key, self.new_key, version, M)
+                # The decrypting thread is stopped before its ring is wiped.
+                self.assertNotIn('cipher21-decrypter', [t.name for t in threading.enumerate()])
+
+    def test_batch(self):
+        with TemporaryDirectory() as directory:
+            plains = {}
+            for i, size in enumerate((0, 3*M + 5, self.S + 7)):
+                path = os.path.join(directory, 'file{}.c21'.format(i))
+                plains[path] = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+                with open(path, 'wb') as f:
+                    f.write(self.encrypt(plains[path], 1 + i % 2))
+            with open(os.path.join(directory, 'broken.c21'), 'wb') as f:
+                f.write(b'broken')
+            paths = list_batch_files(directory, OperationMode.REKEYING)
+            results = list(process_files(paths, self.new_key, OperationMode.REKEYING,
+                                         version=None, processes=2, old_key=self.old_key))
+            self.assertEqual(paths, [r.output_path for r in results])
+            self.assertEqual([False] + [True] * len(plains),
+                             [r.error is None for r in results])
+            with open(os.path.join(directory, 'broken.c21'), 'rb') as f:
+                self.assertEqual(b'broken', f.read())
+            for path, plain in plains.items():
+                decrypted = BytesIO()
+                with open(path, 'rb') as f:
+                    blocking_io.decrypt_stream(decrypted, f, self.new_key)
+                self.assertEqual(plain, decrypted.getvalue())
+            self.assertEqual(sorted(paths), sorted(os.path.join(directory, name)
+                                                   for name in os.listdir(directory)))
+
+    def test_arguments(self):
+        parser = ArgumentsParser()
+        env = {'CIPHER21_OLD_KEY': self.old_key.hex(), 'CIPHER21_NEW_KEY': self.new_key.hex()}
+        with patch.dict(os.environ, env):
+            parsed_args = parser.parse(('--rekey', 'env:CIPHER21_OLD_KEY',
+                                        '-k', 'env:CIPHER21_NEW_KEY', '-o', os.devnull))
+            self.assertIs(OperationMode.REKEYING, parsed_args.operation_mode)
+            self.assertIsNone(parsed_args.stream_version)
+            self.assertEqual(self.old_key, parsed_args.old_key.bytes)
+            self.assertEqual(self.new_key, parsed_args.key.bytes)
+            parsed_args.key.clear()
+            parsed_args.old_key.clear()
+            parsed_args.output.close()
+            for args in (
+                ('--rekey', 'env:CIPHER21_OLD_KEY'),
+                ('--rekey', 'env:CIPHER21_OLD_KEY', '-e', '-k', 'env:CIPHER21_NEW_KEY'),
+                ('--rekey', 'env:CIPHER21_OLD_KEY', '-k', 'env:CIPHER21_NEW_KEY', '--pipeline'),
+                ('--rekey', 'env:CIPHER21_OLD_KEY', '-k', 'env:CIPHER21_NEW_KEY',
+                 '--compress', 'zlib'),
+                ('-e', '-k', 'env:CIPHER21_NEW_KEY', '--keep-timestamp'),
+            ):
+                with self.subTest(args=args):
+                    with self.assertRaises(argparse.ArgumentError):
+                        parser.parse(args)
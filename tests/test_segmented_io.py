@@ -0,0 +1,90 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO
+
+from cipher21 import blocking_io, pipelined_io
+from cipher21.constants import *
+from cipher21.decrypter import DecryptingError
+from cipher21.segmented_encrypter import SegmentedEncrypter
+from cipher21.segmented_decrypter import SegmentedDecrypter
+
+
+class SegmentedIoTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, M, S - 1, S, S + 1, 2*S - M + 5, 3*S)
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x9B1A7C3E5D2F40618293A4B5C6D7E8F9, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def _random_bytes(self, size: int) -> bytes:
+        return self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+
+    def _encrypt(self, plain: bytes, workers: int = 2) -> bytes:
+        encrypted = BytesIO()
+        blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=2, workers=workers)
+        return encrypted.getvalue()
+
+    def test_round_trip(self):
+        for size in self.TEST_SIZES:
+            plain = self._random_bytes(size)
+            for workers in (1, 3):
+                with self.subTest(size=size, workers=workers):
+                    encrypted = self._encrypt(plain, workers)
+                    self.assertTrue(encrypted.startswith(STREAM_V2_SIGNATURE))
+                    self.assertEqual(0, len(encrypted) % STREAM_LENGTH_MULTIPLICAND)
+                    for module in (blocking_io, pipelined_io):
+                        decrypted = BytesIO()
+                        decrypter = module.decrypt_stream(
+                            decrypted, BytesIO(encrypted), self.key, workers=workers
+                        )
+                        self.assertIsInstance(decrypter, SegmentedDecrypter)
+                        self.assertEqual(size, decrypter.payload_length)
+                        self.assertEqual(plain, decrypted.getvalue())
+
+    def test_final_segment_lengths(self):
+        encrypter = SegmentedEncrypter(self.key)
+        header = encrypter.initialize()
+        for length in range(0, self.S + 1, 997):
+            with self.subTest(length=length):
+                final = encrypter.finalize(0, bytes(length))
+                self.assertGreaterEqual(len(final), MIN_FINAL_SEGMENT_LENGTH)
+                self.assertLess(len(final), SEGMENT_LENGTH + MIN_FINAL_SEGMENT_LENGTH)
+                self.assertEqual(0, (len(header) + len(final)) % STREAM_LENGTH_MULTIPLICAND)
+
+    def test_tampered(self):
+        encrypted = self._encrypt(self._random_bytes(3*self.S + 7))
+        body = STREAM_V2_HEADER_LENGTH
+        segments = [encrypted[body + i*SEGMENT_LENGTH:body + (i+1)*SEGMENT_LENGTH] for i in range(3)]
+        final = encrypted[body + 3*SEGMENT_LENGTH:]
+        header = encrypted[:body]
+        flipped = bytearray(encrypted)
+        flipped[body + SEGMENT_LENGTH + 1234] ^= 0x04
+        cases = {
+            'flipped': bytes(flipped),
+            'reordered': header + segments[1] + segments[0] + segments[2] + final,
+            'dropped': header + segments[0] + segments[2] + final,
+            'truncated': header + b''.join(segments),
+            'no final': header + segments[0] + segments[1] + final[:-MAC_LENGTH],
+        }
+        for name, tampered in cases.items():
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError):
+                    blocking_io.decrypt_stream(BytesIO(), BytesIO(tampered), self.key)
+
+    def test_tampered_header(self):
+        encrypted = bytearray(self._encrypt(b'abc'))
+        encrypted[HEADER_BLOCK_OFFSET + 3] ^= 0x01
+        with self.assertRaises(DecryptingError):
+            blocking_io.decrypt_stream(BytesIO(), BytesIO(encrypted), self.key)
+
+    def test_version_1_detection(self):
+        plain = self._random_bytes(2*M + 3)
+        encrypted = BytesIO()
+        blocking_io.encrypt_stream(encrypted, BytesIO(plain), self.key, version=1)
+        encrypted.seek(0)
+        decrypted = BytesIO()
+        blocking_io.decrypt_stream(decrypted, encrypted, self.key)
+        self.assertEqual(plain, decrypted.getvalue())
@@ -0,0 +1,71 @@
+from unittest import TestCase
+from random import Random
+from copy import copy
+from typing import Dict, Sequence
+import subprocess
+import sys
+import os
+
+from cipher21.arguments_parser import ArgumentsParser, DEFAULT_AFTER, DEFAULT_AFTER_NS
+from cipher21.constants import KEY_LENGTH
+
+
+class StartupTest(TestCase):
+
+    PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+    # Number of modules imported by -h, which are about 90 including the interpreter start-up
+    # ones, while importing the cipher and the I/O modules eagerly doubles it. Unlike import
+    # times, the number does not depend on the machine load.
+    HELP_IMPORT_BUDGET = 120
+    HEAVY_MODULES = ('datetime', 'json', 'multiprocessing', 'secrets', 'hashlib', 'cipher21.batch')
+
+    def setUp(self) -> None:
+        prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        prng.seed(0xB7E2A4C6D8F0123456789ABCDEF01234, version=2)
+        self.key = bytes(prng.getrandbits(8) for _ in range(KEY_LENGTH)).hex()
+
+    def import_times(self, *args: str, input: bytes = b'') -> Dict[str, int]:
+        """Runs the application. Returns the cumulative import times in us by module names."""
+        env = copy(os.environ)
+        env.update(KEY=self.key)
+        result = subprocess.run(
+            (sys.executable, '-X', 'importtime', '-m', 'cipher21.application') + args,
+            input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            cwd=self.PROJECT_DIR
+        )
+        self.assertEqual(0, result.returncode, result.stderr)
+        times = {}
+        for line in result.stderr.decode().splitlines():
+            if line.startswith('import time:') and '|' in line:
+                _, cumulative, name = line.split('|')
+                if cumulative.strip().isdigit():
+                    times[name.strip()] = int(cumulative)
+        return times
+
+    def assertNotImported(self, modules: Sequence[str], times: Dict[str, int]):
+        for module in modules:
+            imported = [name for name in times if name == module or name.startswith(module + '.')]
+            self.assertEqual([], imported)
+
+    def test_help(self):
+        times = self.import_times('-h')
+        self.assertNotImported(self.HEAVY_MODULES + (
+            'Crypto', 'cipher21.key', 'cipher21.blocking_io', 'cipher21.buffer_pool'
+        ), times)
+        self.assertLess(len(times), self.HELP_IMPORT_BUDGET)
+
+    def test_small_input(self):
+        encrypted = subprocess.run(
+            (sys.executable, '-m', 'cipher21.application', '-e', '-k', 'env:KEY'),
+            input=b'small object', stdout=subprocess.PIPE, env=dict(os.environ, KEY=self.key),
+            cwd=self.PROJECT_DIR, check=True
+        ).stdout
+        self.assertNotImported(self.HEAVY_MODULES, self.import_times('-e', '-k', 'env:KEY'))
+        self.assertNotImported(self.HEAVY_MODULES,
+                               self.import_times('-d', '-k', 'env:KEY', input=encrypted))
+        times = self.import_times('-v', '-k', 'env:KEY', '--after', '2022-01-01T00Z',
+                                  input=encrypted)
+        self.assertIn('datetime', times)
+
+    def test_default_after(self):
+        self.assertEqual(DEFAULT_AFTER_NS, ArgumentsParser().parse_date_time_into_ns(DEFAULT_AFTER))
@@ -0,0 +1,126 @@
+from unittest import TestCase
+from random import Random
+from io import BytesIO, RawIOBase
+from tempfile import TemporaryDirectory
+from copy import copy
+import subprocess
+import json
+import sys
+import os
+
+from cipher21 import blocking_io
+from cipher21.stats import ProcessingStats
+from cipher21.constants import *
+
+
+class StallingStream(RawIOBase):
+    """Returns None from every other call, as a non-blocking stream does."""
+
+    def __init__(self, stream: BytesIO):
+        super().__init__()
+        self.stream = stream
+        self.ready = False
+
+    def fileno(self) -> int:
+        raise OSError()
+
+    def readinto(self, buffer):
+        self.ready = not self.ready
+        return self.stream.readinto(buffer) if self.ready else None
+
+    def write(self, b):
+        self.ready = not self.ready
+        return self.stream.write(b) if self.ready else None
+
+
+class StatsTest(TestCase):
+
+    PROJECT_DIR = os.path.dirname(os.path.dirname(__file__))
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x5D0C3B2A19E8F7D6C5B4A39281706F5E, version=2)
+        self.key = bytearray(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+        self.plain = self.prng.getrandbits(8 * (5*M + 3)).to_bytes(5*M + 3, 'little')
+
+    def test_counters(self):
+        stats = ProcessingStats()
+        encrypted = BytesIO()
+        encrypter = blocking_io.encrypt_stream(
+            stats.wrap_output(StallingStream(encrypted)), stats.wrap_input(
+                StallingStream(BytesIO(self.plain))
+            ), self.key, 2*M
+        )
+        report = stats.report(encrypter, 'encryption')
+        self.assertEqual(len(self.plain), report['bytes_in'])
+        self.assertEqual(len(encrypted.getvalue()), report['bytes_out'])
+        self.assertEqual(encrypter.padding_length, report['padding_length'])
+        for direction in ('read', 'write'):
+            stalls, calls = report[direction + '_stalls'], report[direction + '_calls']
+            self.assertGreater(stalls, 0)
+            self.assertLessEqual(abs(calls - 2 * stalls), 1)
+        self.assertGreater(report['throughput'], 0)
+        self.assertGreater(report['peak_rss'], 0)
+        self.assertAlmostEqual(report['processing_time'], report['read_time']
+                               + report['write_time'] + report['crypto_time'], delta=1e-3)
+
+    def test_progress(self):
+        stats = ProcessingStats(1e-9)
+        with self.assertLogs('cipher21.stats') as logs:
+            blocking_io.encrypt_stream(stats.wrap_output(BytesIO()),
+                                       stats.wrap_input(BytesIO(self.plain)), self.key, M)
+        self.assertGreaterEqual(len(logs.output), 5)
+        self.assertIn('{:,} B read'.format(len(self.plain)), logs.output[-1])
+
+    def test_application(self):
+        env = copy(os.environ)
+        env.update(KEY=self.key.hex())
+        with TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'stats.json')
+            result = subprocess.run(
+                (sys.executable, '-m', 'cipher21.application', '-e', '-k', 'env:KEY',
+                 '--stats', 'json:' + path, '--stream-version', '2'),
+                input=self.plain, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+                cwd=self.PROJECT_DIR
+            )
+            self.assertEqual(0, result.returncode, result.stderr)
+            with open(path) as f:
+                report = json.load(f)
+        self.assertEqual('encryption', report['operation'])
+        self.assertEqual(len(self.plain), report['bytes_in'])
+        self.assertEqual(len(result.stdout), report['bytes_out'])
+        result = subprocess.run(
+            (sys.executable, '-m', 'cipher21.application', '-v', '-k', 'env:KEY', '--stats',
+             'json'),
+            input=result.stdout, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+            cwd=self.PROJECT_DIR
+        )
+        self.assertEqual(0, result.returncode, result.stderr)
+        report = json.loads(result.stderr.splitlines()[-1])
+        self.assertEqual(len(self.plain), report['payload_length'])
+        self.assertFalse(report['mapped'])
+
+    def test_regular_files(self):
+        env = copy(os.environ)
+        env.update(KEY=self.key.hex())
+        with TemporaryDirectory() as directory:
+            plain_path = os.path.join(directory, 'plain')
+            stats_path = os.path.join(directory, 'stats.json')
+            with open(plain_path, 'wb') as f:
+                f.write(self.plain)
+            result = subprocess.run(
+                (sys.executable, '-m', 'cipher21.application', '-e', '-k', 'env:KEY',
+                 '-i', plain_path, '-o', plain_path + '.c21', '--buffer-size', str(M),
+                 '--progress', '0.000001', '--stats', 'json:' + stats_path),
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, cwd=self.PROJECT_DIR
+            )
+            self.assertEqual(0, result.returncode, result.stderr)
+            progress = [line for line in result.stderr.decode().splitlines() if 'progress:' in line]
+            self.assertGreaterEqual(len(progress), 5)
+            self.assertIn('{:,} B read'.format(len(self.plain)), progress[-1])
+            with open(stats_path) as f:
+                report = json.load(f)
+            self.assertFalse(report['mapped'])
+            self.assertEqual(len(self.plain), report['bytes_in'])
+            self.assertEqual(os.path.getsize(plain_path + '.c21'), report['bytes_out'])
+            self.assertGreater(report['read_calls'], 5)
@@ -0,0 +1,105 @@
+from unittest import TestCase
+from unittest.mock import patch
+from random import Random
+from io import BytesIO
+from tempfile import TemporaryFile
+import argparse
+import os
+
+from cipher21 import blocking_io
+from cipher21.verifier import verify_stream, verify_file, is_mappable
+from cipher21.null_stream import NullStream
+from cipher21.buffer_pool import SecureBufferPool
+from cipher21.constants import *
+from cipher21.decrypter import StaleStreamError
+from cipher21.arguments_parser import ArgumentsParser
+
+
+class VerifierTest(TestCase):
+
+    S = SEGMENT_PAYLOAD_LENGTH
+    TEST_SIZES = (0, 1, M - 58, M - 57, 3*M + 5, S - 1, S, S + 1, 2*S + 12345)
+    ATTRIBUTES = ('stream_timestamp_ns', 'payload_length', 'padding_length', 'mac')
+
+    def setUp(self) -> None:
+        self.prng = Random()  # For test repetitiveness purpose only. Use SystemRandom ordinarily.
+        self.prng.seed(0x4B8D2E6F1A3C5E7092B4D6F8A0C2E4F6, version=2)
+        self.key = bytes(self.prng.getrandbits(8) for _ in range(KEY_LENGTH))
+
+    def encrypt(self, size: int, version: int) -> bytes:
+        stream = BytesIO()
+        plain = self.prng.getrandbits(8 * size).to_bytes(size, 'little')
+        blocking_io.encrypt_stream(stream, BytesIO(plain), self.key, version=version)
+        return stream.getvalue()
+
+    def get_attributes(self, attrs) -> tuple:
+        return tuple(getattr(attrs, name) for name in self.ATTRIBUTES)
+
+    def verify_all(self, stream: bytes, **kwargs) -> list:
+        """Returns the attributes or the errors of the decryption and all the verification paths."""
+        results = []
+        calls = (
+            lambda f: blocking_io.decrypt_stream(NullStream(), f, self.key, **kwargs),
+            lambda f: verify_stream(f, self.key, **kwargs),
+            lambda f: verify_stream(f, self.key, 2*M, 2, SecureBufferPool(), **kwargs),
+            lambda f: verify_file(f, self.key, **kwargs),
+        )
+        for call in calls:
+            with TemporaryFile() as f:
+                f.write(stream)
+                f.seek(0)
+                try:
+                    results.append(self.get_attributes(call(f)))
+                except ValueError as e:
+                    results.append(str(e))
+        return results
+
+    def test_same_as_decryption(self):
+        for version in (1, 2):
+            for size in self.TEST_SIZES:
+                with self.subTest(version=version, size=size):
+                    results = self.verify_all(self.encrypt(size, version))
+                    self.assertEqual(size, results[0][1])
+                    self.assertEqual(results[:1] * len(results), results)
+
+    def test_forgeries(self):
+        for version in (1, 2):
+            stream = self.encrypt(2*self.S + 12345, version)
+            header_length = STREAM_V2_HEADER_LENGTH if version == 2 else STREAM_HEADER_LENGTH
+            for position in (TIMESTAMP_OFFSET, header_length, header_length + self.S,
+                             len(stream) - MAC_LENGTH - 1, len(stream) - 1):
+                with self.subTest(version=version, position=position):
+                    forged = bytearray(stream)
+                    forged[position] ^= 0x10
+                    results = self.verify_all(bytes(forged))
+                    self.assertIsInstance(results[0], str)
+                    self.assertEqual(results[:1] * len(results), results)
+            for length in (len(stream) - M, len(stream) - 1, header_length + M):
+                with self.subTest(version=version, length=length):
+                    for result in self.verify_all(stream[:length]):
+                        self.assertIsInstance(result, str)
+
+    def test_after(self):
+        for version in (1, 2):
+            stream = BytesIO(self.encrypt(3*M, version))
+            timestamp_ns = verify_stream(stream, self.key).stream_timestamp_ns
+            for verify in (verify_stream, verify_file):
+                with self.subTest(version=version, verify=verify.__name__), \
+                        TemporaryFile() as f:
+                    f.write(stream.getvalue())
+                    f.seek(0)
+                    with self.assertRaises(StaleStreamError):
+                        verify(f, self.key, after_ns=timestamp_ns)
+                    f.seek(0)
+                    verify(f, self.key, after_ns=timestamp_ns - 1)
+
+    def test_is_mappable(self):
+        self.assertFalse(is_mappable(BytesIO()))
+        self.assertFalse(is_mappable(NullStream()))
+        with TemporaryFile() as f:
+            self.assertTrue(is_mappable(f))
+
+    def test_arguments(self):
+        with patch.dict(os.environ, {'CIPHER21_KEY': self.key.hex()}):
+            with self.assertRaisesRegex(argparse.ArgumentError, '--pipeline'):
+                ArgumentsParser().parse(('-v', '-k', 'env:CIPHER21_KEY', '-p'))